@@ -0,0 +1,71 @@
+"""Роли и маршрутизация заявок.
+
+Админы, получатели уведомлений по типам заявок и ответственные хранятся в базе
+(admins, type_routes, responsible_persons) и меняются командами админов без
+перезапуска. Обработчики читают неизменяемый снимок в памяти: frozenset админов и
+словари только для чтения, поэтому проверка прав и выбор получателей — поиск по
+хешу без обращения к базе. Изменение сначала пишется в базу, затем снимок
+перечитывается целиком и подменяется одним присваиванием: обработчик, уже взявший
+старый снимок, дочитывает его согласованным.
+"""
+from types import MappingProxyType
+from typing import NamedTuple
+
+import database as db
+
+DEFAULT_RESPONSIBLE = 'Дежурный'
+
+
+class Snapshot(NamedTuple):
+    admins: frozenset
+    # тип заявки -> кортеж chat_id; типы без маршрута уходят всем админам
+    routes: MappingProxyType
+    # тип заявки -> контакт ответственного, в порядке добавления
+    responsible: MappingProxyType
+
+
+EMPTY = Snapshot(frozenset(), MappingProxyType({}), MappingProxyType({}))
+
+
+def build_snapshot(admins, routes, responsible):
+    """Снимок из строк базы: admins — [telegram_id], routes — [(type, chat_id)],
+    responsible — [(type, contact)]"""
+    by_type = {}
+    for request_type, chat_id in routes:
+        by_type.setdefault(request_type, []).append(chat_id)
+    return Snapshot(
+        admins=frozenset(admins),
+        routes=MappingProxyType({request_type: tuple(ids) for request_type, ids in by_type.items()}),
+        responsible=MappingProxyType(dict(responsible)),
+    )
+
+
+class AccessControl:
+    def __init__(self, bootstrap_admins=()):
+        # Админы из config.ADMIN_IDS попадают в базу, только пока в ней нет ни одного админа
+        self.bootstrap_admins = tuple(bootstrap_admins)
+        self.snapshot = EMPTY
+        self._requested = 0
+        self._applied = 0
+
+    def is_admin(self, telegram_id):
+        return telegram_id in self.snapshot.admins
+
+    def recipients(self, request_type):
+        """Кому отправлять уведомление о новой заявке этого типа"""
+        snapshot = self.snapshot
+        return list(snapshot.routes.get(request_type) or snapshot.admins)
+
+    def responsible(self, request_type):
+        return self.snapshot.responsible.get(request_type, DEFAULT_RESPONSIBLE)
+
+    async def reload(self):
+        """Перечитывает роли и маршруты из базы и подменяет снимок. Если два перечитывания
+        пересеклись, остается снимок того, что запрошено позже"""
+        self._requested += 1
+        number = self._requested
+        rows = await db.load_access(self.bootstrap_admins)
+        if number > self._applied:
+            self._applied = number
+            self.snapshot = build_snapshot(*rows)
+        return self.snapshot
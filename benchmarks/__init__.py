@@ -0,0 +1 @@
+"""Нагрузочные замеры бота. Запускаются из корня репозитория: python -m benchmarks.<имя>"""
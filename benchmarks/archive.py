@@ -0,0 +1,116 @@
+"""Архивация: размер рабочего набора и задержка списков до и после переноса в архив.
+
+Заполняет базу через benchmarks.dataset (почти вся история — давно выполненные
+заявки), замеряет списки, затем переносит выполненные больше --days дней назад
+заявки пачками, как ночная задача бота, запускает run_maintenance и замеряет снова.
+Рабочий набор — страницы таблицы requests и ее индексов (по dbstat): именно их
+читают списки и поиск открытых заявок.
+
+    python -m benchmarks.archive --rows 200000 --days 180
+"""
+import argparse
+import inspect
+import os
+import random
+import time
+
+import database as db
+from benchmarks import dataset
+from benchmarks.common import summarize, temp_database_path
+
+
+def sync(func):
+    return inspect.unwrap(func)
+
+
+def working_set(conn):
+    """(строк в requests, МБ страниц requests и ее индексов, МБ файла базы)"""
+    rows = conn.execute('SELECT COUNT(*) FROM requests').fetchone()[0]
+    pages = conn.execute('''
+        SELECT COUNT(*) FROM dbstat
+        WHERE name = 'requests' OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'requests' AND type = 'index')
+    ''').fetchone()[0]
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    # Иначе часть страниц лежит в -wal и размер файла занижен
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    return rows, pages * page_size / 1024 / 1024, os.path.getsize(path) / 1024 / 1024
+
+
+def cases(users):
+    first_user = 100000
+
+    def random_user(rng):
+        return first_user + int(users * rng.random() ** 1.3)
+
+    return [
+        ('get_user_requests', lambda conn, rng: sync(db.get_user_requests)(conn, random_user(rng))),
+        ('get_user_requests + архив',
+         lambda conn, rng: sync(db.get_user_requests)(conn, random_user(rng), include_archive=True)),
+        ('get_requests_page first', lambda conn, rng: sync(db.get_requests_page)(conn, None)),
+        ('get_requests_page completed', lambda conn, rng: sync(db.get_requests_page)(conn, 'completed')),
+        ('get_requests_page new', lambda conn, rng: sync(db.get_requests_page)(conn, 'new')),
+    ]
+
+
+def measure(conn, users, iterations):
+    rng = random.Random(1)
+    results = {}
+    for name, func in cases(users):
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func(conn, rng)
+            durations.append(time.perf_counter() - started)
+        results[name] = summarize(durations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--days', type=int, default=180, help='архивировать выполненные раньше стольких дней назад')
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    db.init_database(temp_database_path('archive.db'))
+    conn = db._get_connection()
+    users = dataset.seed(conn, args.rows)
+    before_size = working_set(conn)
+    before = measure(conn, users, args.iterations)
+
+    batches = []
+    archived = 0
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        moved = sync(db.archive_completed_requests)(conn, args.days, args.batch)
+        batches.append(time.perf_counter() - batch_started)
+        archived += moved
+        if moved < args.batch:
+            break
+    archive_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    sync(db.run_maintenance)(conn)
+    maintenance_seconds = time.perf_counter() - started
+    after_size = working_set(conn)
+    after = measure(conn, users, args.iterations)
+    db.close_database()
+
+    batch_stats = summarize(batches)
+    print(f"перенесено в архив: {archived} из {args.rows} за {archive_seconds:.1f} с "
+          f"({len(batches)} пачек, p50 {batch_stats['p50_ms']:.1f} мс, max {batch_stats['max_ms']:.1f} мс); "
+          f"обслуживание {maintenance_seconds:.1f} с")
+    print(f"{'':<30} {'до':>12} {'после':>12}")
+    for label, index, unit in (('строк в requests', 0, ''), ('рабочий набор', 1, ' МБ'), ('файл базы', 2, ' МБ')):
+        fmt = '{:>12.0f}' if not unit else '{:>9.1f}' + unit
+        print(f"{label:<30} {fmt.format(before_size[index])} {fmt.format(after_size[index])}")
+    print(f"\n{'список':<30} {'p50 до, мс':>12} {'p50 после':>12} {'p99 до':>10} {'p99 после':>10}")
+    for name in before:
+        print(f"{name:<30} {before[name]['p50_ms']:>12.3f} {after[name]['p50_ms']:>12.3f} "
+              f"{before[name]['p99_ms']:>10.3f} {after[name]['p99_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
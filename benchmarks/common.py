@@ -0,0 +1,40 @@
+import inspect
+import os
+import tempfile
+
+import database as db
+
+
+def percentile(values, p):
+    """Перцентиль p (0..100) по отсортированной копии values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    """p50/p99/max в миллисекундах для списка длительностей в секундах"""
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values, default=0.0) * 1000, 3),
+    }
+
+
+def temp_database_path(name='bench.db'):
+    """Путь к базе во временном каталоге, чтобы не трогать data/database.db"""
+    return os.path.join(tempfile.mkdtemp(prefix='miit_bench_'), name)
+
+
+def only_admins(admin_ids):
+    """Роли в открытой базе для прогона: админы — только admin_ids, маршрутов по типам нет,
+    так что уведомления о всех заявках получают они. Снимок бота потом — ACCESS.reload()"""
+    conn = db._get_connection()
+    with conn:
+        conn.execute('DELETE FROM admins')
+        conn.execute('DELETE FROM type_routes')
+    for admin_id in admin_ids:
+        inspect.unwrap(db.set_admin)(conn, admin_id)
@@ -0,0 +1,76 @@
+"""Синтетическая история заявок для замеров.
+
+Распределения приближены к реальной работе службы: электрика и техника ломаются
+чаще сантехники, небольшая доля аудиторий даёт большую часть заявок, а почти вся
+история — давно выполненные заявки, и только хвост последних дней ещё открыт.
+"""
+import datetime
+import random
+
+from rooms import room_key
+
+TYPES = ["🪑 Мебель", "💡 Электрика", "🚰 Сантехника", "🧹 Уборка", "🖥️ Техника", "❓ Другое"]
+TYPE_WEIGHTS = [20, 25, 10, 15, 25, 5]
+
+DESCRIPTIONS = [
+    "Не работает проектор", "Мигает свет над доской", "Сломан стул у окна",
+    "Протекает кран в коридоре", "Нужна уборка после мероприятия", "Не включается компьютер преподавателя",
+    "Не закрывается окно", "Нет звука в колонках", "Разбита розетка у двери",
+    "Принтер HP1020 не берет бумагу A4",
+]
+
+START = datetime.datetime(2022, 9, 1)
+
+
+def rooms(count=300):
+    return [f"{floor}{number:02d}" for floor in range(1, 10) for number in range(1, 40)][:count]
+
+
+def seed(conn, requests_count, users_count=None, days=3 * 365, open_fraction=0.05, rng_seed=42):
+    """Заполняет users, реестр аудиторий и requests. Возвращает число созданных пользователей"""
+    rng = random.Random(rng_seed)
+    users_count = users_count or max(10, requests_count // 20)
+    room_list = rooms()
+    # Закон Ципфа: k-я по популярности аудитория получает ~1/k заявок
+    room_weights = [1 / (k + 1) for k in range(len(room_list))]
+
+    with conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO users (telegram_id, full_name, username) VALUES (?, ?, ?)',
+            ((100000 + i, f"Студент {i}", f"student{i}") for i in range(users_count)),
+        )
+        first_user_id = conn.execute('SELECT MIN(id) FROM users WHERE telegram_id >= 100000').fetchone()[0]
+        room_ids = {}
+        for room in room_list:
+            room_ids[room] = conn.execute('INSERT INTO rooms (name) VALUES (?)', (room,)).lastrowid
+            conn.execute('INSERT INTO room_aliases (alias, room_id) VALUES (?, ?)', (room_key(room), room_ids[room]))
+
+        step = days * 86400 / requests_count
+        open_after = int(requests_count * (1 - open_fraction))
+
+        def rows():
+            types = rng.choices(TYPES, TYPE_WEIGHTS, k=requests_count)
+            chosen_rooms = rng.choices(room_list, room_weights, k=requests_count)
+            for i in range(requests_count):
+                created = START + datetime.timedelta(seconds=i * step)
+                if i < open_after:
+                    status = 'completed'
+                    completed = created + datetime.timedelta(hours=rng.lognormvariate(2.5, 1.0))
+                else:
+                    status = rng.choice(('new', 'in_progress'))
+                    completed = None
+                yield (
+                    first_user_id + int(users_count * rng.random() ** 1.3),
+                    types[i], chosen_rooms[i], room_key(chosen_rooms[i]), room_ids[chosen_rooms[i]],
+                    rng.choice(DESCRIPTIONS), None, status,
+                    created.strftime('%Y-%m-%d %H:%M:%S'),
+                    completed.strftime('%Y-%m-%d %H:%M:%S') if completed else None,
+                )
+
+        conn.executemany(
+            'INSERT INTO requests (user_id, type, room, room_key, room_id, description, photo_id, status, created_at, '
+            'completed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows(),
+        )
+    conn.execute('ANALYZE')
+    return users_count
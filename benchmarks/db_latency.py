@@ -0,0 +1,145 @@
+"""Задержка обработчиков: старый connect-per-call против общего WAL-соединения.
+
+Каждый "чат" проходит путь обработчиков бота: /start (add_user), создание заявки
+(get_user_by_telegram_id + create_request) и нажатие админом кнопки статуса
+(transition_request_status; старая версия после обновления отдельно читала заявку).
+Все чаты работают в одном цикле событий, как в боте, и присылают каждый шаг одновременно.
+
+    python -m benchmarks.db_latency --chats 50 --rounds 20
+"""
+import argparse
+import asyncio
+import sqlite3
+import time
+
+import database as db
+from benchmarks.common import summarize, temp_database_path
+
+
+class LegacyDatabase:
+    """Копия прежнего database.py: соединение на каждый вызов, синхронно в цикле событий"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def add_user(self, telegram_id, full_name, username=None, role='user'):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO users (telegram_id, full_name, username, role) VALUES (?, ?, ?, ?)',
+                       (telegram_id, full_name, username, role))
+        conn.commit()
+        conn.close()
+
+    def create_request(self, user_id, request_type, room, description, photo_id=None):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO requests (user_id, type, room, description, photo_id) VALUES (?, ?, ?, ?, ?)',
+                       (user_id, request_type, room, description, photo_id))
+        request_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return request_id
+
+    def get_user_by_telegram_id(self, telegram_id):
+        conn = sqlite3.connect(self.path)
+        user = conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+        conn.close()
+        return user
+
+    def get_request_by_id(self, request_id):
+        conn = sqlite3.connect(self.path)
+        request = conn.execute('''
+            SELECT r.id, r.user_id, r.type, r.room, r.description,
+                   r.photo_id, r.status, r.created_at, r.assigned_to, r.completed_at,
+                   u.telegram_id, u.full_name
+            FROM requests r JOIN users u ON r.user_id = u.id WHERE r.id = ?
+        ''', (request_id,)).fetchone()
+        conn.close()
+        return request
+
+    def transition_request_status(self, request_id, status):
+        # Старая версия переход не проверяла; в сценарии переходы всегда допустимы
+        conn = sqlite3.connect(self.path)
+        if status == 'completed':
+            conn.execute('UPDATE requests SET status = ?, completed_at = CURRENT_TIMESTAMP WHERE id = ?', (status, request_id))
+        else:
+            conn.execute('UPDATE requests SET status = ? WHERE id = ?', (status, request_id))
+        conn.commit()
+        conn.close()
+        return self.get_request_by_id(request_id)
+
+
+async def call(backend, name, *args, **kwargs):
+    result = getattr(backend, name)(*args, **kwargs)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+async def run(backend, chats, rounds):
+    """Каждый шаг сценария приходит от всех чатов одновременно (всплеск).
+    Задержка считается от прихода всплеска до завершения обработчика конкретного чата,
+    поэтому время, пока обработчик ждет занятый цикл событий, тоже учитывается."""
+    telegram_ids = [1000 + i for i in range(chats)]
+    latencies = []
+
+    async def timed(arrived, coro):
+        result = await coro
+        latencies.append(time.perf_counter() - arrived)
+        return result
+
+    async def burst(handler, *columns):
+        arrived = time.perf_counter()
+        return await asyncio.gather(*(timed(arrived, handler(*args)) for args in zip(*columns)))
+
+    async def start(telegram_id):
+        await call(backend, 'add_user', telegram_id=telegram_id, full_name=f'Студент {telegram_id}')
+
+    async def submit(telegram_id):
+        user = await call(backend, 'get_user_by_telegram_id', telegram_id)
+        # Своя аудитория у каждого чата, чтобы заявки не объединялись в дубли
+        result = await call(backend, 'create_request', user_id=user[0], request_type='💡 Электрика',
+                            room=str(telegram_id), description='Не работает проектор')
+        # database.create_request возвращает кортеж, начинающийся с id, старая версия — только id
+        return result[0] if isinstance(result, tuple) else result
+
+    async def click(request_id, status):
+        await call(backend, 'transition_request_status', request_id, status)
+
+    started = time.perf_counter()
+    await burst(start, telegram_ids)
+    for _ in range(rounds):
+        request_ids = await burst(submit, telegram_ids)
+        await burst(click, request_ids, ['in_progress'] * chats)
+        await burst(click, request_ids, ['completed'] * chats)
+    elapsed = time.perf_counter() - started
+    return summarize(latencies), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    # Схема одна и та же; у старой реализации журнал по умолчанию (DELETE), у новой WAL
+    legacy_path = temp_database_path('legacy.db')
+    db.init_database(legacy_path)
+    db.close_database()
+    conn = sqlite3.connect(legacy_path)
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+    legacy = asyncio.run(run(LegacyDatabase(legacy_path), args.chats, args.rounds))
+
+    db.init_database(temp_database_path('shared.db'))
+    shared = asyncio.run(run(db, args.chats, args.rounds))
+    db.close_database()
+
+    print(f"{'реализация':<18}{'вызовов':>9}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'всего, с':>10}")
+    for name, (stats, elapsed) in (('connect-per-call', legacy), ('общее WAL', shared)):
+        print(f"{name:<18}{stats['count']:>9}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}{elapsed:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
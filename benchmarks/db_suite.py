@@ -0,0 +1,174 @@
+"""Микробенчмарки функций database.py на синтетической истории заявок.
+
+Для каждого размера (по умолчанию 10k, 100k и 1M заявок) создает свежую базу
+через benchmarks.dataset, вызывает синхронные функции database.py напрямую (без
+потока базы — меряется только SQLite) со случайными аргументами и сохраняет
+p50/p99/среднее в JSON с хэшем коммита. Два таких файла сравниваются через
+--compare, так что регрессию видно до выкладки.
+
+    python -m benchmarks.db_suite --sizes 10000 100000 1000000
+    python -m benchmarks.db_suite --sizes 100000 --compare benchmarks/results/db_suite_4368fba.json
+"""
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+
+import database as db
+from benchmarks import dataset
+from benchmarks.common import summarize, temp_database_path
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def sync(func):
+    """Синхронная функция под @_threaded: вызывается с соединением первым аргументом"""
+    return inspect.unwrap(func)
+
+
+def cases(rows, users):
+    """(имя, функция(conn, rng)) — аргументы выбираются случайно, как у живых пользователей"""
+    first_user = 100000
+
+    def random_user(rng):
+        return first_user + int(users * rng.random() ** 1.3)
+
+    def open_request(rng):
+        # Открыты последние ~5% заявок (см. dataset.seed)
+        return rng.randint(int(rows * 0.95) + 1, rows)
+
+    def transition_status(conn, rng):
+        sync(db.transition_request_status)(conn, open_request(rng), rng.choice(('in_progress', 'completed')),
+                                           notify_as='Бенчмарк')
+
+    return [
+        ('add_user (существующий)',
+         lambda conn, rng: sync(db.add_user)(conn, random_user(rng), 'Студент')),
+        ('get_user_by_telegram_id',
+         lambda conn, rng: sync(db.get_user_by_telegram_id)(conn, random_user(rng))),
+        ('get_user_requests',
+         lambda conn, rng: sync(db.get_user_requests)(conn, random_user(rng))),
+        ('get_requests_page new',
+         lambda conn, rng: sync(db.get_requests_page)(conn, 'new')),
+        ('get_requests_page first',
+         lambda conn, rng: sync(db.get_requests_page)(conn, None)),
+        ('get_requests_page deep',
+         lambda conn, rng: sync(db.get_requests_page)(conn, 'completed', rng.randint(1, rows), 'older')),
+        ('get_stats',
+         lambda conn, rng: sync(db.get_stats)(conn)),
+        ('find_room',
+         lambda conn, rng: sync(db.find_room)(conn, f"ауд. {rng.choice(dataset.rooms())}")),
+        ('get_room_history',
+         lambda conn, rng: sync(db.get_room_history)(conn, rng.randint(1, len(dataset.rooms())))),
+        ('get_hotspots 30 дней',
+         lambda conn, rng: sync(db.get_hotspots)(conn, 30)),
+        ('create_request',
+         lambda conn, rng: sync(db.create_request)(conn, 1 + int(users * rng.random()), rng.choice(dataset.TYPES),
+                                                   rng.choice(dataset.rooms()), "Не работает проектор")),
+        ('transition_request_status', transition_status),
+        ('get_due_outbox',
+         lambda conn, rng: sync(db.get_due_outbox)(conn)),
+    ]
+
+
+def measure(conn, func, iterations, budget, rng):
+    """Вызывает func до iterations раз, но не дольше budget секунд (минимум 3 раза)"""
+    durations = []
+    deadline = time.perf_counter() + budget
+    while len(durations) < iterations and (len(durations) < 3 or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        func(conn, rng)
+        durations.append(time.perf_counter() - started)
+    result = summarize(durations)
+    result['mean_ms'] = round(sum(durations) / len(durations) * 1000, 3)
+    return result
+
+
+def run_size(rows, iterations, budget):
+    db.init_database(temp_database_path(f'suite_{rows}.db'))
+    conn = db._get_connection()
+    started = time.perf_counter()
+    users = dataset.seed(conn, rows)
+    seeded = time.perf_counter() - started
+    # Только что записанные страницы лежат в -wal: переносим их в основной файл перед замером
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    size_bytes = os.path.getsize(conn.execute('PRAGMA database_list').fetchone()[2])
+
+    rng = random.Random(rows)
+    results = {}
+    for name, func in cases(rows, users):
+        results[name] = measure(conn, func, iterations, budget, rng)
+    db.close_database()
+    return {'rows': rows, 'users': users, 'seed_seconds': round(seeded, 1), 'db_bytes': size_bytes,
+            'cases': results}
+
+
+def commit_id():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report, baseline=None):
+    base_sizes = {size['rows']: size for size in (baseline or {}).get('sizes', [])}
+    for size in report['sizes']:
+        print(f"\n🗄️ {size['rows']} заявок, {size['users']} пользователей, "
+              f"{size['db_bytes'] / 1024 / 1024:.1f} МБ (заполнение {size['seed_seconds']} с)")
+        header = f"{'функция':<36} {'p50, мс':>9} {'p99, мс':>9} {'сред., мс':>10}"
+        if size['rows'] in base_sizes:
+            header += f" {'было p50':>9} {'Δ':>7}"
+        print(header)
+        for name, result in size['cases'].items():
+            line = f"{name:<36} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['mean_ms']:>10.3f}"
+            before = base_sizes.get(size['rows'], {}).get('cases', {}).get(name)
+            if before:
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] if before['p50_ms'] else 0.0
+                line += f" {before['p50_ms']:>9.3f} {change:>+7.0%}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--budget', type=float, default=3.0, help='секунд на одну функцию')
+    parser.add_argument('--output', help=f'куда записать JSON (по умолчанию {RESULTS_DIR}/db_suite_<коммит>.json)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    commit = commit_id()
+    report = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'sizes': [run_size(rows, args.iterations, args.budget) for rows in args.sizes],
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"сравнение с {baseline['commit']} от {baseline['date']}")
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'db_suite_{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nрезультаты: {output}")
+
+
+if __name__ == '__main__':
+    main()
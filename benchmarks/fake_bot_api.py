@@ -0,0 +1,223 @@
+"""Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Понимает то, чем пользуется бот: getMe, getUpdates (long-poll) и setWebhook /
+deleteWebhook, sendMessage, sendPhoto, sendMediaGroup, editMessageText, answerCallbackQuery;
+остальные методы отвечают true. Обновления в бот кладет сценарий через
+deliver(): они уходят в очередь getUpdates или, если бот зарегистрировал
+webhook, POST-запросом на его адрес с секретным заголовком.
+
+Задержка каждого ответа — latency * (0.5..1.5) секунд. С вероятностью
+error_rate методы из error_methods отвечают 429 (retry after 1) или 502 —
+так проверяется, как бот переживает flood wait и сбои сети. editMessageText
+для сообщения с фото отвечает 400, как настоящий Telegram.
+
+Отдельно (бот запускается с base_url=http://127.0.0.1:8081):
+
+    python -m benchmarks.fake_bot_api --port 8081 --latency-ms 50 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+SEND_METHODS = ('sendMessage', 'sendPhoto', 'sendMediaGroup', 'editMessageText')
+# Параметры, которые python-telegram-bot передает в JSON; строки (text, caption) — как есть
+JSON_PARAMS = {'chat_id', 'message_id', 'offset', 'limit', 'timeout', 'reply_markup', 'reply_parameters', 'media',
+               'allowed_updates'}
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Заявки', 'username': 'fake_repair_bot'}
+
+
+def _decode(name, value):
+    text = value.decode()
+    if name in JSON_PARAMS:
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    return text
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, error_rate=0.0, error_methods=SEND_METHODS, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_methods = set(error_methods)
+        self.random = random.Random(seed)
+        self.updates = asyncio.Queue()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.messages = {}
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = Counter()
+        self.injected = Counter()
+        # Вызывается на каждое сообщение бота: on_message(method, message)
+        self.on_message = None
+        self._client = None
+
+    # --- что видит сценарий ---
+
+    async def deliver(self, update):
+        """Отдает обновление боту; update_id проставляется здесь"""
+        update = dict(update, update_id=next(self.update_ids))
+        if self.webhook_url:
+            if self._client is None:
+                self._client = httpx.AsyncClient()
+            headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret or ''}
+            await self._client.post(self.webhook_url, json=update, headers=headers)
+        else:
+            await self.updates.put(update)
+        return update['update_id']
+
+    async def close(self):
+        """Отпускает висящий long-poll getUpdates и закрывает клиент webhook"""
+        await self.updates.put(None)
+        await asyncio.sleep(0.05)
+        if self._client is not None:
+            await self._client.aclose()
+
+    # --- методы Bot API ---
+
+    def _message(self, params, **fields):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **fields,
+        }
+        # Как и настоящий Telegram, в сообщении возвращается только inline-клавиатура
+        if 'inline_keyboard' in (params.get('reply_markup') or {}):
+            message['reply_markup'] = params['reply_markup']
+        self.messages[(chat_id, message['message_id'])] = message
+        return message
+
+    async def call(self, method, params):
+        """(HTTP-код, тело ответа) для вызова метода"""
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (0.5 + self.random.random()))
+        if method in self.error_methods and self.random.random() < self.error_rate:
+            if self.random.random() < 0.5:
+                self.injected['429'] += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+            self.injected['502'] += 1
+            return 502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': await self._get_updates(params)}
+        if method == 'setWebhook':
+            self.webhook_url = params['url']
+            self.webhook_secret = params.get('secret_token')
+            return 200, {'ok': True, 'result': True}
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return 200, {'ok': True, 'result': True}
+        if method == 'sendMessage':
+            message = self._message(params, text=params['text'])
+        elif method == 'sendPhoto':
+            photo = {'file_id': str(params['photo']), 'file_unique_id': 'u', 'width': 1280, 'height': 960}
+            message = self._message(params, photo=[photo], caption=params.get('caption', ''))
+        elif method == 'sendMediaGroup':
+            group = str(next(self.message_ids))
+            album = [self._message(params, photo=[{'file_id': str(item['media']), 'file_unique_id': 'u',
+                                                   'width': 1280, 'height': 960}], media_group_id=group)
+                     for item in params['media']]
+            if self.on_message:
+                for message in album:
+                    self.on_message(method, message)
+            return 200, {'ok': True, 'result': album}
+        elif method == 'editMessageText':
+            message = self.messages.get((params.get('chat_id'), params.get('message_id')))
+            if message is None:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+            if 'text' not in message:
+                return 400, {'ok': False, 'error_code': 400,
+                             'description': 'Bad Request: there is no text in the message to edit'}
+            message['text'] = params['text']
+            message['edit_date'] = int(time.time())
+            if 'reply_markup' in params:
+                message['reply_markup'] = params['reply_markup']
+            else:
+                message.pop('reply_markup', None)
+        else:
+            return 200, {'ok': True, 'result': True}
+
+        if self.on_message:
+            self.on_message(method, message)
+        return 200, {'ok': True, 'result': message}
+
+    async def _get_updates(self, params):
+        timeout = params.get('timeout', 0)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        if first is None:
+            return []
+        batch = [first]
+        limit = params.get('limit', 100)
+        while len(batch) < limit and not self.updates.empty() and self.updates._queue[0] is not None:
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    # --- HTTP ---
+
+    def make_app(self):
+        return tornado.web.Application([(r'/bot[^/]+/(\w+)', _MethodHandler, {'api': self})])
+
+    def listen(self, port, address='127.0.0.1'):
+        server = HTTPServer(self.make_app())
+        server.listen(port, address=address)
+        return server
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, method):
+        params = {name: _decode(name, values[-1]) for name, values in self.request.body_arguments.items()}
+        for name, files in self.request.files.items():
+            params[name] = files[0].filename
+        status, body = await self.api.call(method, params)
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(body, ensure_ascii=False))
+
+    get = post
+
+
+async def serve(port, latency, error_rate):
+    api = FakeBotAPI(latency=latency, error_rate=error_rate)
+    api.listen(port)
+    print(f"фейковый Bot API на http://127.0.0.1:{port}, задержка {latency * 1000:.0f} мс, "
+          f"ошибки {error_rate:.0%}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms / 1000, args.error_rate))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""Сквозной нагрузочный тест: N студентов подают заявки, админы меняют статусы.
+
+Бот собирается как в проде (bot.build_application) и получает обновления через
+getUpdates от локального фейкового Bot API (benchmarks.fake_bot_api) с заданной
+задержкой и долей ошибок. Фейковый API и сценарий работают в отдельном потоке
+со своим циклом событий, чтобы не отнимать время у бота.
+
+Каждый студент проходит весь диалог: /start → "📝 Подать заявку" → тип →
+аудитория → описание → фото (или "Без фото"; с --album-size больше 1 — альбом,
+который бот собирает ALBUM_COLLECT_DELAY секунд). Админ, получив уведомление о
+заявке, нажимает "🛠️ В работу", затем "✅ Выполнено"; автор ждет уведомления о
+каждом статусе. Задержка этапа — от отправки обновления до ответа бота в этот
+чат; этапы notify:* и user:* — доставка через outbox.
+
+    python -m benchmarks.load_test --users 200 --ramp 5 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+import bot
+import database as db
+import log
+from benchmarks.common import only_admins, summarize, temp_database_path
+from benchmarks.fake_bot_api import FakeBotAPI
+
+USER_BASE = 100000
+ADMIN_BASE = 900
+STATUS_MARKERS = {'in_progress': 'взята в работу', 'completed': 'выполнена'}
+NEW_MESSAGE = ('sendMessage', 'sendPhoto')
+
+
+class StageTimeout(Exception):
+    pass
+
+
+class Scenario:
+    def __init__(self, api, users, admins, ramp, photo_share, album_size, timeout, seed=7):
+        self.api = api
+        self.users = users
+        self.admin_ids = [ADMIN_BASE + i for i in range(admins)]
+        self.ramp = ramp
+        self.photo_share = photo_share
+        self.album_size = album_size
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.latencies = defaultdict(list)
+        self.timeouts = Counter()
+        self.waiters = defaultdict(list)
+        self.created = {}
+        self.owners = {}
+        self.claimed = set()
+        self.admin_tasks = []
+        self.finished_flows = 0
+        api.on_message = self.observe
+
+    # --- наблюдение за ответами бота ---
+
+    def observe(self, method, message):
+        now = time.perf_counter()
+        chat_id = message['chat']['id']
+        for waiter in self.waiters[chat_id]:
+            predicate, future = waiter
+            if not future.done() and predicate(method, message):
+                future.set_result((now, message))
+                self.waiters[chat_id].remove(waiter)
+                break
+        if chat_id in self.admin_ids and method in NEW_MESSAGE:
+            for row in (message.get('reply_markup') or {}).get('inline_keyboard', []):
+                for button in row:
+                    data = button.get('callback_data', '')
+                    if data.startswith('status_in_progress_'):
+                        request_id = int(data.rsplit('_', 1)[1])
+                        if request_id not in self.claimed:
+                            self.claimed.add(request_id)
+                            self.admin_tasks.append(asyncio.ensure_future(
+                                self.admin_flow(chat_id, request_id, message, now)))
+
+    def expect(self, chat_id, predicate):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id].append((predicate, future))
+        return future
+
+    async def wait(self, stage, future, started):
+        try:
+            finished, message = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[stage] += 1
+            raise StageTimeout(stage)
+        self.latencies[stage].append(finished - started)
+        return finished, message
+
+    async def step(self, stage, chat_id, update, predicate=lambda method, message: method in NEW_MESSAGE):
+        future = self.expect(chat_id, predicate)
+        started = time.perf_counter()
+        for one in (update if isinstance(update, list) else [update]):
+            await self.api.deliver(one)
+        return await self.wait(stage, future, started)
+
+    def owner(self, request_id):
+        if request_id not in self.owners:
+            self.owners[request_id] = asyncio.get_running_loop().create_future()
+        return self.owners[request_id]
+
+    # --- обновления ---
+
+    @staticmethod
+    def person(chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': 'Студент', 'last_name': str(chat_id)}
+
+    def message(self, chat_id, **fields):
+        return {'message': {'message_id': next(self.ids), 'date': int(time.time()),
+                            'chat': {'id': chat_id, 'type': 'private'}, 'from': self.person(chat_id), **fields}}
+
+    def text(self, chat_id, text):
+        if text.startswith('/'):
+            return self.message(chat_id, text=text,
+                                entities=[{'type': 'bot_command', 'offset': 0, 'length': len(text)}])
+        return self.message(chat_id, text=text)
+
+    def callback(self, chat_id, message, data):
+        return {'callback_query': {'id': str(next(self.ids)), 'from': self.person(chat_id), 'message': message,
+                                   'chat_instance': str(chat_id), 'data': data}}
+
+    # --- сценарии ---
+
+    async def user_flow(self, chat_id):
+        await asyncio.sleep(self.random.random() * self.ramp)
+        with_photo = self.random.random() < self.photo_share
+        try:
+            await self.step('start', chat_id, self.text(chat_id, '/start'))
+            await self.step('submit', chat_id, self.text(chat_id, "📝 Подать заявку"))
+            await self.step('type', chat_id, self.text(chat_id, self.random.choice(bot.REQUEST_TYPES)))
+            await self.step('room', chat_id, self.text(chat_id, str(self.random.randint(100, 599))))
+            await self.step('description', chat_id, self.text(chat_id, f"Не работает проектор, чат {chat_id}"))
+            if with_photo:
+                await self.step('photo_choice', chat_id, self.text(chat_id, "📷 Прикрепить фото"))
+                album = {'media_group_id': f'album-{chat_id}'} if self.album_size > 1 else {}
+                updates = [self.message(chat_id, photo=[{'file_id': f'photo-{chat_id}-{i}', 'file_unique_id': f'u{chat_id}-{i}',
+                                                         'width': 1280, 'height': 960}], **album)
+                           for i in range(self.album_size)]
+                finished, reply = await self.step('photo', chat_id, updates)
+            else:
+                finished, reply = await self.step('no_photo', chat_id, self.text(chat_id, "📋 Без фото"))
+        except StageTimeout:
+            return
+        request_id = int(re.search(r'#(\d+)', reply['text']).group(1))
+        self.created[request_id] = finished
+        self.owner(request_id).set_result(chat_id)
+
+    async def admin_flow(self, admin_id, request_id, message, notified_at):
+        try:
+            user_chat = await asyncio.wait_for(self.owner(request_id), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts['notify:admin'] += 1
+            return
+        self.latencies['notify:admin'].append(max(0.0, notified_at - self.created[request_id]))
+
+        try:
+            for status in ('in_progress', 'completed'):
+                marker = f"#{request_id} {STATUS_MARKERS[status]}"
+
+                def matches(method, sent):
+                    return marker in (sent.get('text') or sent.get('caption') or '')
+
+                user_notified = self.expect(user_chat, matches)
+                started = time.perf_counter()
+                _, message = await self.step(f'admin:{status}', admin_id,
+                                             self.callback(admin_id, message, f'status_{status}_{request_id}'),
+                                             matches)
+                await self.wait(f'user:{status}', user_notified, started)
+            self.finished_flows += 1
+        except StageTimeout:
+            pass
+
+    async def run(self):
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user_flow(USER_BASE + i) for i in range(self.users)))
+        # Уведомление о последних заявках могло еще не дойти до админов
+        deadline = time.perf_counter() + self.timeout
+        while set(self.created) - self.claimed and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        while self.admin_tasks:
+            tasks, self.admin_tasks = self.admin_tasks, []
+            await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+class ApiThread(threading.Thread):
+    """Фейковый Bot API и сценарий в отдельном потоке со своим циклом событий"""
+
+    def __init__(self, port, latency, error_rate, scenario_args):
+        super().__init__(daemon=True)
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.scenario_args = scenario_args
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.bot_stopped = threading.Event()
+        self.api = None
+        self.scenario = None
+        self.elapsed = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.api = FakeBotAPI(latency=self.latency, error_rate=self.error_rate)
+        server = self.api.listen(self.port)
+        self.scenario = Scenario(self.api, **self.scenario_args)
+        self.ready.set()
+        # Ждем, пока бот начнет опрашивать getUpdates
+        while not self.api.calls['getUpdates']:
+            await asyncio.sleep(0.01)
+        try:
+            self.elapsed = await self.scenario.run()
+        finally:
+            self.done.set()
+            await asyncio.to_thread(self.bot_stopped.wait)
+            await self.api.close()
+            server.stop()
+
+
+async def run_bot(thread):
+    application = bot.build_application(token='1:fake', mode='polling', base_url=f'http://127.0.0.1:{thread.port}')
+    async with application:
+        await bot.ACCESS.reload()
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=5)
+        await asyncio.to_thread(thread.done.wait)
+        thread.bot_stopped.set()
+        await application.updater.stop()
+        await application.stop()
+    await bot.USER_STATES.flush()
+    thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--ramp', type=float, default=5.0, help='за сколько секунд приходят все студенты')
+    parser.add_argument('--photo-share', type=float, default=0.3)
+    parser.add_argument('--album-size', type=int, default=1, help='сколько фото в заявке с фото')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help='сколько ждать ответа на одном этапе')
+    parser.add_argument('--port', type=int, default=18081)
+    args = parser.parse_args()
+
+    log.setup(level='WARNING')
+    # Внесенные ошибки фейковый API и так посчитает; журнал доступа tornado только мешает
+    logging.getLogger('tornado.access').disabled = True
+    db.init_database(temp_database_path('load_test.db'))
+    # Все уведомления идут фейковым админам
+    only_admins([ADMIN_BASE + i for i in range(args.admins)])
+
+    thread = ApiThread(args.port, args.latency_ms / 1000, args.error_rate, {
+        'users': args.users, 'admins': args.admins, 'ramp': args.ramp,
+        'photo_share': args.photo_share, 'album_size': args.album_size, 'timeout': args.timeout,
+    })
+    thread.start()
+    thread.ready.wait()
+    asyncio.run(run_bot(thread))
+    db.close_database()
+
+    scenario, api = thread.scenario, thread.api
+    print(f"студентов: {args.users}, админов: {args.admins}, задержка API {args.latency_ms:.0f} мс, "
+          f"ошибки {args.error_rate:.0%} (внесено: {dict(api.injected) or 'нет'})")
+    print(f"полных циклов (заявка → выполнена → автор уведомлен): {scenario.finished_flows} "
+          f"за {thread.elapsed:.1f} с ({scenario.finished_flows / thread.elapsed:.1f}/с)")
+    print(f"{'этап':<22} {'n':>5} {'p50, мс':>10} {'p99, мс':>10} {'max, мс':>10} {'таймаутов':>10}")
+    stages = list(scenario.latencies) + [stage for stage in scenario.timeouts if stage not in scenario.latencies]
+    for stage in stages:
+        stats = summarize(scenario.latencies.get(stage, []))
+        print(f"{stage:<22} {stats['count']:>5} {stats['p50_ms']:>10.1f} {stats['p99_ms']:>10.1f} "
+              f"{stats['max_ms']:>10.1f} {scenario.timeouts[stage]:>10}")
+    print("вызовы API:", ', '.join(f"{method} {count}" for method, count in api.calls.most_common()))
+
+
+if __name__ == '__main__':
+    main()
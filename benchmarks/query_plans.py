@@ -0,0 +1,77 @@
+"""Проверка планов запросов на синтетической таблице заявок.
+
+Вызывает функции database.py на базе из миллиона заявок, перехватывает выполненный
+SQL и прогоняет его через EXPLAIN QUERY PLAN. Запрос считается регрессией, если
+requests читается полным сканом или результат сортируется во временном B-дереве.
+Код выхода 1 при любой регрессии — скрипт можно ставить в CI.
+
+    python -m benchmarks.query_plans --rows 1000000
+"""
+import argparse
+import inspect
+import sys
+import time
+
+import database as db
+from benchmarks import dataset
+from benchmarks.common import temp_database_path
+
+FORBIDDEN = ('SCAN r', 'SCAN requests', 'USE TEMP B-TREE')
+
+
+def cases(rows):
+    """(имя, функция database.py, аргументы) для проверки"""
+    middle = rows // 2
+    return [
+        ('get_user_requests', db.get_user_requests, (100007,)),
+        ('get_requests_page new', db.get_requests_page, ('new',)),
+        ('get_requests_page in_progress', db.get_requests_page, ('in_progress',)),
+        ('get_requests_page all', db.get_requests_page, (None, middle, 'older')),
+        ('get_requests_page completed', db.get_requests_page, ('completed', middle, 'older')),
+        ('get_requests_page completed newer', db.get_requests_page, ('completed', middle, 'newer')),
+    ]
+
+
+def traced_plans(conn, func, args):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        started = time.perf_counter()
+        # Синхронная функция под @_threaded (и замером метрик, если он включен)
+        inspect.unwrap(func)(conn, *args)
+        elapsed = time.perf_counter() - started
+    finally:
+        conn.set_trace_callback(None)
+    plans = []
+    for sql in statements:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+        plans.append([row[3] for row in plan])
+    return plans, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    db.init_database(temp_database_path('plans.db'))
+    conn = db._get_connection()
+    started = time.perf_counter()
+    dataset.seed(conn, args.rows)
+    print(f"🗄️ Создано {args.rows} заявок за {time.perf_counter() - started:.1f} с")
+
+    failed = False
+    for name, func, call_args in cases(args.rows):
+        plans, elapsed = traced_plans(conn, func, call_args)
+        details = [line for plan in plans for line in plan]
+        bad = [line for line in details if line.startswith(FORBIDDEN)]
+        failed = failed or bool(bad)
+        print(f"{'❌' if bad else '✅'} {name}: {elapsed * 1000:.1f} мс")
+        for line in details:
+            print(f"    {line}")
+    db.close_database()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
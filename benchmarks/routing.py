@@ -0,0 +1,84 @@
+"""Стоимость маршрутизации одного текстового сообщения: цепочка if/elif против Router.
+
+Синтетический бот с заданным числом кнопок и этапов: у админа и пользователя
+по buttons кнопок, на каждом этапе по три кнопки перехода и свободный текст.
+Прежняя цепочка сравнивает текст с кнопками по очереди, поэтому худший случай —
+свободный текст на последнем этапе (описание проблемы) — проходит ее целиком.
+Router делает фиксированное число обращений к словарю.
+
+    python -m benchmarks.routing --repeat 200000
+"""
+import argparse
+import timeit
+
+from router import ANY, Router
+
+SIZES = ((10, 5), (100, 20), (1000, 100))
+
+
+def handler(*args):
+    return None
+
+
+def build(buttons, stages):
+    admin_buttons = [f"admin-{i}" for i in range(buttons)]
+    user_buttons = [f"user-{i}" for i in range(buttons)]
+    stage_buttons = {f"stage-{s}": [f"stage-{s}-button-{i}" for i in range(3)] for s in range(stages)}
+
+    router = Router(fallback=handler)
+    for text in admin_buttons:
+        router.add(handler, text, role='admin')
+    for text in user_buttons:
+        router.add(handler, text)
+    for stage, texts in stage_buttons.items():
+        for text in texts:
+            router.add(handler, text, stage)
+        router.add(handler, ANY, stage)
+
+    def legacy_resolve(role, stage, text):
+        # Та же логика, что в прежнем handle_message: сравнения по порядку
+        if role == 'admin':
+            for button in admin_buttons:
+                if text == button:
+                    return handler
+        for button in user_buttons:
+            if text == button:
+                return handler
+        if stage is not None:
+            for candidate, texts in stage_buttons.items():
+                if stage == candidate:
+                    for button in texts:
+                        if text == button:
+                            return handler
+                    return handler
+        return handler
+
+    last_stage = f"stage-{stages - 1}"
+    cases = {
+        'первая кнопка': ('user', None, user_buttons[0]),
+        'кнопка этапа': ('user', last_stage, stage_buttons[last_stage][-1]),
+        'свободный текст': ('user', last_stage, "Не работает проектор у окна"),
+    }
+    return router, legacy_resolve, cases
+
+
+def per_call_ns(func, args, repeat):
+    return min(timeit.repeat(lambda: func(*args), number=repeat, repeat=5)) / repeat * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'кнопок':>7} {'этапов':>7}  {'случай':<16} {'if/elif, нс':>12} {'Router, нс':>11}")
+    for buttons, stages in SIZES:
+        router, legacy_resolve, cases = build(buttons, stages)
+        for name, case in cases.items():
+            legacy = per_call_ns(legacy_resolve, case, args.repeat)
+            table = per_call_ns(router.resolve, case, args.repeat)
+            print(f"{buttons:>7} {stages:>7}  {name:<16} {legacy:>12.0f} {table:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
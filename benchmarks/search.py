@@ -0,0 +1,87 @@
+"""Поиск заявок: FTS5 с ранжированием bm25 против LIKE '%…%'.
+
+Для каждого размера заполняет базу через benchmarks.dataset (индекс FTS пополняется
+триггерами, как в боте) и замеряет db.search_requests — первую страницу и страницу
+поглубже — и тот же поиск через LIKE по каждому слову, как пришлось бы искать без
+индекса. Все запросы есть в данных benchmarks.dataset: запрос без результатов (например,
+латинская модель, испорченная приведением к номеру аудитории) помечается ⚠️, и бенчмарк
+завершается с ошибкой.
+
+    python -m benchmarks.search --sizes 100000 1000000
+"""
+import argparse
+import inspect
+import time
+
+import database as db
+from benchmarks import dataset
+from benchmarks.common import summarize, temp_database_path
+
+QUERIES = ("проектор", "проектор 305", "мигает свет", "кран коридор", "компьютер преподавателя 1-01", "ауд. 712",
+           "HP1020", "бумага a4",
+           # Знаки без букв и цифр не должны обнулять выдачу
+           "проектор +")
+
+
+def like_search(conn, text, offset=0, limit=10):
+    """Поиск без индекса: каждое слово — подстрока описания, аудитории или типа"""
+    conditions, params = [], []
+    for word in text.split():
+        conditions.append("(r.description LIKE ? OR r.room LIKE ? OR r.type LIKE ?)")
+        params += [f'%{word}%'] * 3
+    return conn.execute(f'''
+        SELECT r.id, r.type, r.room, substr(r.description, 1, 50), r.status, r.created_at, u.full_name
+        FROM requests r JOIN users u ON r.user_id = u.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY r.created_at DESC LIMIT ? OFFSET ?
+    ''', (*params, limit + 1, offset)).fetchall()
+
+
+def measure(func, iterations, budget):
+    durations = []
+    deadline = time.perf_counter() + budget
+    while len(durations) < iterations and (len(durations) < 3 or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+
+def run_size(rows, iterations, budget):
+    db.init_database(temp_database_path(f'search_{rows}.db'))
+    conn = db._get_connection()
+    started = time.perf_counter()
+    dataset.seed(conn, rows)
+    seeded = time.perf_counter() - started
+    search = inspect.unwrap(db.search_requests)
+    missed = 0
+
+    print(f"\n🗄️ {rows} заявок (заполнение с индексом {seeded:.1f} с)")
+    print(f"{'запрос':<30} {'найдено':>8} {'FTS p50':>9} {'FTS p99':>9} {'стр. 5':>9} {'LIKE p50':>10}")
+    for text in QUERIES:
+        first = measure(lambda: search(conn, text), iterations, budget)
+        deep = measure(lambda: search(conn, text, offset=40), iterations, budget)
+        like = measure(lambda: like_search(conn, text), min(iterations, 20), budget)
+        total = conn.execute('SELECT COUNT(*) FROM requests_fts WHERE requests_fts MATCH ?',
+                             (db.fts_query(text),)).fetchone()[0]
+        print(f"{text:<30} {total:>8} {first['p50_ms']:>9.2f} {first['p99_ms']:>9.2f} "
+              f"{deep['p50_ms']:>9.2f} {like['p50_ms']:>10.2f}{'  ⚠️ ничего не найдено' if not total else ''}")
+        missed += not total
+    db.close_database()
+    return missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=3.0, help='секунд на один замер')
+    args = parser.parse_args()
+    print("время в мс; «стр. 5» — результаты 41–50")
+    missed = sum(run_size(rows, args.iterations, args.budget) for rows in args.sizes)
+    if missed:
+        raise SystemExit(f"запросов без результатов: {missed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Эскалация по срокам: пробуждение к ближайшему сроку против периодического прохода.
+
+Заполняет базу через benchmarks.dataset с долей открытых заявок --open-fraction и
+раздает открытым сроки due_at на ближайшую неделю. Замеряет:
+
+- пробуждение, когда просроченных нет (обычный случай): db.escalate_overdue_requests
+  читает одну запись idx_requests_due и ближайший срок;
+- пробуждение с пачкой просроченных (SLA_BATCH_SIZE заявок ставят напоминания в outbox);
+- периодический проход, как без индекса сроков: все открытые заявки с их типом и
+  временем последнего изменения, срок считается в Python.
+
+    python -m benchmarks.sla --rows 200000 --open-fraction 0.25
+"""
+import argparse
+import datetime
+import inspect
+import random
+import time
+
+import database as db
+import sla
+from benchmarks import dataset
+from benchmarks.common import only_admins, summarize, temp_database_path
+from config import SLA_BATCH_SIZE
+
+
+def measure(func, iterations):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+
+def spread_deadlines(conn, rng):
+    """Сроки открытых заявок — случайно в ближайшие 7 дней"""
+    ids = [row[0] for row in conn.execute("SELECT id FROM requests WHERE status IN ('new', 'in_progress')")]
+    with conn:
+        conn.executemany("UPDATE requests SET due_at = datetime('now', ?) WHERE id = ?",
+                         ((f'+{rng.randint(60, 7 * 86400)} seconds', request_id) for request_id in ids))
+    conn.execute('ANALYZE')
+    return len(ids)
+
+
+def overdue(conn, count):
+    """Делает count ближайших сроков просроченными"""
+    with conn:
+        conn.execute('''
+            UPDATE requests SET due_at = datetime('now', '-1 minute'), escalation = 0
+            WHERE id IN (SELECT id FROM requests WHERE due_at IS NOT NULL ORDER BY due_at LIMIT ?)
+        ''', (count,))
+
+
+def full_scan(conn):
+    """Проход без индекса сроков: каждый раз все открытые заявки"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    late = []
+    for request_id, request_type, status, changed in conn.execute('''
+        SELECT id, type, status, COALESCE(completed_at, created_at) FROM requests
+        WHERE status IN ('new', 'in_progress') AND parent_id IS NULL
+    '''):
+        seconds = sla.deadline_seconds(request_type, status)
+        if seconds and datetime.datetime.fromisoformat(changed) + datetime.timedelta(seconds=seconds) <= now:
+            late.append(request_id)
+    return late
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--open-fraction', type=float, default=0.25)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    db.init_database(temp_database_path('sla.db'))
+    conn = db._get_connection()
+    dataset.seed(conn, args.rows, open_fraction=args.open_fraction)
+    only_admins([900, 901, 902])
+    open_requests = spread_deadlines(conn, random.Random(1))
+    escalate = inspect.unwrap(db.escalate_overdue_requests)
+
+    idle = measure(lambda: escalate(conn, SLA_BATCH_SIZE), args.iterations)
+
+    def batch():
+        overdue(conn, SLA_BATCH_SIZE)
+        started = time.perf_counter()
+        escalate(conn, SLA_BATCH_SIZE)
+        return time.perf_counter() - started
+
+    batches = summarize([batch() for _ in range(args.iterations)])
+    scan = measure(lambda: full_scan(conn), max(3, args.iterations // 10))
+    reminders = conn.execute("SELECT COUNT(*) FROM outbox WHERE kind = 'sla_reminder'").fetchone()[0]
+    db.close_database()
+
+    print(f"заявок: {args.rows}, открытых со сроком: {open_requests}; напоминаний поставлено: {reminders}")
+    print(f"{'проход':<42} {'p50, мс':>9} {'p99, мс':>9}")
+    print(f"{'пробуждение без просроченных':<42} {idle['p50_ms']:>9.3f} {idle['p99_ms']:>9.3f}")
+    print(f"{f'пробуждение, {SLA_BATCH_SIZE} просроченных':<42} {batches['p50_ms']:>9.3f} {batches['p99_ms']:>9.3f}")
+    print(f"{'периодический проход по открытым':<42} {scan['p50_ms']:>9.3f} {scan['p99_ms']:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Память под состояния диалогов: прежний dict строк против ChatState со __slots__.
+
+Каждый чат находится на середине создания заявки (тип, аудитория и описание уже
+введены) — это худший и самый частый в час пик случай. Память меряется через
+tracemalloc и пересчитывается на 1000 активных чатов.
+
+    python -m benchmarks.state_memory --chats 10000
+"""
+import argparse
+import tracemalloc
+
+from states import ChatState, StateStore
+
+
+def draft(i):
+    return "💡 Электрика", f"{300 + i % 200}", f"Не работает проектор у окна, заявка {i}"
+
+
+def legacy_states(chats):
+    states = {}
+    for i in range(chats):
+        request_type, room, description = draft(i)
+        states[i] = {'mode': 'user', 'creating_request': True, 'stage': 'photo_choice',
+                     'type': request_type, 'room': room, 'description': description}
+    return states
+
+
+def slotted_states(chats):
+    store = StateStore(max_chats=chats)
+    for i in range(chats):
+        state = ChatState(i)
+        state.creating_request = True
+        state.stage = 'photo_choice'
+        state.type, state.room, state.description = draft(i)
+        store._remember(state)
+    return store
+
+
+def measure(build, chats):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    states = build(chats)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return states, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=10000)
+    args = parser.parse_args()
+
+    _, legacy = measure(legacy_states, args.chats)
+    store, slotted = measure(slotted_states, args.chats)
+    print(f"чатов: {args.chats}")
+    print(f"dict-состояния:   {legacy * 1000 // args.chats // 1024} КБ на 1000 чатов")
+    print(f"ChatState:        {slotted * 1000 // args.chats // 1024} КБ на 1000 чатов")
+    print(f"оценка StateStore.memory_usage(): "
+          f"{store.memory_usage()['bytes_per_1000_chats'] // 1024} КБ на 1000 чатов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Пропускная способность обработки обновлений: по одному против параллельно по чатам.
+
+Бот собирается через bot.build_application и отвечает локальному фейковому Bot API
+(в отдельном потоке) с задержкой latency. Обновления кладутся прямо в
+application.update_queue всплеском: каждый из chats чатов проходит диалог создания
+заявки (/start → "📝 Подать заявку" → тип → аудитория → описание → "📋 Без фото")
+столько раз, чтобы всего вышло около --updates обновлений. Время — от первого
+обновления до последнего ответа бота.
+
+Порядок внутри чата проверяется по итогу: если шаги одного чата перепутались,
+заявок в базе окажется меньше, чем пройденных диалогов.
+
+    python -m benchmarks.update_throughput --updates 600 --latency-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import threading
+import time
+
+from telegram import Update
+
+import bot
+import database as db
+import log
+from benchmarks.common import only_admins, temp_database_path
+from benchmarks.fake_bot_api import FakeBotAPI
+from identity import IdentityCache
+from states import StateStore
+
+LEVELS = (1, 10, 100)
+CHAT_BASE = 200000
+STEPS = ('/start', "📝 Подать заявку", bot.REQUEST_TYPES[0], None, "Не работает проектор", "📋 Без фото")
+
+
+class ApiThread(threading.Thread):
+    """Фейковый Bot API в своем потоке; считает ответы бота и будит ждущего на expected-м"""
+
+    def __init__(self, port, latency):
+        super().__init__(daemon=True)
+        self.port = port
+        self.latency = latency
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.expected = 0
+        self.replies = 0
+        self.loop = None
+        self.stopped = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        api = FakeBotAPI(latency=self.latency)
+        api.on_message = self.observe
+        server = api.listen(self.port)
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.ready.set()
+        await self.stopped.wait()
+        server.stop()
+
+    def observe(self, method, message):
+        if method == 'sendMessage' and message['chat']['id'] >= CHAT_BASE:
+            self.replies += 1
+            if self.replies >= self.expected:
+                self.done.set()
+
+    def expect(self, count):
+        self.replies = 0
+        self.expected = count
+        self.done.clear()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+
+def updates_for(chats, rounds):
+    """Обновления в порядке прихода: шаг за шагом, в каждом шаге — все чаты"""
+    ids = itertools.count(1)
+    for _ in range(rounds):
+        for step in STEPS:
+            for chat_id in range(CHAT_BASE, CHAT_BASE + chats):
+                text = step or str(chat_id)
+                message = {'message_id': next(ids), 'date': int(time.time()), 'text': text,
+                           'chat': {'id': chat_id, 'type': 'private'},
+                           'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Студент'}}
+                if text.startswith('/'):
+                    message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+                yield {'update_id': next(ids), 'message': message}
+
+
+async def run_level(thread, chats, rounds, concurrent_updates, timeout):
+    db.init_database(temp_database_path('updates.db'))
+    # Кэши бота ссылаются на users.id прошлой базы
+    bot.USER_STATES = StateStore()
+    bot.IDENTITIES = IdentityCache()
+    # Без админов: уведомления о заявках никому не уходят, ответы бота — только студентам
+    only_admins([])
+    application = bot.build_application(token='1:fake', mode='polling', base_url=f'http://127.0.0.1:{thread.port}',
+                                        concurrent_updates=concurrent_updates)
+    total = chats * rounds * len(STEPS)
+    async with application:
+        await bot.ACCESS.reload()
+        await application.start()
+        thread.expect(total)
+        started = time.perf_counter()
+        for data in updates_for(chats, rounds):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        finished = await asyncio.to_thread(thread.done.wait, timeout)
+        elapsed = time.perf_counter() - started
+        created = db._get_connection().execute('SELECT COUNT(*) FROM requests').fetchone()[0]
+        await application.stop()
+    return total, elapsed if finished else None, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=300, help='примерно сколько обновлений на уровень')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=bot.CONCURRENT_UPDATES,
+                        help='max_concurrent_updates для параллельного режима')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--port', type=int, default=18082)
+    args = parser.parse_args()
+
+    log.setup(level='WARNING')
+    thread = ApiThread(args.port, args.latency_ms / 1000)
+    thread.start()
+    thread.ready.wait()
+
+    print(f"задержка API {args.latency_ms:.0f} мс, параллельно до {args.concurrency} обновлений")
+    print(f"{'чатов':>6}  {'режим':<10} {'обновлений':>10} {'обн./с':>8} {'заявок':>12}")
+    for chats in LEVELS:
+        rounds = max(1, args.updates // (chats * len(STEPS)))
+        for name, concurrency in (('по одному', 1), ('по чатам', args.concurrency)):
+            total, elapsed, created = asyncio.run(run_level(thread, chats, rounds, concurrency, args.timeout))
+            rate = f"{total / elapsed:>8.1f}" if elapsed else f"{'таймаут':>8}"
+            print(f"{chats:>6}  {name:<10} {total:>10} {rate} {created:>5} из {chats * rounds:<5}")
+    thread.stop()
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Сквозная задержка режима webhook на синтетических обновлениях.
+
+Поднимает webhook.serve на локальном порту с ботом, которому не нужен доступ к
+Telegram, и отправляет POST-запросы с текстовыми сообщениями от разных чатов.
+Задержка — от начала POST до завершения обработчика. Заодно проверяет, что запрос
+с неверным секретом получает 403, а /healthz отвечает 200.
+
+    python -m benchmarks.webhook_latency --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import httpx
+from telegram import Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+import webhook
+from benchmarks.common import summarize
+
+SECRET = 'bench-secret'
+PATH = 'telegram'
+
+
+class OfflineBot(ExtBot):
+    """Бот без обращения к api.telegram.org: getMe отвечает заранее заданным пользователем"""
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(id=1, first_name='bench', is_bot=True, username='bench_bot')
+        return self._bot_user
+
+
+def synthetic_update(update_id, chat_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Студент'},
+            'text': '📊 Мои заявки',
+        },
+    }
+
+
+class ServerThread(threading.Thread):
+    """webhook.serve в отдельном потоке со своим циклом событий, чтобы клиент
+    не делил с сервером один цикл и не искажал задержку"""
+
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.port = port
+        self.done = {}
+        self.ready = threading.Event()
+        self.loop = None
+        self.stop_event = None
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        async def probe(update: Update, context):
+            callback = self.done.pop(update.update_id, None)
+            if callback:
+                callback(time.perf_counter())
+
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        application = Application.builder().bot(OfflineBot('1:offline')).updater(None).build()
+        application.add_handler(TypeHandler(Update, probe))
+        application.post_init = self.mark_ready
+        await webhook.serve(application, '127.0.0.1', self.port, PATH,
+                            secret_token=SECRET, stop_event=self.stop_event)
+
+    async def mark_ready(self, application):
+        self.ready.set()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.join()
+
+
+async def run(updates, concurrency, port):
+    server = ServerThread(port)
+    server.start()
+    await asyncio.to_thread(server.ready.wait)
+    url = f'http://127.0.0.1:{port}'
+    async with httpx.AsyncClient(base_url=url) as client:
+        for _ in range(50):
+            try:
+                health = await client.get('/healthz')
+                if health.status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+        rejected = await client.post(f'/{PATH}', json=synthetic_update(0, 1),
+                                     headers={webhook.SECRET_HEADER: 'wrong'})
+
+        loop = asyncio.get_running_loop()
+        latencies = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(update_id):
+            async with semaphore:
+                finished = loop.create_future()
+                server.done[update_id] = lambda at: loop.call_soon_threadsafe(finished.set_result, at)
+                started = time.perf_counter()
+                response = await client.post(f'/{PATH}', json=synthetic_update(update_id, 1000 + update_id % 100),
+                                             headers={webhook.SECRET_HEADER: SECRET})
+                response.raise_for_status()
+                latencies.append(await finished - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(1, updates + 1)))
+        elapsed = time.perf_counter() - started
+
+    server.stop()
+    return health.status_code, rejected.status_code, summarize(latencies), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+
+    health, rejected, stats, elapsed = asyncio.run(run(args.updates, args.concurrency, args.port))
+    print(f"/healthz: {health}, неверный секрет: {rejected}")
+    print(f"обновлений: {stats['count']} за {elapsed:.2f} с ({stats['count'] / elapsed:.0f}/с)")
+    print(f"POST → обработчик: p50 {stats['p50_ms']} мс, p99 {stats['p99_ms']} мс, max {stats['max_ms']} мс")
+
+
+if __name__ == '__main__':
+    main()
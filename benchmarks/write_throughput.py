@@ -0,0 +1,87 @@
+"""Пропускная способность записей: транзакция на вызов против группового commit.
+
+Моделирует отключение света в корпусе: concurrency студентов одновременно
+подают заявки, а админы сразу меняют статусы. Режим "по одной" вызывает
+синхронные функции database.py через поток базы — каждая со своей транзакцией,
+как было до группового commit. Режим "пакетами" — обычные db.create_request и
+db.transition_request_status.
+
+С synchronous=NORMAL в WAL commit не ждет fsync, и выигрыш меньше; --synchronous
+FULL показывает случай, когда каждый commit платит за fsync.
+
+    python -m benchmarks.write_throughput --writes 2000 --synchronous FULL
+"""
+import argparse
+import asyncio
+import inspect
+import random
+import time
+
+import database as db
+from benchmarks import dataset
+from benchmarks.common import summarize, temp_database_path
+
+LEVELS = (1, 10, 50, 200)
+
+
+async def per_call(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db._executor, lambda: inspect.unwrap(func)(db._get_connection(), *args))
+
+
+async def batched(func, *args):
+    return await func(*args)
+
+
+async def workload(call, writes, concurrency, rng):
+    """writes записей от concurrency одновременных клиентов: 2/3 заявок, 1/3 смен статуса"""
+    latencies = []
+    created = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            if i % 3 == 2 and created:
+                # Каждую заявку берут в работу один раз, иначе переход отклоняется без записи
+                request_id = created.pop(rng.randrange(len(created)))
+                await call(db.transition_request_status, request_id, 'in_progress', 'Админ')
+            else:
+                request_id, _, _ = await call(db.create_request, 1 + i % 50, rng.choice(dataset.TYPES),
+                                           rng.choice(dataset.rooms()), "Нет света в аудитории", None, (900,))
+                created.append(request_id)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(writes)))
+    return writes / (time.perf_counter() - started), summarize(latencies)
+
+
+async def run(writes, synchronous):
+    results = []
+    for concurrency in LEVELS:
+        for name, call in (('по одной', per_call), ('пакетами', batched)):
+            db.init_database(temp_database_path('writes.db'))
+            conn = db._get_connection()
+            conn.execute(f'PRAGMA synchronous = {synchronous}')
+            dataset.seed(conn, 1000, users_count=50)
+            rate, stats = await workload(call, writes, concurrency, random.Random(concurrency))
+            db.close_database()
+            results.append((concurrency, name, rate, stats))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writes', type=int, default=2000)
+    parser.add_argument('--synchronous', choices=('NORMAL', 'FULL'), default='NORMAL')
+    args = parser.parse_args()
+
+    print(f"записей на уровень: {args.writes}, synchronous={args.synchronous}")
+    print(f"{'клиентов':>9}  {'режим':<9} {'записей/с':>10} {'p50, мс':>9} {'p99, мс':>9}")
+    for concurrency, name, rate, stats in asyncio.run(run(args.writes, args.synchronous)):
+        print(f"{concurrency:>9}  {name:<9} {rate:>10.0f} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
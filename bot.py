@@ -1,19 +1,52 @@
-import logging
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+import asyncio
+import datetime
+import log
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, ReplyParameters
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 import database as db
 import keyboards as kb
-from config import BOT_TOKEN, ADMIN_IDS, RESPONSIBLE_PERSONS, SPECIAL_NOTIFICATIONS
-from telegram.error import BadRequest
+import metrics
+import rooms
+import sla
+import stats
+import webhook
+from access import AccessControl
+from identity import IdentityCache
+from notifier import Dispatcher
+from processor import ChatOrderedProcessor
+from router import ANY, Router
+from states import ChatState, StateStore
+from config import (BOT_TOKEN, ADMIN_IDS,
+                    OUTBOX_POLL_INTERVAL, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS,
+                    STATE_MAX_CHATS, STATE_TTL, STATE_FLUSH_INTERVAL, REQUESTS_PAGE_SIZE, IDENTITY_CACHE_SIZE,
+                    BOT_MODE, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                    LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE, METRICS_LISTEN, METRICS_PORT,
+                    ALBUM_COLLECT_DELAY, MAX_REQUEST_PHOTOS, CONCURRENT_UPDATES,
+                    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, OUTBOX_RETENTION_DAYS, MAINTENANCE_TIME,
+                    SLA_BATCH_SIZE)
+from telegram.error import BadRequest, Forbidden
+from telegram.helpers import escape_markdown
 
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-    level=logging.INFO
-)
+log.setup(level=LOG_LEVEL, debug_sample_rate=LOG_DEBUG_SAMPLE_RATE)
+logger = log.get_logger('bot')
 
-USER_STATES = {}
+USER_STATES = StateStore(max_chats=STATE_MAX_CHATS, ttl=STATE_TTL)
+IDENTITIES = IdentityCache(max_users=IDENTITY_CACHE_SIZE)
+# Админы, получатели по типам заявок и ответственные — снимок таблиц базы, см. access.py
+ACCESS = AccessControl(bootstrap_admins=ADMIN_IDS)
 application = None
+dispatcher = Dispatcher()
+metrics_server = None
+# Альбомы в процессе сбора: chat_id -> {'group': media_group_id, 'photos': [file_id], 'done': bool}.
+# После создания заявки запись еще немного живет с done=True, чтобы опоздавшие фото альбома тихо отбросить
+albums = {}
+# Текстовые сообщения: (роль, этап, кнопка) -> обработчик(update, context, user_state, text)
+router = Router()
+
+# Замер обработчиков и фоновых задач; при выключенных метриках возвращает функцию как есть
+timed_handler = metrics.timed('handler_seconds', 'handler', errors='handler_errors_total')
+timed_job = metrics.timed('job_seconds', 'job')
 
 # === ОСНОВНЫЕ ФУНКЦИИ ===
 
@@ -21,18 +54,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = update.effective_chat.id
     
-    print(f"🆕 Пользователь {user.id} ({user.full_name}) запустил бота")
-    db.add_user(telegram_id=user.id, full_name=user.full_name, username=user.username)
-    USER_STATES[chat_id] = {'mode': 'user'}
+    logger.info("пользователь запустил бота", user_id=user.id)
+    await IDENTITIES.ensure_user(user.id, user.full_name, user.username)
+    await USER_STATES.reset(chat_id, mode='user')
     
     # Если пользователь администратор - показываем админскую клавиатуру
-    if user.id in ADMIN_IDS:
+    if ACCESS.is_admin(user.id):
         await update.message.reply_text(
             "🔧 **Панель администратора**\n\nВыберите действие:",
             reply_markup=kb.ADMIN_KEYBOARD,
             parse_mode='Markdown'
         )
-        USER_STATES[chat_id] = {'mode': 'admin'}
+        await USER_STATES.reset(chat_id, mode='admin')
     else:
         await update.message.reply_text(
             "🔧 **Служба оперативного ремонта ИЭФ МЛИТ**\n\nБыстро сообщайте о проблемах и отслеживайте статус заявок!\n\nВыберите действие:",
@@ -40,93 +73,78 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
-async def notify_admins_about_new_request(request_id, request_type, room, description, user_name, user_telegram_id, photo_id=None):
-    """Отправляет уведомления о новой заявке с inline кнопками"""
-    global application
-    
-    print(f"🔔 Начало отправки уведомлений для заявки #{request_id}")
-    print(f"🔔 Тип заявки: {request_type}")
-    print(f"🔔 SPECIAL_NOTIFICATIONS: {SPECIAL_NOTIFICATIONS}")
-    
-    # Определяем кому отправлять уведомления
-    if request_type in SPECIAL_NOTIFICATIONS:
-        notify_ids = SPECIAL_NOTIFICATIONS[request_type].copy()
-        print(f"🔔 Специальное уведомление для '{request_type}': {notify_ids}")
+async def send_album_with_controls(chat_id, photos, text, keyboard):
+    """Фото заявки одной медиагруппой и следом сообщение с кнопками статуса (у альбома
+    кнопок быть не может). Возвращает Outcome сообщения с кнопками — его потом и редактируют"""
+    album = await dispatcher.send(chat_id, application.bot.send_media_group,
+                                  media=[InputMediaPhoto(file_id) for file_id in photos])
+    reply = None
+    if album.ok:
+        reply = ReplyParameters(message_id=album.result[0].message_id, allow_sending_without_reply=True)
     else:
-        notify_ids = ADMIN_IDS.copy()
-        print(f"🔔 Общее уведомление для '{request_type}': {notify_ids}")
+        logger.warning("альбом не отправлен", chat_id=chat_id, attempts=album.attempts, error=album.error)
+    return await dispatcher.send(chat_id, application.bot.send_message, text=text, parse_mode='Markdown',
+                                 reply_markup=keyboard, reply_parameters=reply)
+
+async def notify_admins_about_new_request(request_id, request_type, room, description, user_name, notify_ids,
+                                          photo_id=None, photos=(), status='new'):
+    """Отправляет уведомления о новой заявке с inline кнопками.
+    status — текущий статус заявки: уведомление, дождавшееся очереди, когда заявку уже
+    взяли в работу, приходит с пометкой об этом и только с кнопкой «Выполнено»"""
+    global application
     
     message = f"""
 🚨 *НОВАЯ ЗАЯВКА #{request_id}*
 
 👤 *От:* {user_name}
 🚪 *Аудитория:* {room}
-�� *Тип:* {request_type}
+🔧 *Тип:* {request_type}
 📝 *Описание:* {description}
 
-👨‍🔧 *Ответственный:* {RESPONSIBLE_PERSONS.get(request_type, 'Дежурный')}
+👨‍🔧 *Ответственный:* {ACCESS.responsible(request_type)}
     """
+    if status == 'in_progress':
+        message += "\n🛠️ *Уже в работе*"
     
     # Используем функцию из keyboards.py
-    keyboard = kb.get_status_keyboard(request_id)
+    keyboard = kb.get_status_keyboard(request_id, status)
     
-    print(f"🔔 Будет отправлено {len(notify_ids)} уведомлений")
+    if len(photos) > 1:
+        # Два вызова на получателя независимо от числа фото
+        outcomes = await asyncio.gather(*(
+            send_album_with_controls(chat_id, photos, message, keyboard) for chat_id in notify_ids
+        ))
+    elif photo_id:
+        outcomes = await dispatcher.fan_out(
+            notify_ids, application.bot.send_photo,
+            photo=photo_id, caption=message, parse_mode='Markdown', reply_markup=keyboard
+        )
+    else:
+        outcomes = await dispatcher.fan_out(
+            notify_ids, application.bot.send_message,
+            text=message, parse_mode='Markdown', reply_markup=keyboard
+        )
     
-    success_count = 0
-    for user_id in notify_ids:
-        try:
-            print(f"🔔 Отправка пользователю {user_id}...")
-            
-            if photo_id:
-                await application.bot.send_photo(
-                    chat_id=user_id,
-                    photo=photo_id,
-                    caption=message,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-                print(f"✅ Фото с кнопками отправлено пользователю {user_id}")
-            else:
-                await application.bot.send_message(
-                    chat_id=user_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-                print(f"✅ Уведомление с кнопками отправлено пользователю {user_id}")
-            
-            success_count += 1
-            
-        except Exception as e:
-            print(f"❌ Ошибка отправки пользователю {user_id}: {e}")
+    for outcome in outcomes:
+        if outcome.ok:
+            logger.debug("уведомление отправлено", request_id=request_id, chat_id=outcome.chat_id,
+                         attempts=outcome.attempts)
+        else:
+            logger.warning("уведомление не отправлено", request_id=request_id, chat_id=outcome.chat_id,
+                           attempts=outcome.attempts, error=outcome.error)
     
-    print(f"🔔 Итог: отправлено {success_count}/{len(notify_ids)} уведомлений")
+    success_count = sum(outcome.ok for outcome in outcomes)
+    logger.info("рассылка о новой заявке", request_id=request_id, type=request_type,
+                sent=success_count, recipients=len(notify_ids))
+    return outcomes
 
-async def notify_user_about_status_change(request_id, new_status, admin_name):
+async def notify_user_about_status_change(request_id, new_status, admin_name, user_telegram_id):
     """Уведомляет пользователя об изменении статуса заявки"""
-    try:
-        global application
-        print(f"🔔 Уведомление пользователя: заявка #{request_id}, статус: {new_status}")
-        
-        request = db.get_request_by_id(request_id)
-        if not request:
-            print(f"❌ Заявка #{request_id} не найдена")
-            return
-        
-        # telegram_id теперь на позиции [10]
-        user_telegram_id = request[10]
-        user_name = request[11]  # full_name на позиции [11]
-        
-        print(f"🔔 Telegram ID пользователя: {user_telegram_id}")
-        print(f"🔔 Имя пользователя: {user_name}")
-        
-        if not user_telegram_id:
-            print(f"❌ Telegram ID не найден для заявки #{request_id}")
-            return
-        
-        # Формируем понятное сообщение для пользователя
-        if new_status == 'in_progress':
-            message = f"""
+    global application
+    
+    # Формируем понятное сообщение для пользователя
+    if new_status == 'in_progress':
+        message = f"""
 🛠️ *Заявка #{request_id} взята в работу*
 
 📋 *Номер заявки:* #{request_id}
@@ -135,8 +153,8 @@ async def notify_user_about_status_change(request_id, new_status, admin_name):
 
 Мы приступили к выполнению вашей заявки!
 """
-        elif new_status == 'completed':
-            message = f"""
+    elif new_status == 'completed':
+        message = f"""
 ✅ *Заявка #{request_id} выполнена*
 
 📋 *Номер заявки:* #{request_id}  
@@ -145,8 +163,8 @@ async def notify_user_about_status_change(request_id, new_status, admin_name):
 
 Ваша заявка успешно выполнена!
 """
-        else:
-            message = f"""
+    else:
+        message = f"""
 🆕 *Заявка #{request_id} принята*
 
 📋 *Номер заявки:* #{request_id}
@@ -155,113 +173,448 @@ async def notify_user_about_status_change(request_id, new_status, admin_name):
 
 Заявка принята в работу!
 """
-        
-        print(f"🔔 Отправка сообщения пользователю {user_telegram_id}")
-        
-        await application.bot.send_message(
-            chat_id=user_telegram_id,
-            text=message,
-            parse_mode='Markdown'
+    
+    outcome = await dispatcher.send(
+        user_telegram_id, application.bot.send_message,
+        text=message, parse_mode='Markdown'
+    )
+    
+    if outcome.ok:
+        logger.info("пользователь уведомлен о статусе", request_id=request_id, chat_id=user_telegram_id,
+                    status=new_status)
+    else:
+        logger.warning("пользователь не уведомлен о статусе", request_id=request_id, chat_id=user_telegram_id,
+                       status=new_status, error=outcome.error)
+    return outcome
+
+# === ФОНОВАЯ ДОСТАВКА УВЕДОМЛЕНИЙ ИЗ OUTBOX ===
+# Обработчики только записывают уведомления в outbox в одной транзакции с заявкой
+# и сразу отвечают пользователю. Отправляет их эта задача: при падении бота
+# недоставленные записи останутся в базе и уйдут после перезапуска.
+
+_outbox_lock = asyncio.Lock()
+_outbox_rerun = False
+
+# Получатель -> задача, которая сейчас отправляет ему его записи. Получатели не ждут
+# друг друга: админ, упершийся в лимит сообщений на чат, не задерживает уведомления
+# авторам заявок. Записи занятого получателя не выбираются, пока его задача не закончит
+_chat_deliveries = {}
+
+def wake_outbox_worker():
+    """Запускает доставку сразу, не дожидаясь следующего планового прохода"""
+    application.job_queue.run_once(timed_job(deliver_outbox), 0)
+
+async def deliver_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Раздает записи outbox, срок которых наступил, задачам по получателям. Отправки не ждет:
+    следующий проход может начаться, пока предыдущие записи еще уходят"""
+    global _outbox_rerun
+    if _outbox_lock.locked():
+        # Выборка уже идет — попросим ее пройтись по очереди еще раз
+        _outbox_rerun = True
+        return
+    
+    async with _outbox_lock:
+        while True:
+            _outbox_rerun = False
+            batch = await db.get_due_outbox(OUTBOX_BATCH_SIZE, busy_chats=tuple(_chat_deliveries))
+            by_chat = {}
+            for row in batch:
+                by_chat.setdefault(row['chat_id'], []).append(row)
+            for chat_id, rows in by_chat.items():
+                _chat_deliveries[chat_id] = asyncio.create_task(deliver_to_chat(chat_id, rows))
+            if len(batch) < OUTBOX_BATCH_SIZE and not _outbox_rerun:
+                break
+
+async def deliver_to_chat(chat_id, rows):
+    """Отправляет получателю его записи по порядку; итог каждой попытки пишется в базу сразу"""
+    try:
+        for row in rows:
+            if row['kind'] == 'new_request' and row['status'] == 'completed':
+                # Заявку закрыли, пока уведомление ждало очереди: копии обновлять уже некому,
+                # и кнопки в ней были бы неверны
+                logger.debug("уведомление о выполненной заявке не отправлено", request_id=row['request_id'],
+                             chat_id=chat_id)
+                await db.finish_outbox([(row['id'], True, None, None)])
+                continue
+            outcome = await send_outbox_row(row)
+            messages = []
+            if outcome.ok:
+                result = (row['id'], True, None, None)
+                if row['kind'] == 'new_request':
+                    # Запоминаем копию, чтобы потом обновить ее при смене статуса
+                    kind = 'photo' if outcome.result.photo else 'text'
+                    messages.append((row['request_id'], chat_id, outcome.result.message_id, kind))
+            else:
+                attempts = row['attempts'] + 1
+                permanent = isinstance(outcome.error, (Forbidden, BadRequest))
+                retry_in = None if permanent or attempts >= OUTBOX_MAX_ATTEMPTS else OUTBOX_POLL_INTERVAL * 2 ** attempts
+                result = (row['id'], False, str(outcome.error), retry_in)
+            await db.finish_outbox([result], messages)
+    except Exception:
+        # Неотмеченные записи остаются в outbox и уйдут при следующем проходе
+        logger.exception("ошибка доставки из outbox", chat_id=chat_id)
+    finally:
+        del _chat_deliveries[chat_id]
+    # Пока шла отправка, у получателя могли появиться новые записи
+    wake_outbox_worker()
+
+async def send_outbox_row(row):
+    """Отправляет одну запись outbox ее получателю, возвращает Outcome"""
+    if row['kind'] == 'new_request':
+        (outcome,) = await notify_admins_about_new_request(
+            request_id=row['request_id'],
+            request_type=row['type'],
+            room=row['room'],
+            description=row['description'],
+            user_name=row['full_name'],
+            notify_ids=[row['chat_id']],
+            photo_id=row['photo_id'],
+            photos=row['photos'],
+            status=row['status']
         )
-        
-        print(f"✅ Пользователь {user_telegram_id} уведомлен о статусе: {new_status}")
-        
-    except Exception as e:
-        print(f"❌ Ошибка уведомления пользователя: {e}")
-# === АДМИНСКИЕ КОМАНДЫ ===
+        return outcome
+    if row['kind'] == 'sla_reminder':
+        (outcome,) = await notify_admins_about_overdue_request(row, [row['chat_id']])
+        return outcome
+    return await notify_user_about_status_change(
+        row['request_id'], row['payload']['status'], row['payload']['admin_name'], row['chat_id']
+    )
 
-async def show_all_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает все заявки"""
-    user = update.effective_user
-    if user.id not in ADMIN_IDS:
-        await update.message.reply_text("❌ Доступ запрещен")
+# === СРОКИ ЗАЯВОК (SLA) ===
+# Задача эскалации не опрашивает базу по расписанию: она спит до ближайшего срока
+# (idx_requests_due), а создание заявки и смена статуса будят ее раньше, если новый
+# срок наступает прежде запланированного пробуждения.
+
+# На когда запланировано пробуждение escalate_overdue (UTC); None — ни на когда
+escalation_at = None
+
+# Чего ждали от заявки в статусе, о котором напоминаем
+OVERDUE_REASONS = {'new': "не взята в работу", 'in_progress': "не выполнена"}
+
+def sla_deadline(request_type, status):
+    """Когда истечет срок заявки, только что получившей status (UTC), или None"""
+    seconds = sla.deadline_seconds(request_type, status)
+    if seconds is None:
+        return None
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=seconds)
+
+def schedule_escalation(when):
+    """Будит escalate_overdue в when, если она не запланирована на более ранний момент"""
+    global escalation_at
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # Прошедшее escalation_at не в счет: та задача уже идет или потеряна
+    if when is None or (escalation_at is not None and now < escalation_at <= when):
         return
+    escalation_at = when
+    # Задержкой, а не моментом: срок в прошлом планировщик счел бы пропущенным
+    application.job_queue.run_once(timed_job(escalate_overdue), max(0.0, (when - now).total_seconds()), data=when)
+
+async def escalate_overdue(context: ContextTypes.DEFAULT_TYPE):
+    """Ставит напоминания о просроченных заявках в outbox и засыпает до следующего срока"""
+    global escalation_at
+    # Пробуждение, замененное более ранним, отрабатывает вхолостую и расписание не сбивает
+    if context.job.data == escalation_at:
+        escalation_at = None
+    escalated = 0
+    while True:
+        count, next_due = await db.escalate_overdue_requests(SLA_BATCH_SIZE)
+        escalated += count
+        if count < SLA_BATCH_SIZE:
+            break
+    if escalated:
+        logger.info("напоминания о просроченных заявках", requests=escalated)
+        wake_outbox_worker()
+    if next_due is not None:
+        schedule_escalation(datetime.datetime.fromisoformat(next_due).replace(tzinfo=datetime.timezone.utc))
+
+async def notify_admins_about_overdue_request(row, notify_ids):
+    """Напоминание о просроченной заявке с кнопками смены статуса"""
+    status = row['payload']['status']
+    audience = " — напоминание всем админам" if row['payload']['level'] == 2 else ""
+    message = f"""
+⏰ *Заявка #{row['request_id']} просрочена*{audience}
+
+🚪 *Аудитория:* {row['room']}
+🔧 *Тип:* {row['type']}
+📝 *Описание:* {row['description']}
+
+⌛ Срок прошел, а заявка {OVERDUE_REASONS.get(status, 'не закрыта')}
+    """
+    return await dispatcher.fan_out(notify_ids, application.bot.send_message, text=message, parse_mode='Markdown',
+                                    reply_markup=kb.get_status_keyboard(row['request_id'], status))
+
+# === СИНХРОНИЗАЦИЯ КОПИЙ УВЕДОМЛЕНИЙ У АДМИНОВ ===
+
+# Текст уведомления о заявке после смены статуса
+ADMIN_STATUS_MESSAGES = {
+    'in_progress': "🛠️ *Заявка #{request_id} взята в работу*\n\nИсполнитель: {admin_name}",
+    'completed': "✅ *Заявка #{request_id} выполнена*\n\nИсполнитель: {admin_name}",
+}
+
+async def sync_notification_copies(context: ContextTypes.DEFAULT_TYPE):
+    """Обновляет копии уведомления о заявке у остальных админов и убирает с них кнопки,
+    чтобы заявку не взяли в работу второй раз. job.data — (request_id, status, admin_name, chat_id нажавшего)"""
+    request_id, status, admin_name, acted_chat_id = context.job.data
+    copies = await db.get_notification_messages(request_id, forget=status == 'completed')
+    text = ADMIN_STATUS_MESSAGES[status].format(request_id=request_id, admin_name=admin_name)
+    
+    async def edit(chat_id, message_id, kind):
+        # Уведомление с одним фото — это подпись к фото, а не текст
+        if kind == 'photo':
+            return await dispatcher.send(chat_id, application.bot.edit_message_caption, message_id=message_id,
+                                         caption=text, parse_mode='Markdown')
+        return await dispatcher.send(chat_id, application.bot.edit_message_text, message_id=message_id,
+                                     text=text, parse_mode='Markdown')
     
-    requests = db.get_all_requests(limit=10)
+    outcomes = await asyncio.gather(*(edit(*copy) for copy in copies if copy[0] != acted_chat_id))
+    for outcome in outcomes:
+        if not outcome.ok:
+            logger.warning("копия уведомления не обновлена", request_id=request_id, chat_id=outcome.chat_id,
+                           error=outcome.error)
+    logger.debug("копии уведомления обновлены", request_id=request_id, status=status,
+                 edited=sum(outcome.ok for outcome in outcomes), copies=len(outcomes))
+
+# === АДМИНСКИЕ КОМАНДЫ ===
+
+# Значок статуса в списках заявок
+STATUS_EMOJI = {'new': '🆕', 'in_progress': '🛠️', 'completed': '✅'}
+
+# Заголовок списка и текст для пустого списка; ключ 'all' — все заявки без фильтра
+REQUEST_LISTS = {
+    'all': ("📋 *Все заявки:*", "📭 Заявок пока нет"),
+    'new': ("🆕 *Новые заявки:*", "🆕 Новых заявок нет"),
+    'in_progress': ("🛠️ *Заявки в работе:*", "🛠️ Заявок в работе нет"),
+    'completed': ("✅ *Выполненные заявки:*", "✅ Выполненных заявок нет"),
+}
+
+async def render_requests_page(list_key, cursor_id=None, direction='older'):
+    """Текст и клавиатура одной страницы списка заявок (или None, если страница пуста)"""
+    status = None if list_key == 'all' else list_key
+    requests, has_newer, has_older = await db.get_requests_page(
+        status=status, cursor_id=cursor_id, direction=direction, limit=REQUESTS_PAGE_SIZE
+    )
     if not requests:
-        await update.message.reply_text("📭 Заявок пока нет")
-        return
+        return None, None
     
-    message = "📋 *Все заявки:*\n\n"
+    message = f"{REQUEST_LISTS[list_key][0]}\n\n"
     for request in requests:
-        status_emoji = {
-            'new': '🆕',
-            'in_progress': '🛠️', 
-            'completed': '✅'
-        }.get(request[6], '📋')
+        header = f"#{request['id']}"
+        if list_key == 'all':
+            header += " " + STATUS_EMOJI.get(request['status'], '📋')
         
-        message += f"#{request[0]} {status_emoji} {request[2]} - {request[3]}\n"
-        message += f"👤 {request[11]}\n"
-        message += f"📝 {request[4][:50]}...\n\n"
+        if request['followers']:
+            header += f" 👥 +{request['followers']}"
+        message += f"{header} {request['type']} - {request['room']}\n"
+        message += f"👤 {request['full_name']}\n"
+        message += f"📝 {request['description']}...\n\n"
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    keyboard = kb.get_page_keyboard(list_key, requests[0]['id'], requests[-1]['id'], has_newer, has_older)
+    return message, keyboard
 
-async def show_new_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает новые заявки"""
+async def show_requests_list(update: Update, list_key):
+    """Показывает первую страницу списка заявок с кнопками листания"""
     user = update.effective_user
-    if user.id not in ADMIN_IDS:
+    if not ACCESS.is_admin(user.id):
         await update.message.reply_text("❌ Доступ запрещен")
         return
     
-    requests = db.get_requests_by_status('new')
-    if not requests:
-        await update.message.reply_text("🆕 Новых заявок нет")
+    message, keyboard = await render_requests_page(list_key)
+    if message is None:
+        await update.message.reply_text(REQUEST_LISTS[list_key][1])
         return
     
-    message = "🆕 *Новые заявки:*\n\n"
-    for request in requests[:10]:
-        message += f"#{request[0]} {request[2]} - {request[3]}\n"
-        message += f"👤 {request[11]}\n"
-        message += f"📝 {request[4][:50]}...\n\n"
-    
-    await update.message.reply_text(message, parse_mode='Markdown')
+    await update.message.reply_text(message, parse_mode='Markdown', reply_markup=keyboard)
 
-async def show_requests_in_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route("📋 Все заявки", role='admin')
+async def show_all_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    """Показывает все заявки"""
+    await show_requests_list(update, 'all')
+
+@router.route("🆕 Новые заявки", role='admin')
+async def show_new_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    """Показывает новые заявки"""
+    await show_requests_list(update, 'new')
+
+@router.route("🛠️ В работе", role='admin')
+async def show_requests_in_progress(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
     """Показывает заявки в работе"""
-    user = update.effective_user
-    if user.id not in ADMIN_IDS:
-        await update.message.reply_text("❌ Доступ запрещен")
+    await show_requests_list(update, 'in_progress')
+
+@router.route("✅ Выполненные", role='admin')
+async def show_completed_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    """Показывает выполненные заявки"""
+    await show_requests_list(update, 'completed')
+
+async def handle_page_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает список заявок кнопками ◀️/▶️, редактируя то же сообщение"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not ACCESS.is_admin(query.from_user.id):
         return
     
-    requests = db.get_requests_by_status('in_progress')
+    # page:<список>:<newer|older>:<id крайней заявки>
+    try:
+        _, list_key, direction, cursor_id = query.data.split(':')
+        cursor_id = int(cursor_id)
+    except ValueError:
+        logger.warning("неверные данные листания", data=query.data)
+        return
+    if list_key not in REQUEST_LISTS or direction not in ('newer', 'older'):
+        return
+    
+    message, keyboard = await render_requests_page(list_key, cursor_id, direction)
+    if message is None:
+        return
+    
+    try:
+        await query.edit_message_text(message, parse_mode='Markdown', reply_markup=keyboard)
+    except BadRequest as e:
+        # "Message is not modified" — страница не изменилась
+        logger.debug("страница не отредактирована", error=e)
+
+# Сколько последних поисков в чате можно листать
+FIND_QUERIES_KEPT = 20
+
+async def render_search_page(text, offset=0):
+    """Текст и клавиатура страницы результатов поиска (или None, если ничего не найдено)"""
+    requests, has_more = await db.search_requests(text, offset=offset, limit=REQUESTS_PAGE_SIZE)
     if not requests:
-        await update.message.reply_text("��️ Заявок в работе нет")
+        return None, None
+    
+    message = f"🔍 *Поиск:* {escape_markdown(text)}\n\n"
+    for request in requests:
+        status_emoji = STATUS_EMOJI.get(request['status'], '📋')
+        # Описание, аудиторию и имя пишут пользователи: "_" или "*" в них сломали бы разметку
+        message += f"#{request['id']} {status_emoji} {request['type']} - {escape_markdown(request['room'])}\n"
+        message += f"👤 {escape_markdown(request['full_name'])} · {request['created_at'][:10]}\n"
+        message += f"📝 {escape_markdown(request['description'])}...\n\n"
+    
+    return message, kb.get_search_keyboard(offset, REQUESTS_PAGE_SIZE, has_more)
+
+async def find_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/find <слова> — поиск заявок по описанию, аудитории и типу"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
         return
     
-    message = "🛠️ *Заявки в работе:*\n\n"
-    for request in requests[:10]:
-        message += f"#{request[0]} {request[2]} - {request[3]}\n"
-        message += f"👤 {request[11]}\n"
-        message += f"📝 {request[4][:50]}...\n\n"
+    text = ' '.join(context.args)
+    if not text:
+        await update.message.reply_text("🔍 Укажите, что искать: /find проектор 305")
+        return
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    message, keyboard = await render_search_page(text)
+    if message is None:
+        await update.message.reply_text(f"🔍 По запросу «{text}» ничего не найдено")
+        return
+    
+    logger.debug("поиск заявок", admin_id=update.effective_user.id, query=text)
+    reply = await update.message.reply_text(message, parse_mode='Markdown', reply_markup=keyboard)
+    if keyboard is not None:
+        # Запрос нужен для листания: в callback_data (64 байта) он может не поместиться.
+        # Храним его по id сообщения с результатами, чтобы кнопки старого поиска листали свой запрос
+        queries = context.chat_data.setdefault('find_queries', {})
+        queries[reply.message_id] = text
+        while len(queries) > FIND_QUERIES_KEPT:
+            del queries[next(iter(queries))]
 
-async def show_completed_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает выполненные заявки"""
+async def handle_search_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листает результаты /find, редактируя то же сообщение"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not ACCESS.is_admin(query.from_user.id):
+        return
+    
+    # find:<сколько результатов пропустить>
+    try:
+        offset = max(0, int(query.data.split(':')[1]))
+    except (IndexError, ValueError):
+        logger.warning("неверные данные листания поиска", data=query.data)
+        return
+    text = context.chat_data.get('find_queries', {}).get(query.message.message_id)
+    if not text:
+        # Поиск слишком старый — запрос уже забыт
+        return
+    
+    message, keyboard = await render_search_page(text, offset)
+    if message is None:
+        return
+    
+    try:
+        await query.edit_message_text(message, parse_mode='Markdown', reply_markup=keyboard)
+    except BadRequest as e:
+        logger.debug("страница поиска не отредактирована", error=e)
+
+@router.route("📊 Статистика", role='admin')
+async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    """Показывает статистику по готовым агрегатам (без сканирования заявок)"""
     user = update.effective_user
-    if user.id not in ADMIN_IDS:
+    if not ACCESS.is_admin(user.id):
         await update.message.reply_text("❌ Доступ запрещен")
         return
     
-    requests = db.get_requests_by_status('completed')
-    if not requests:
-        await update.message.reply_text("✅ Выполненных заявок нет")
+    data = await db.get_stats(days=7)
+    by_type = {}
+    totals = {'new': 0, 'in_progress': 0, 'completed': 0}
+    for row in data['counts']:
+        by_type.setdefault(row['type'], {})[row['status']] = row['count']
+        totals[row['status']] = totals.get(row['status'], 0) + row['count']
+    
+    message = "📊 Статистика заявок\n\n"
+    message += f"Всего: {sum(totals.values())} (🆕 {totals['new']} · 🛠️ {totals['in_progress']} · ✅ {totals['completed']})\n\n"
+    
+    message += "По типам:\n"
+    for request_type, counts in sorted(by_type.items(), key=lambda item: -sum(item[1].values())):
+        message += (f"{request_type}: 🆕 {counts.get('new', 0)} · 🛠️ {counts.get('in_progress', 0)}"
+                    f" · ✅ {counts.get('completed', 0)}\n")
+    
+    message += "\nПоступило за 7 дней:\n"
+    for row in data['daily']:
+        message += f"{row['day']}: {row['count']}\n"
+    if not data['daily']:
+        message += "заявок не было\n"
+    
+    median = stats.percentile(data['histogram'], 0.5)
+    p90 = stats.percentile(data['histogram'], 0.9)
+    if median is not None:
+        message += (f"\n⏱️ Время выполнения: медиана ~{stats.format_duration(median)}, "
+                    f"90% заявок быстрее ~{stats.format_duration(p90)}")
+    
+    await update.message.reply_text(message, reply_markup=kb.ADMIN_KEYBOARD)
+
+async def rebuild_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/rebuild_stats — пересчитывает статистику с нуля, если агрегаты разошлись с заявками"""
+    user = update.effective_user
+    if not ACCESS.is_admin(user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
         return
     
-    message = "✅ *Выполненные заявки:*\n\n"
-    for request in requests[:10]:
-        message += f"#{request[0]} {request[2]} - {request[3]}\n"
-        message += f"�� {request[11]}\n"
-        message += f"📝 {request[4][:50]}...\n\n"
+    await db.rebuild_stats()
+    logger.info("статистика пересчитана", admin_id=user.id)
+    await update.message.reply_text("📊 Статистика пересчитана", reply_markup=kb.ADMIN_KEYBOARD)
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/metrics — сводка задержек обработчиков, базы и Bot API и попаданий в кэш пользователей"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    identities = IDENTITIES.stats()
+    # Сообщение Telegram ограничено 4096 символами
+    message = (f"{metrics.summary()[:3800]}\n\n👤 Кэш пользователей: {identities['size']} записей, "
+               f"попаданий {identities['hit_rate']:.0%} ({identities['hits']} из "
+               f"{identities['hits'] + identities['misses']})")
+    await update.message.reply_text(message, reply_markup=kb.ADMIN_KEYBOARD)
 
-async def show_my_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@router.route("📊 Мои заявки")
+async def show_my_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str,
+                           include_archive=False, limit=5):
     """Показывает заявки текущего пользователя"""
     user = update.effective_user
     
     try:
-        requests = db.get_user_requests(user.id)
+        requests = await db.get_user_requests(user.id, include_archive=include_archive)
         if not requests:
             await update.message.reply_text(
                 "У вас пока нет заявок.", 
@@ -270,14 +623,10 @@ async def show_my_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Формируем сообщение БЕЗ Markdown форматирования
-        message = "📊 Ваши заявки:\n\n"
+        message = "🗄️ История ваших заявок:\n\n" if include_archive else "📊 Ваши заявки:\n\n"
         
-        for request in requests[:5]:  # Показываем последние 5 заявок
-            status_emoji = {
-                'new': '🆕',
-                'in_progress': '🛠️', 
-                'completed': '✅'
-            }.get(request[6], '📋')
+        for request in requests[:limit]:  # Показываем последние limit заявок
+            status_emoji = STATUS_EMOJI.get(request[6], '📋')
             
             status_text = {
                 'new': 'Принята',
@@ -292,40 +641,210 @@ async def show_my_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
             message += f"Статус: {status_emoji} {status_text}\n"
             message += f"Дата: {request[7]}\n\n"
         
+        if not include_archive:
+            message += "Давно выполненные заявки — в /history"
+        
         # Отправляем без parse_mode
         await update.message.reply_text(
             message, 
             reply_markup=kb.MAIN_KEYBOARD
         )
         
-        print(f"✅ Показаны заявки пользователя {user.id}")
+        logger.debug("показаны заявки пользователя", user_id=user.id)
         
-    except Exception as e:
-        print(f"❌ Ошибка показа заявок: {e}")
+    except Exception:
+        logger.exception("ошибка показа заявок", user_id=user.id)
         await update.message.reply_text(
             "Произошла ошибка при загрузке заявок.",
             reply_markup=kb.MAIN_KEYBOARD
         )
 
+async def show_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/room <аудитория> — последние заявки аудитории из реестра, включая архив"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    room = await db.find_room(' '.join(context.args)) if context.args else None
+    if room is None:
+        await update.message.reply_text("🏫 Аудитория не найдена. Пример: /room 305")
+        return
+    
+    requests = await db.get_room_history(room['id'], limit=REQUESTS_PAGE_SIZE)
+    message = f"🏫 *Аудитория {escape_markdown(room['name'])}*\n\n"
+    if not requests:
+        message += "Заявок пока не было"
+    for request in requests:
+        status_emoji = STATUS_EMOJI.get(request['status'], '📋')
+        message += f"#{request['id']} {status_emoji} {request['type']} · {request['created_at'][:10]}\n"
+        message += f"📝 {escape_markdown(request['description'][:50])}...\n\n"
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+async def alias_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/room_alias <аудитория> <другое написание> — другое написание означает ту же аудиторию"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    if len(context.args) < 2:
+        await update.message.reply_text("🏫 Пример: /room_alias 101 актовый зал")
+        return
+    
+    name = await db.add_room_alias(context.args[0], ' '.join(context.args[1:]))
+    if name is None:
+        await update.message.reply_text("🏫 Аудитория не найдена. Пример: /room_alias 101 актовый зал")
+        return
+    logger.info("добавлено написание аудитории", room=name, alias=' '.join(context.args[1:]))
+    await update.message.reply_text(f"✅ «{' '.join(context.args[1:])}» теперь означает аудиторию {name}")
+
+async def show_hotspots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/hotspots [дней] — аудитории с наибольшим числом открытых и повторяющихся заявок"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    try:
+        days = max(1, int(context.args[0])) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("🔥 Пример: /hotspots 30")
+        return
+    
+    hotspots = await db.get_hotspots(days)
+    message = "🔥 *Проблемные аудитории*\n\n*Открытые заявки:*\n"
+    for name, count in hotspots['open']:
+        message += f"• {escape_markdown(name)}: {count}\n"
+    if not hotspots['open']:
+        message += "нет\n"
+    message += f"\n*Повторные поломки за {days} дн.:*\n"
+    for name, request_type, count in hotspots['repeats']:
+        message += f"• {escape_markdown(name)} {request_type}: {count} раз\n"
+    if not hotspots['repeats']:
+        message += "нет\n"
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+# === РОЛИ И МАРШРУТЫ ===
+
+def find_request_type(text):
+    """Тип заявки по названию без эмодзи, без учета регистра: "электрика" -> "💡 Электрика" """
+    name = text.strip().lower()
+    for request_type in REQUEST_TYPES:
+        if name in (request_type.lower(), request_type.split(' ', 1)[-1].lower()):
+            return request_type
+    return None
+
+def parse_chat_ids(args):
+    """Список Telegram id из аргументов команды или None, если среди них не число"""
+    try:
+        return [int(arg) for arg in args]
+    except ValueError:
+        return None
+
+async def show_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admins — админы, получатели по типам заявок и ответственные"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    snapshot = ACCESS.snapshot
+    message = "👮 Админы: " + ', '.join(str(telegram_id) for telegram_id in sorted(snapshot.admins)) + "\n\n"
+    message += "📬 Уведомления о новых заявках:\n"
+    for request_type in REQUEST_TYPES:
+        chat_ids = snapshot.routes.get(request_type)
+        message += f"• {request_type}: {', '.join(map(str, chat_ids)) if chat_ids else 'все админы'}\n"
+    message += "\n👨‍🔧 Ответственные:\n"
+    for request_type in REQUEST_TYPES:
+        message += f"• {request_type}: {ACCESS.responsible(request_type)}\n"
+    message += ("\n/admin_add <id>, /admin_remove <id>\n/route <тип> [id ...] — без id уведомлять всех админов\n"
+                "/responsible <тип> <контакт>")
+    await update.message.reply_text(message)
+
+async def change_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/admin_add <id> и /admin_remove <id>"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    adding = update.message.text.startswith('/admin_add')
+    chat_ids = parse_chat_ids(context.args)
+    if not chat_ids or len(chat_ids) != 1:
+        await update.message.reply_text(f"👮 Пример: {'/admin_add' if adding else '/admin_remove'} 979855667")
+        return
+    
+    telegram_id = chat_ids[0]
+    if not adding and ACCESS.snapshot.admins == {telegram_id}:
+        await update.message.reply_text("❌ Нельзя снять последнего админа")
+        return
+    
+    changed = await db.set_admin(telegram_id, admin=adding)
+    await ACCESS.reload()
+    logger.info("права админа изменены", admin_id=update.effective_user.id, telegram_id=telegram_id,
+                admin=adding, changed=changed)
+    if not changed:
+        await update.message.reply_text("ℹ️ Ничего не изменилось")
+    elif adding:
+        await update.message.reply_text(f"✅ {telegram_id} теперь админ (нужно отправить боту /start)")
+    else:
+        await update.message.reply_text(f"✅ {telegram_id} больше не админ")
+
+async def change_route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/route <тип> [id ...] — кому уведомлять о новых заявках типа"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    request_type = find_request_type(context.args[0]) if context.args else None
+    chat_ids = parse_chat_ids(context.args[1:])
+    if request_type is None or chat_ids is None:
+        await update.message.reply_text("📬 Пример: /route электрика 979855667 966122911")
+        return
+    
+    await db.set_route(request_type, chat_ids)
+    await ACCESS.reload()
+    logger.info("маршрут заявок изменен", admin_id=update.effective_user.id, type=request_type, recipients=len(chat_ids))
+    recipients = ', '.join(map(str, chat_ids)) if chat_ids else 'все админы'
+    await update.message.reply_text(f"✅ {request_type}: {recipients}")
+
+async def change_responsible(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/responsible <тип> <контакт> — ответственный в уведомлениях и контактах"""
+    if not ACCESS.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен")
+        return
+    
+    request_type = find_request_type(context.args[0]) if context.args else None
+    contact = ' '.join(context.args[1:])
+    if request_type is None or not contact:
+        await update.message.reply_text("👨‍🔧 Пример: /responsible электрика Петров Петр - +79997654321")
+        return
+    
+    await db.set_responsible(request_type, contact)
+    await ACCESS.reload()
+    logger.info("ответственный изменен", admin_id=update.effective_user.id, type=request_type)
+    await update.message.reply_text(f"✅ {request_type}: {contact}")
+
+async def show_request_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/history — заявки пользователя вместе с перенесенными в архив"""
+    await show_my_requests(update, context, None, None, include_archive=True, limit=20)
+
 async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает изменение статуса через inline кнопки"""
     query = update.callback_query
     
     try:
-        await query.answer()
-        
         user = query.from_user
-        if user.id not in ADMIN_IDS:
+        if not ACCESS.is_admin(user.id):
+            await query.answer()
             return
         
         data = query.data
-        print(f"🔔 Callback data: {data}")
+        logger.debug("callback", data=data, admin_id=user.id)
         
         if not data.startswith('status_'):
+            await query.answer()
             return
             
         parts = data.split('_')
         if len(parts) < 3:
+            await query.answer()
             return
         
         # Извлекаем request_id и status
@@ -336,31 +855,29 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
         try:
             request_id = int(request_id)
         except ValueError:
-            print(f"❌ Неверный request_id: {request_id}")
+            logger.warning("неверный request_id в callback", data=data)
+            await query.answer()
             return
         
-        if status not in ['in_progress', 'completed']:
-            print(f"❌ Неизвестный статус: {status}")
+        if status not in db.STATUS_TRANSITIONS:
+            logger.warning("неизвестный статус в callback", data=data)
+            await query.answer()
             return
         
-        print(f"🔔 Изменение статуса: заявка #{request_id}, статус: {status}")
-        
-        # Обновляем статус в базе
-        db.update_request_status(request_id, status)
-        
-        # Получаем информацию о заявке
-        request = db.get_request_by_id(request_id)
-        if not request:
-            print(f"❌ Заявка #{request_id} не найдена")
+        # Проверка перехода, смена статуса и уведомление автору в outbox — одна транзакция
+        request = await db.transition_request_status(request_id, status, notify_as=user.full_name)
+        if request is None:
+            # Другой админ успел раньше или заявка уже дальше этого статуса — автора повторно не уведомляем
+            logger.info("изменение статуса отклонено", request_id=request_id, status=status, admin_id=user.id)
+            await query.answer("⚠️ Статус заявки уже изменен", show_alert=True)
             return
         
-        # Формируем сообщение для админа
-        status_messages = {
-            'in_progress': f"🛠️ *Заявка #{request_id} взята в работу*\n\nИсполнитель: {user.full_name}",
-            'completed': f"✅ *Заявка #{request_id} выполнена*\n\nИсполнитель: {user.full_name}"
-        }
+        logger.info("изменение статуса", request_id=request_id, status=status, admin_id=user.id)
+        await query.answer()
+        schedule_escalation(sla_deadline(request['type'], status))
         
-        admin_message = status_messages.get(status, f"📋 *Заявка #{request_id}*\n\nСтатус обновлен")
+        # Формируем сообщение для админа
+        admin_message = ADMIN_STATUS_MESSAGES[status].format(request_id=request_id, admin_name=user.full_name)
         
         # СОЗДАЕМ НОВУЮ КЛАВИАТУРУ В ЗАВИСИМОСТИ ОТ ТЕКУЩЕГО СТАТУСА
         if status == 'in_progress':
@@ -403,20 +920,23 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
                 )
         
         # Уведомляем пользователя
-        await notify_user_about_status_change(request_id, status, user.full_name)
+        wake_outbox_worker()
+        # И обновляем копии этого уведомления у остальных админов
+        context.job_queue.run_once(timed_job(sync_notification_copies), 0,
+                                   data=(request_id, status, user.full_name, query.message.chat_id))
         
-    except Exception as e:
-        print(f"❌ Критическая ошибка: {e}")
+    except Exception:
+        logger.exception("ошибка изменения статуса", data=query.data)
 async def safe_edit_message(query, text):
     """Безопасно редактирует сообщение или отправляет новое"""
     try:
         await query.edit_message_text(text)
     except Exception as e:
-        print(f"DEBUG: Cannot edit message, sending new: {e}")
+        logger.debug("сообщение не отредактировано, отправляем новое", error=e)
         try:
             await query.message.reply_text(text)
         except Exception as e2:
-            print(f"DEBUG: Cannot send new message: {e2}")
+            logger.warning("не удалось отправить сообщение", error=e2)
 # === ОБРАБОТЧИКИ СООБЩЕНИЙ ===
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -424,265 +944,350 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     text = update.message.text
     
-    print(f"📨 Сообщение от {user.id}: '{text}'")  # КАВЫЧКИ ДЛЯ ОТЛАДКИ
-    
-    if chat_id not in USER_STATES:
-        USER_STATES[chat_id] = {'mode': 'user'}
+    logger.debug("сообщение", user_id=user.id, length=len(text))
     
-    user_state = USER_STATES[chat_id]
+    user_state = await USER_STATES.get(chat_id)
+    role = 'admin' if ACCESS.is_admin(user.id) else 'user'
+    stage = user_state.stage if user_state.creating_request else None
     
-    # Админские команды
-    if user.id in ADMIN_IDS:
-        if text == "📋 Все заявки":
-            await show_all_requests(update, context)
-            return
-        elif text == "🆕 Новые заявки":
-            await show_new_requests(update, context)
-            return
-        elif text == "🛠️ В работе":
-            await show_requests_in_progress(update, context)
-            return
-        elif text == "✅ Выполненные":
-            await show_completed_requests(update, context)
-            return
-        elif text == "📊 Статистика":
-            # ДОБАВИТЬ ФУНКЦИЮ СТАТИСТИКИ
-            await update.message.reply_text("📊 Статистика пока в разработке", reply_markup=kb.ADMIN_KEYBOARD)
-            return
-        elif text == "🔙 В главное меню":
-            user_state['mode'] = 'user'
-            await update.message.reply_text("Главное меню:", reply_markup=kb.MAIN_KEYBOARD)
-            return
-    
-    # Пользовательские команды
-    if text == "📝 Подать заявку":
-        user_state['creating_request'] = True
-        user_state['stage'] = 'type'
-        print(f"🔄 Пользователь {user.id} начал создание заявки")
-        await update.message.reply_text("Выберите тип проблемы:", reply_markup=kb.TYPE_KEYBOARD)
-    
-    elif text == "📊 Мои заявки":
-        try:
-            requests = db.get_user_requests(user.id)
-            if not requests:
-                await update.message.reply_text("У вас пока нет заявок.", reply_markup=kb.MAIN_KEYBOARD)
-                return
-            
-            message = "📊 Ваши заявки:\n\n"
-            
-            for request in requests[:5]:
-                status_emoji = {
-                    'new': '🆕',
-                    'in_progress': '🛠️', 
-                    'completed': '✅'
-                }.get(request[6], '📋')
-                
-                status_text = {
-                    'new': 'Принята',
-                    'in_progress': 'В работе', 
-                    'completed': 'Выполнена'
-                }.get(request[6], 'Неизвестен')
-                
-                message += f"📋 Заявка #{request[0]}\n"
-                message += f"Тип: {request[2]}\n"
-                message += f"Аудитория: {request[3]}\n"
-                message += f"Статус: {status_emoji} {status_text}\n"
-                message += f"Дата: {request[7]}\n\n"
-            
-            await update.message.reply_text(message, reply_markup=kb.MAIN_KEYBOARD)
-            
-        except Exception as e:
-            print(f"❌ Ошибка показа заявок: {e}")
-            await update.message.reply_text("Произошла ошибка при загрузке заявок.", reply_markup=kb.MAIN_KEYBOARD)
-    
-    elif text == "ℹ️ Помощь":
-        await update.message.reply_text(
-            "ℹ️ Помощь по боту\n\n1. Нажмите '📝 Подать заявку'\n2. Выберите тип проблемы\n3. Укажите аудиторию\n4. Опишите проблему\n\nСтатусы: 🆕 Принята, 🛠️ В работе, ✅ Выполнена",
-            reply_markup=kb.MAIN_KEYBOARD
-        )
-    
-    elif text == "📞 Контакты":
-        print("🔔 Нажата кнопка Контакты")  # ОТЛАДКА
-        try:
-            contacts_text = "📞 Контакты ответственных лиц:\n\n"
-            for problem_type, responsible in RESPONSIBLE_PERSONS.items():
-                contacts_text += f"• {problem_type}: {responsible}\n"
-            
-            await update.message.reply_text(contacts_text, reply_markup=kb.MAIN_KEYBOARD)
-            print("✅ Контакты отправлены")
-            
-        except Exception as e:
-            print(f"❌ Ошибка в контактах: {e}")
-            # ЗАПАСНОЙ ВАРИАНТ
-            contacts_text = """📞 Контакты ответственных лиц:
-
-• 🪑 Мебель: Иванов Иван - +79991234567
-• 💡 Электрика: Петров Петр - +79997654321  
-• 🚰 Сантехника: Сидоров Сидор - +79999876543
-• 🧹 Уборка: Кузнецова Мария - +79995554433
-• 🖥️ Техника: Смирнов Алексей - +79993332211
-• ❓ Другое: Дежурный - +79991112233"""
-            
-            await update.message.reply_text(contacts_text, reply_markup=kb.MAIN_KEYBOARD)
+    handler = router.resolve(role, stage, text)
+    await handler(update, context, user_state, text)
+
+@router.route("🔙 В главное меню", role='admin')
+async def back_to_user_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    user_state.mode = 'user'
+    await update.message.reply_text("Главное меню:", reply_markup=kb.MAIN_KEYBOARD)
+
+@router.route("ℹ️ Помощь")
+async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    await update.message.reply_text(
+        "ℹ️ Помощь по боту\n\n1. Нажмите '📝 Подать заявку'\n2. Выберите тип проблемы\n3. Укажите аудиторию\n4. Опишите проблему\n\nСтатусы: 🆕 Принята, 🛠️ В работе, ✅ Выполнена",
+        reply_markup=kb.MAIN_KEYBOARD
+    )
+
+@router.route("📞 Контакты")
+async def show_contacts(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    contacts_text = "📞 Контакты ответственных лиц:\n\n"
+    for problem_type, responsible in ACCESS.snapshot.responsible.items():
+        contacts_text += f"• {problem_type}: {responsible}\n"
     
-    elif text == "🔙 Назад":
-        if 'creating_request' in user_state:
-            user_state['creating_request'] = False
-        await update.message.reply_text("Главное меню:", reply_markup=kb.MAIN_KEYBOARD)
+    await update.message.reply_text(contacts_text, reply_markup=kb.MAIN_KEYBOARD)
+
+@router.route("🔙 Назад")
+async def cancel_request(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    user_state.creating_request = False
+    await update.message.reply_text("Главное меню:", reply_markup=kb.MAIN_KEYBOARD)
+
+async def show_navigation_hint(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    logger.debug("неизвестная команда", user_id=update.effective_user.id)
+    await update.message.reply_text("Используйте кнопки для навигации:", reply_markup=kb.MAIN_KEYBOARD)
+
+router.fallback = show_navigation_hint
+
+# === ДИАЛОГ СОЗДАНИЯ ЗАЯВКИ ===
+
+REQUEST_TYPES = ("🪑 Мебель", "💡 Электрика", "🚰 Сантехника", "🧹 Уборка", "🖥️ Техника", "❓ Другое")
+
+# Переходы: (этап, кнопка или ANY — любой текст) -> следующий этап; 'complete' — заявка готова
+CREATION_TRANSITIONS = {
+    **{('type', request_type): 'room' for request_type in REQUEST_TYPES},
+    ('room', ANY): 'description',
+    ('description', ANY): 'photo_choice',
+    ('photo_choice', "📷 Прикрепить фото"): 'photo',
+    ('photo_choice', "📋 Без фото"): 'complete',
+}
+
+# Какое поле черновика заполняет ответ на этапе
+CREATION_FIELDS = {'type': 'type', 'room': 'room', 'description': 'description'}
+
+# Вопрос при входе на этап
+STAGE_PROMPTS = {
+    'type': ("Выберите тип проблемы:", kb.TYPE_KEYBOARD),
+    'room': ("Укажите номер аудитории или кабинета:", kb.BACK_KEYBOARD),
+    'description': ("Опишите проблему подробно:", kb.BACK_KEYBOARD),
+    'photo_choice': ("📸 Хотите прикрепить фото к заявке?\n\nЭто поможет быстрее понять проблему.",
+                     kb.PHOTO_CHOICE_KEYBOARD),
+    'photo': (f"Отправьте фото проблемы (можно альбомом, до {MAX_REQUEST_PHOTOS} шт.):", kb.BACK_KEYBOARD),
+}
+
+# Ответ на текст, для которого на этапе нет перехода (фото принимает handle_photo)
+STAGE_HINTS = {
+    'type': ("Выберите тип проблемы кнопкой:", kb.TYPE_KEYBOARD),
+    'photo_choice': ("Пожалуйста, используйте кнопки:", kb.PHOTO_CHOICE_KEYBOARD),
+    'photo': ("Ожидаю фото...", kb.BACK_KEYBOARD),
+}
+
+async def normalize_room(text):
+    """Аудитория из реестра — под ее основным названием, новая — как написана.
+    None, если в ответе нет номера"""
+    if rooms.room_key(text) is None:
+        return None
+    room = await db.find_room(text)
+    return room['name'] if room else text.strip()
+
+# Приведение ответа на этапе к значению поля; None — ответ не принят
+CREATION_NORMALIZERS = {'room': normalize_room}
+
+# Ответ на непринятый нормализатором текст
+STAGE_ERRORS = {
+    'room': ("Не удалось распознать аудиторию. Укажите номер, например: 305 или ауд. 3-05", kb.BACK_KEYBOARD),
+}
+
+@router.route("📝 Подать заявку")
+async def begin_request(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    user_state.creating_request = True
+    user_state.stage = 'type'
+    logger.debug("начато создание заявки", user_id=update.effective_user.id)
+    prompt, keyboard = STAGE_PROMPTS['type']
+    await update.message.reply_text(prompt, reply_markup=keyboard)
+
+async def advance_request(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    """Шаг диалога по таблице CREATION_TRANSITIONS"""
+    stage = user_state.stage
+    next_stage = CREATION_TRANSITIONS.get((stage, text)) or CREATION_TRANSITIONS[(stage, ANY)]
+    logger.debug("создание заявки", user_id=update.effective_user.id, stage=stage)
     
-    elif user_state.get('creating_request'):
-        await handle_request_creation(update, context, user_state, text)
+    field = CREATION_FIELDS.get(stage)
+    if field:
+        normalize = CREATION_NORMALIZERS.get(stage)
+        value = await normalize(text) if normalize else text
+        if value is None:
+            prompt, keyboard = STAGE_ERRORS[stage]
+            await update.message.reply_text(prompt, reply_markup=keyboard)
+            return
+        setattr(user_state, field, value)
+    user_state.stage = next_stage
     
+    if next_stage == 'complete':
+        await complete_request_creation(update, context, user_state)
     else:
-        print(f"❌ Неизвестная команда: '{text}'")
-        await update.message.reply_text("Используйте кнопки для навигации:", reply_markup=kb.MAIN_KEYBOARD)
+        prompt, keyboard = STAGE_PROMPTS[next_stage]
+        await update.message.reply_text(prompt, reply_markup=keyboard)
 
-async def handle_request_creation(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: dict, text: str):
-    chat_id = update.effective_chat.id
-    user = update.effective_user
-    
-    print(f"🔄 Создание заявки, этап {user_state['stage']}: {text}")
-    
-    if user_state['stage'] == 'type':
-        if text in ["🪑 Мебель", "💡 Электрика", "🚰 Сантехника", "🧹 Уборка", "🖥️ Техника", "❓ Другое"]:
-            user_state['type'] = text
-            user_state['stage'] = 'room'
-            await update.message.reply_text("Укажите номер аудитории или кабинета:", reply_markup=kb.BACK_KEYBOARD)
-    
-    elif user_state['stage'] == 'room':
-        user_state['room'] = text
-        user_state['stage'] = 'description'
-        await update.message.reply_text("Опишите проблему подробно:", reply_markup=kb.BACK_KEYBOARD)
-    
-    elif user_state['stage'] == 'description':
-        user_state['description'] = text
-        user_state['stage'] = 'photo_choice'  # НОВЫЙ ЭТАП
-        await update.message.reply_text(
-            "📸 Хотите прикрепить фото к заявке?\n\n"
-            "Это поможет быстрее понять проблему.",
-            reply_markup=kb.PHOTO_CHOICE_KEYBOARD  # Создадим эту клавиатуру
-        )
-    
-    elif user_state['stage'] == 'photo_choice':
-        if text == "📷 Прикрепить фото":
-            user_state['stage'] = 'photo'
-            await update.message.reply_text(
-                "Отправьте фото проблемы:",
-                reply_markup=kb.BACK_KEYBOARD
-            )
-        elif text == "📋 Без фото":
-            user_state['stage'] = 'complete'
-            await complete_request_creation(update, context, user_state)
-        else:
-            await update.message.reply_text("Пожалуйста, используйте кнопки:", reply_markup=kb.PHOTO_CHOICE_KEYBOARD)
-    
-    elif user_state['stage'] == 'photo':
-        # Этот этап обрабатывается в handle_photo
-        await update.message.reply_text("Ожидаю фото...", reply_markup=kb.BACK_KEYBOARD)
+async def repeat_stage_hint(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState, text: str):
+    prompt, keyboard = STAGE_HINTS[user_state.stage]
+    await update.message.reply_text(prompt, reply_markup=keyboard)
 
-async def complete_request_creation(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: dict):
-    chat_id = update.effective_chat.id
+for stage, button in CREATION_TRANSITIONS:
+    router.add(advance_request, button, stage)
+for stage in STAGE_HINTS:
+    router.add(repeat_stage_hint, ANY, stage)
+
+async def complete_request_creation(update: Update, context: ContextTypes.DEFAULT_TYPE, user_state: ChatState,
+                                    photos=()):
     user = update.effective_user
     
-    print(f"✅ Завершение создания заявки пользователем {user.id}")
-    print(f"✅ Данные заявки: тип={user_state['type']}, аудитория={user_state['room']}, описание={user_state['description']}")
-    print(f"✅ Photo ID: {user_state.get('photo_id', 'Нет фото')}")
-    
-    db_user = db.get_user_by_telegram_id(user.id)
-    request_id = db.create_request(
-        user_id=db_user[0],
-        request_type=user_state['type'],
-        room=user_state['room'],
-        description=user_state['description'],
-        photo_id=user_state.get('photo_id')
+    # Пользователь мог не нажимать /start (например, после очистки базы) — тогда зарегистрируем
+    user_id = await IDENTITIES.ensure_user(user.id, user.full_name, user.username)
+    request_id, parent_id, status = await db.create_request(
+        user_id=user_id,
+        request_type=user_state.type,
+        room=user_state.room,
+        description=user_state.description,
+        photo_id=user_state.photo_id,
+        notify_ids=ACCESS.recipients(user_state.type),
+        photos=photos
     )
+    photo_count = len(photos) or int(bool(user_state.photo_id))
     
-    print(f"✅ Заявка #{request_id} создана в базе данных")
+    logger.info("заявка создана", request_id=request_id, user_id=user.id, type=user_state.type,
+                photos=photo_count, parent_id=parent_id)
     
     # Формируем сообщение для пользователя
     message = f"""
 ✅ *Заявка создана!*
 
 📋 *Номер:* #{request_id}
-🚪 *Аудитория:* {user_state['room']}
-🔧 *Тип:* {user_state['type']}
-📝 *Описание:* {user_state['description']}
-�� *Фото:* {'Прикреплено' if user_state.get('photo_id') else 'Нет'}
+🚪 *Аудитория:* {user_state.room}
+🔧 *Тип:* {user_state.type}
+📝 *Описание:* {user_state.description}
+�� *Фото:* {f'Прикреплено ({photo_count})' if photo_count else 'Нет'}
 
-*Статус:* 🆕 Принята
+*Статус:* {'🛠️ В работе' if status == 'in_progress' else '🆕 Принята'}
 Мы уведомим вас о ходе работ!
 
-👨‍🔧 *Ответственный:* {RESPONSIBLE_PERSONS.get(user_state['type'], 'Дежурный')}
+👨‍🔧 *Ответственный:* {ACCESS.responsible(user_state.type)}
     """
+    if parent_id:
+        # Дубль открытой заявки: админов не беспокоим, статус придет вместе с основной.
+        # Дубль получает статус основной, поэтому обещаем только то, что еще впереди
+        promise = ("ее уже взяли в работу, сообщим, когда она будет выполнена" if status == 'in_progress'
+                   else "сообщим, когда ее возьмут в работу")
+        message += (f"\n🔗 Такая же проблема в этой аудитории уже зарегистрирована (заявка #{parent_id}). "
+                    f"Ваша заявка присоединена к ней — {promise}.")
     
     await update.message.reply_text(message, reply_markup=kb.MAIN_KEYBOARD, parse_mode='Markdown')
     
-    # Отправляем уведомления администраторам
-    await notify_admins_about_new_request(
-        request_id=request_id,
-        request_type=user_state['type'],
-        room=user_state['room'],
-        description=user_state['description'],
-        user_name=user.full_name,
-        user_telegram_id=user.id,
-        photo_id=user_state.get('photo_id')
-    )
+    if not parent_id:
+        # Уведомления администраторам уже записаны в outbox вместе с заявкой
+        wake_outbox_worker()
+        schedule_escalation(sla_deadline(user_state.type, 'new'))
     
     # Сбрасываем состояние
-    USER_STATES[chat_id] = {'mode': USER_STATES[chat_id].get('mode', 'user')}
+    user_state.reset()
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    if chat_id in USER_STATES and USER_STATES[chat_id].get('creating_request'):
-        user_state = USER_STATES[chat_id]
-        
-        if user_state.get('stage') == 'photo':
-            photo = update.message.photo[-1]
-            user_state['photo_id'] = photo.file_id
-            user_state['stage'] = 'complete'
+    message = update.message
+    file_id = message.photo[-1].file_id
+    
+    # Следующее фото уже собираемого (или только что оформленного) альбома
+    album = albums.get(chat_id)
+    if message.media_group_id and album and album['group'] == message.media_group_id:
+        if not album['done'] and len(album['photos']) < MAX_REQUEST_PHOTOS:
+            album['photos'].append(file_id)
+        return
+    
+    user_state = await USER_STATES.get(chat_id)
+    if user_state.creating_request:
+        if user_state.stage == 'photo':
+            if message.media_group_id:
+                # Остальные фото альбома придут отдельными обновлениями — заявку оформит finish_album
+                albums[chat_id] = {'group': message.media_group_id, 'photos': [file_id], 'done': False}
+                context.job_queue.run_once(timed_job(finish_album), ALBUM_COLLECT_DELAY, chat_id=chat_id,
+                                           data=update)
+                return
+            albums.pop(chat_id, None)
+            user_state.photo_id = file_id
+            user_state.stage = 'complete'
             
-            print(f"✅ Фото добавлено к заявке пользователем {update.effective_user.id}")
-            await complete_request_creation(update, context, user_state)
+            logger.debug("фото добавлено к заявке", user_id=update.effective_user.id)
+            await complete_request_creation(update, context, user_state, [file_id])
         else:
             await update.message.reply_text("❌ Сейчас не время для отправки фото. Завершите создание заявки.")
     else:
         await update.message.reply_text("❌ Сначала начните создание заявки через '📝 Подать заявку'")
 
-def main():
+async def finish_album(context: ContextTypes.DEFAULT_TYPE):
+    """Создает заявку по собранному альбому; job.data — обновление с первым фото"""
+    chat_id = context.job.chat_id
+    album = albums.get(chat_id)
+    user_state = await USER_STATES.get(chat_id)
+    if album is None or album['done'] or not (user_state.creating_request and user_state.stage == 'photo'):
+        # Пока собирали альбом, пользователь отменил заявку
+        albums.pop(chat_id, None)
+        return
+    album['done'] = True
+    context.job_queue.run_once(forget_album, ALBUM_COLLECT_DELAY * 10, chat_id=chat_id, data=album['group'])
+    
+    user_state.photo_id = album['photos'][0]
+    user_state.stage = 'complete'
+    logger.debug("альбом добавлен к заявке", chat_id=chat_id, photos=len(album['photos']))
+    await complete_request_creation(context.job.data, context, user_state, album['photos'])
+
+async def forget_album(context: ContextTypes.DEFAULT_TYPE):
+    album = albums.get(context.job.chat_id)
+    if album and album['group'] == context.job.data:
+        del albums[context.job.chat_id]
+
+async def flush_states(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сохраняет измененные состояния диалогов в базу"""
+    saved = await USER_STATES.flush()
+    if saved:
+        usage = USER_STATES.memory_usage()
+        logger.debug("состояния сохранены", saved=saved, chats=usage['chats'],
+                     kb_per_1000_chats=usage['bytes_per_1000_chats'] // 1024)
+
+async def maintain_database(context: ContextTypes.DEFAULT_TYPE):
+    """Ночное обслуживание: переносит давно выполненные заявки в архив и чистит outbox пачками
+    (между пачками успевают пройти записи обработчиков), затем VACUUM/ANALYZE"""
+    archived = pruned = 0
+    while True:
+        moved = await db.archive_completed_requests(ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+    while True:
+        deleted = await db.prune_outbox(OUTBOX_RETENTION_DAYS, ARCHIVE_BATCH_SIZE)
+        pruned += deleted
+        if deleted < ARCHIVE_BATCH_SIZE:
+            break
+    free_pages = await db.run_maintenance()
+    logger.info("обслуживание базы", archived=archived, outbox_pruned=pruned, free_pages=free_pages)
+
+async def on_startup(app: Application):
+    global metrics_server
+    snapshot = await ACCESS.reload()
+    logger.info("роли загружены", admins=len(snapshot.admins), routed_types=len(snapshot.routes))
+    if metrics.ENABLED and BOT_MODE != 'webhook':
+        # В режиме webhook /metrics отдает сервер webhook, в polling — отдельный
+        metrics_server = metrics.start_server(METRICS_LISTEN, METRICS_PORT)
+        logger.info("метрики слушают", listen=METRICS_LISTEN, port=METRICS_PORT)
+
+async def on_shutdown(app: Application):
+    if metrics_server is not None:
+        metrics_server.stop()
+    await USER_STATES.flush()
+    # Недоставленные записи остаются в outbox и уйдут после перезапуска
+    deliveries = list(_chat_deliveries.values())
+    for task in deliveries:
+        task.cancel()
+    await asyncio.gather(*deliveries, return_exceptions=True)
+    # Закрытие ждет, пока поток базы доделает очередь; цикл событий при этом не блокируем
+    await asyncio.get_running_loop().run_in_executor(None, db.close_database)
+
+def build_application(token=BOT_TOKEN, mode=BOT_MODE, base_url=None, concurrent_updates=CONCURRENT_UPDATES):
+    """Собирает Application со всеми обработчиками и фоновыми задачами.
+    base_url — адрес другого Bot API (локальный сервер или замена для нагрузочных тестов)"""
     global application
-    db.init_database()
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(token).post_init(on_startup).post_shutdown(on_shutdown)
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(ChatOrderedProcessor(concurrent_updates))
+    if base_url:
+        builder = builder.base_url(f"{base_url.rstrip('/')}/bot").base_file_url(f"{base_url.rstrip('/')}/file/bot")
+    if mode == 'webhook':
+        # Обновления приходят на встроенный сервер, Updater с getUpdates не нужен
+        builder = builder.updater(None)
+    if metrics.ENABLED:
+        # Замер вызовов Bot API (кроме long-poll getUpdates, у которого свой запрос)
+        builder = builder.request(metrics.instrumented_request(connection_pool_size=256))
+    application = builder.build()
     
     # Обработчики команд
-    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("start", timed_handler(start)))
+    application.add_handler(CommandHandler("rebuild_stats", timed_handler(rebuild_statistics)))
+    application.add_handler(CommandHandler("metrics", timed_handler(show_metrics)))
+    application.add_handler(CommandHandler("history", timed_handler(show_request_history)))
+    application.add_handler(CommandHandler("find", timed_handler(find_requests)))
+    application.add_handler(CommandHandler("room", timed_handler(show_room)))
+    application.add_handler(CommandHandler("room_alias", timed_handler(alias_room)))
+    application.add_handler(CommandHandler("hotspots", timed_handler(show_hotspots)))
+    application.add_handler(CommandHandler("admins", timed_handler(show_access)))
+    application.add_handler(CommandHandler(["admin_add", "admin_remove"], timed_handler(change_admin)))
+    application.add_handler(CommandHandler("route", timed_handler(change_route)))
+    application.add_handler(CommandHandler("responsible", timed_handler(change_responsible)))
     
     # Обработчики inline кнопок
-    application.add_handler(CallbackQueryHandler(handle_status_change, pattern='^status_'))
+    application.add_handler(CallbackQueryHandler(timed_handler(handle_status_change), pattern='^status_'))
+    application.add_handler(CallbackQueryHandler(timed_handler(handle_page_navigation), pattern='^page:'))
+    application.add_handler(CallbackQueryHandler(timed_handler(handle_search_navigation), pattern='^find:'))
     
     # Обработчики сообщений (ВАЖНО: фото должно быть перед текстом!)
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.PHOTO, timed_handler(handle_photo)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(handle_message)))
     
-    print("=" * 50)
-    print("🤖 Бот запускается...")
-    print(f"🔑 Токен: {BOT_TOKEN[:10]}...")
-    print(f"👑 Главные администраторы: {ADMIN_IDS}")
-    print(f"🔔 Специальные уведомления: {SPECIAL_NOTIFICATIONS}")
-    print("=" * 50)
-    print("⏹️  Чтобы остановить бота, нажми Ctrl+C")
+    # Фоновая доставка уведомлений из outbox (подхватывает и то, что не ушло до перезапуска)
+    application.job_queue.run_repeating(timed_job(deliver_outbox), interval=OUTBOX_POLL_INTERVAL, first=0)
+    # Write-behind состояний диалогов: незавершенные заявки переживут перезапуск
+    application.job_queue.run_repeating(timed_job(flush_states), interval=STATE_FLUSH_INTERVAL)
+    # Архив и обслуживание базы — раз в сутки, в MAINTENANCE_TIME по местному времени
+    maintenance_time = datetime.time.fromisoformat(MAINTENANCE_TIME).replace(
+        tzinfo=datetime.datetime.now().astimezone().tzinfo)
+    application.job_queue.run_daily(timed_job(maintain_database), time=maintenance_time)
+    # Напоминания о просроченных заявках: первый проход при запуске, дальше — к ближайшему сроку
+    schedule_escalation(datetime.datetime.now(datetime.timezone.utc))
+    return application
+
+def main():
+    db.init_database()
+    build_application()
     
-    application.run_polling()
+    logger.info("бот запускается", mode=BOT_MODE)
+    
+    if BOT_MODE == 'webhook':
+        webhook.run(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET)
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
-
-
-
-
-
-
-
-
-
-
-
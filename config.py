@@ -1,8 +1,88 @@
 BOT_TOKEN = ""
 WORKER_CHAT_ID = None
 DATABASE_PATH = "data/database.db"
+# Админы, получатели уведомлений по типам (SPECIAL_NOTIFICATIONS) и ответственные
+# (RESPONSIBLE_PERSONS) хранятся в базе и меняются командами /admins, /admin_add, /route,
+# /responsible. Значения здесь переносятся в базу при ее создании; ADMIN_IDS, кроме того,
+# назначаются админами при запуске, если в базе не осталось ни одного
 ADMIN_IDS = []
 
+# Логирование: уровень и доля отладочных (DEBUG) событий, которые попадают в лог
+LOG_LEVEL = "INFO"
+LOG_DEBUG_SAMPLE_RATE = 0.1
+
+# Режим получения обновлений: "polling" (long-poll getUpdates) или "webhook"
+# (встроенный HTTP-сервер; WEBHOOK_URL — внешний адрес, на который Telegram шлет обновления,
+# обычно за nginx с TLS). Пустой WEBHOOK_SECRET — секрет генерируется при каждом запуске
+BOT_MODE = "polling"
+WEBHOOK_URL = ""
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "telegram"
+WEBHOOK_SECRET = ""
+
+# Outbox уведомлений: как часто фоновая задача проверяет очередь, сколько писем берет за раз
+# и сколько попыток делает, прежде чем сдаться
+OUTBOX_POLL_INTERVAL = 2
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+
+# Архив: выполненные больше ARCHIVE_AFTER_DAYS дней назад заявки переносятся в requests_archive
+# пачками по ARCHIVE_BATCH_SIZE (списки админов их больше не показывают, автору они видны в /history),
+# доставленные записи outbox удаляются через OUTBOX_RETENTION_DAYS дней. Обслуживание (архив,
+# VACUUM, ANALYZE) идет раз в сутки в MAINTENANCE_TIME по местному времени
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH_SIZE = 500
+OUTBOX_RETENTION_DAYS = 30
+MAINTENANCE_TIME = "04:00"
+
+# Состояния диалогов: сколько чатов держать в памяти, через сколько секунд простоя
+# забывать черновик заявки и как часто сбрасывать изменения в базу
+STATE_MAX_CHATS = 5000
+STATE_TTL = 7 * 24 * 3600
+STATE_FLUSH_INTERVAL = 5
+
+# Сколько обновлений обрабатывать одновременно (обновления одного чата — всегда по очереди);
+# 1 — строго по одному, как по умолчанию в python-telegram-bot
+CONCURRENT_UPDATES = 64
+
+# Групповой commit записей (заявки, статусы, пользователи): сколько секунд свободная база
+# ждет попутчиков для первой записи (0 — не ждать) и сколько записей максимум в одной транзакции
+WRITE_BATCH_WINDOW = 0
+WRITE_BATCH_MAX = 64
+
+# Сколько пользователей держать в кэше Telegram id -> users.id
+IDENTITY_CACHE_SIZE = 10000
+
+# Альбом приходит отдельным обновлением на каждое фото: сколько секунд ждать остальные
+# фото после первого и сколько фото максимум у одной заявки (предел sendMediaGroup — 10)
+ALBUM_COLLECT_DELAY = 1.0
+MAX_REQUEST_PHOTOS = 10
+
+# SLA: за сколько часов заявку типа должны взять в работу ('new') и выполнить ('in_progress').
+# Просроченная заявка — напоминание получателям из /route, еще через SLA_ESCALATION_HOURS — всем
+# админам. За один проход напоминания ставятся пачками по SLA_BATCH_SIZE заявок
+SLA_HOURS = {
+    "💡 Электрика": {'new': 1, 'in_progress': 8},
+    "🚰 Сантехника": {'new': 1, 'in_progress': 8},
+    "🖥️ Техника": {'new': 2, 'in_progress': 24},
+}
+SLA_DEFAULT_HOURS = {'new': 4, 'in_progress': 48}
+SLA_ESCALATION_HOURS = 2
+SLA_BATCH_SIZE = 100
+
+# Сколько заявок показывать на одной странице админских списков
+REQUESTS_PAGE_SIZE = 10
+
+# /find ранжирует по bm25 только столько самых новых совпадений
+SEARCH_CANDIDATES = 200
+
+# Встроенные метрики (гистограммы задержек обработчиков, базы и Bot API). В режиме webhook
+# /metrics отдается тем же сервером, в режиме polling — отдельным на METRICS_LISTEN:METRICS_PORT
+METRICS_ENABLED = False
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9108
+
 RESPONSIBLE_PERSONS = {
     "🪑 Мебель": "Иванов Иван - +79991234567",
     "💡 Электрика": "Петров Петр - +79997654321", 
@@ -1,150 +1,787 @@
-import sqlite3
+import asyncio
+import functools
+import json
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
-def init_database():
-    os.makedirs("data", exist_ok=True)
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            full_name TEXT NOT NULL,
-            username TEXT,
-            role TEXT DEFAULT 'user',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL,
-            room TEXT NOT NULL,
-            description TEXT NOT NULL,
-            photo_id TEXT,
-            status TEXT DEFAULT 'new',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            assigned_to INTEGER,
-            completed_at DATETIME,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+from config import DATABASE_PATH, WRITE_BATCH_WINDOW, WRITE_BATCH_MAX, SEARCH_CANDIDATES
+import log
+import metrics
+import stats
+from migrations import apply_migrations
+from rooms import display_name, is_room, room_key
+import sla
+
+# Одно долгоживущее соединение на весь процесс вместо connect/close на каждый вызов.
+# Все обращения к нему идут через единственный поток, поэтому цикл событий бота
+# не блокируется на диске, а само соединение не используется из двух потоков сразу.
+_connection = None
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+logger = log.get_logger('database')
+
+
+def _connect(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL: читатели не ждут писателя, а commit не делает fsync всего файла
+    # Место, освобожденное архивацией, возвращается incremental_vacuum в run_maintenance.
+    # На новой базе режим включается сразу, на старой — первым же обслуживанием
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = _connect(DATABASE_PATH)
+    return _connection
+
+
+def _threaded(func):
+    """Превращает синхронную функцию работы с базой в корутину,
+    которая выполняется в потоке базы данных с общим соединением"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor, lambda: func(_get_connection(), *args, **kwargs))
+    # Время считаем вместе с ожиданием потока базы: именно столько ждет обработчик
+    return metrics.timed('db_seconds', 'function', errors='db_errors_total')(wrapper)
+
+
+class _InBatch:
+    """Соединение для функции записи внутри общей транзакции группового commit.
+    `with conn:` в функции ничего не коммитит — границы задает SAVEPOINT пакета"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def _commit_batch(batch):
+    """Выполняет пакет записей одной транзакцией. Каждая запись — в своем SAVEPOINT,
+    так что ошибка одной откатывает только ее. Возвращает (ok, результат или исключение)"""
+    conn = _get_connection()
+    proxy = _InBatch(conn)
+    results = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for func, args, kwargs in batch:
+            conn.execute('SAVEPOINT batch_item')
+            try:
+                results.append((True, func(proxy, *args, **kwargs)))
+            except Exception as e:
+                conn.execute('ROLLBACK TO batch_item')
+                results.append((False, e))
+            conn.execute('RELEASE batch_item')
+        conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return results
+
+
+class _GroupCommit:
+    """Собирает одновременные записи и коммитит их пакетом.
+
+    Пока поток базы выполняет предыдущий пакет, новые записи копятся в очереди и
+    уходят следующим пакетом (не больше max_batch). Если база свободна, запись
+    уходит сразу после текущего шага цикла событий (или через window секунд,
+    если задано ожидание попутчиков), так что одиночный вызов почти не ждет,
+    а в пик одна транзакция с одним commit обслуживает десятки заявок."""
+
+    def __init__(self, window=0.0, max_batch=64):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._in_flight = False
+
+    def submit(self, func, args, kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, args, kwargs, future))
+        if not self._in_flight and self._timer is None:
+            if self.window:
+                self._timer = loop.call_later(self.window, self._flush)
+            else:
+                self._timer = loop.call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        self._timer = None
+        if self._in_flight or not self._pending:
+            return
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        self._in_flight = True
+        loop = asyncio.get_running_loop()
+        done = loop.run_in_executor(_executor, _commit_batch, [item[:3] for item in batch])
+        done.add_done_callback(lambda done: self._settle(batch, done))
+
+    def _settle(self, batch, done):
+        self._in_flight = False
+        if done.cancelled():
+            for *_, future in batch:
+                future.cancel()
+            return
+        error = done.exception()
+        results = done.result() if error is None else [(False, error)] * len(batch)
+        for (*_, future), (ok, value) in zip(batch, results):
+            if future.cancelled():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        logger.debug("групповой commit", writes=len(batch), failed=sum(not ok for ok, _ in results))
+        # Все, что пришло, пока пакет был в работе, — следующим пакетом
+        self._flush()
+
+
+_group_commit = _GroupCommit(window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_MAX)
+
+
+def _coalesced(func):
+    """Как _threaded, но для коротких записей: вызов попадает в пакет группового commit.
+    Функция пишется как обычно, с `with conn:` — вызванная напрямую, без пакета
+    (бенчмарки берут ее через inspect.unwrap), она сама открывает и коммитит транзакцию"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _group_commit.submit(func, args, kwargs)
+    return metrics.timed('db_seconds', 'function', errors='db_errors_total')(wrapper)
+
+
+def _on_db_thread(func):
+    """Выполняет func в потоке базы после всего, что уже стоит в его очереди, и ждет результата.
+    Для открытия и закрытия соединения: его, как и запросы, трогает только поток базы"""
+    return _executor.submit(func).result()
+
+
+def init_database(path=DATABASE_PATH):
+    """Открывает соединение и доводит схему до последней версии. Вызывается один раз при запуске"""
+    def open_connection():
+        global _connection
+        if _connection is not None:
+            _connection.close()
+        _connection = _connect(path)
+        return apply_migrations(_connection)
+
+    applied = _on_db_thread(open_connection)
+    if applied:
+        logger.info("применены миграции схемы", versions=applied)
+
+
+def close_database():
+    """Закрывает соединение (при остановке бота). Запросы и пакеты записей, уже отданные
+    потоку базы, сначала доделываются — commit не оборвется на середине"""
+    def close_connection():
+        global _connection
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+    _on_db_thread(close_connection)
+
+
+@_coalesced
+def add_user(conn, telegram_id, full_name, username=None, role='user'):
+    """Регистрирует пользователя, если его еще нет. Возвращает users.id"""
+    with conn:
+        conn.execute('INSERT OR IGNORE INTO users (telegram_id, full_name, username, role) VALUES (?, ?, ?, ?)',
+                     (telegram_id, full_name, username, role))
+        return conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()[0]
+
+def _room_id(conn, key):
+    """id аудитории по ключу. Незнакомая аудитория заводится в реестре, если похожа на номер,
+    под названием из ключа, а не под написанием первого пользователя ("ауд. 305" -> "305");
+    иначе None"""
+    row = conn.execute('SELECT room_id FROM room_aliases WHERE alias = ?', (key,)).fetchone()
+    if row:
+        return row[0]
+    if not is_room(key):
+        return None
+    room_id = conn.execute('INSERT INTO rooms (name) VALUES (?)', (display_name(key),)).lastrowid
+    conn.execute('INSERT INTO room_aliases (alias, room_id) VALUES (?, ?)', (key, room_id))
+    return room_id
+
+@_coalesced
+def create_request(conn, user_id, request_type, room, description, photo_id=None, notify_ids=(), photos=()):
+    """Создает заявку и в той же транзакции ставит в outbox уведомления для notify_ids.
+
+    photos — file_id всех фото по порядку (альбом); в requests.photo_id остается первое.
+
+    Аудитория привязывается к реестру (room_id), незнакомый номер — заводится в нем.
+    Текст, не похожий на номер ("у окна"), остается как есть, без room_id и без объединения.
+    Срок due_at считается по SLA типа (у дублей срока нет).
+    Если в той же аудитории уже открыта заявка того же типа, новая присоединяется
+    к ней (parent_id), получает ее статус и уведомлений админам не рассылает.
+    Возвращает (id заявки, id основной заявки или None, статус новой заявки)"""
+    key = room_key(room)
+    photos = list(photos) or ([photo_id] if photo_id else [])
+    photo_id = photos[0] if photos else None
+    with conn:
+        parent = room_id = None
+        if key is not None:
+            room_id = _room_id(conn, key)
+        if room_id is not None:
+            parent = conn.execute('''
+                SELECT id, status FROM requests
+                WHERE room_id = ? AND type = ? AND status IN ('new', 'in_progress') AND parent_id IS NULL
+                ORDER BY id LIMIT 1
+            ''', (room_id, request_type)).fetchone()
+        status = parent['status'] if parent else 'new'
+        due = None if parent else sla.modifier(sla.deadline_seconds(request_type, 'new'))
+        cursor = conn.execute('''
+            INSERT INTO requests (user_id, type, room, description, photo_id, status, room_key, parent_id, room_id,
+                                  due_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', ?))
+        ''', (user_id, request_type, room, description, photo_id, status, key, parent['id'] if parent else None,
+              room_id, due))
+        request_id = cursor.lastrowid
+        conn.executemany('INSERT INTO request_photos (request_id, position, file_id) VALUES (?, ?, ?)',
+                         [(request_id, position, file_id) for position, file_id in enumerate(photos)])
+        stats.record_created(conn, request_type)
+        if parent:
+            if status != 'new':
+                stats.record_status_change(conn, request_type, 'new', status)
+        else:
+            conn.executemany('INSERT INTO outbox (kind, request_id, chat_id) VALUES (?, ?, ?)',
+                             [('new_request', request_id, chat_id) for chat_id in notify_ids])
+    return request_id, parent['id'] if parent else None, status
+
+@_threaded
+def get_user_by_telegram_id(conn, telegram_id):
+    return conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+
+# Общие колонки requests и requests_archive в порядке таблицы requests
+REQUEST_COLUMNS = ('id, user_id, type, room, description, photo_id, status, created_at, assigned_to, completed_at, '
+                   'room_key, parent_id, room_id')
+
+@_threaded
+def get_user_requests(conn, telegram_id, include_archive=False):
+    """Заявки пользователя, новые сверху. include_archive=True — вместе с перенесенными в архив"""
+    user = conn.execute('SELECT id FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+    if user is None:
+        return []
+    if not include_archive:
+        return conn.execute(f'SELECT {REQUEST_COLUMNS} FROM requests WHERE user_id = ? ORDER BY created_at DESC',
+                            (user[0],)).fetchall()
+    return conn.execute(f'''
+        SELECT {REQUEST_COLUMNS} FROM requests WHERE user_id = ?
+        UNION ALL
+        SELECT {REQUEST_COLUMNS} FROM requests_archive WHERE user_id = ?
+        ORDER BY created_at DESC
+    ''', (user[0], user[0])).fetchall()
+
+# === ДОБАВЛЕННЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ СО СТАТУСАМИ ===
+
+# Разрешенные переходы: новый статус -> из каких статусов в него можно перейти.
+# Выполненная заявка обратно не открывается
+STATUS_TRANSITIONS = {
+    'in_progress': ('new',),
+    'completed': ('new', 'in_progress'),
+}
+
+_STATUS_SNAPSHOT_SQL = '''
+    SELECT id, type, status, (julianday(completed_at) - julianday(created_at)) * 86400 FROM requests
+    WHERE id = ? OR parent_id = ?
+'''
+
+def _after_status_change(conn, request_id, status, before, notify_as):
+    """Общая часть смены статуса: статистика по каждой измененной строке и уведомления
+    авторам в outbox. before — снимок _STATUS_SNAPSHOT_SQL до изменения"""
+    for row in conn.execute(_STATUS_SNAPSHOT_SQL, (request_id, request_id)).fetchall():
+        old = before[row[0]]
+        stats.record_status_change(
+            conn, old[1], old[2], row[2],
+            old_completion_seconds=old[3] if old[2] == 'completed' else None,
+            new_completion_seconds=row[3] if row[2] == 'completed' else None,
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def add_user(telegram_id, full_name, username=None, role='user'):
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO users (telegram_id, full_name, username, role) VALUES (?, ?, ?, ?)', 
-                   (telegram_id, full_name, username, role))
-    conn.commit()
-    conn.close()
-
-def create_request(user_id, request_type, room, description, photo_id=None):
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO requests (user_id, type, room, description, photo_id) VALUES (?, ?, ?, ?, ?)', 
-                   (user_id, request_type, room, description, photo_id))
-    request_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return request_id
-
-def get_user_by_telegram_id(telegram_id):
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def get_user_requests(telegram_id):
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('SELECT r.* FROM requests r JOIN users u ON r.user_id = u.id WHERE u.telegram_id = ? ORDER BY r.created_at DESC', (telegram_id,))
-    requests = cursor.fetchall()
-    conn.close()
-    return requests
-
-def get_request_by_id(request_id):
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT 
-            r.id, r.user_id, r.type, r.room, r.description, 
-            r.photo_id, r.status, r.created_at, r.assigned_to, r.completed_at,
-            u.telegram_id, u.full_name  -- ИЗМЕНИЛ ПОРЯДОК: сначала telegram_id, потом full_name
-        FROM requests r 
-        JOIN users u ON r.user_id = u.id 
-        WHERE r.id = ?
-    ''', (request_id,))
-    request = cursor.fetchone()
-    conn.close()
-    
-    # ДЛЯ ОТЛАДКИ
-    if request:
-        print(f"🔍 СТРУКТУРА ЗАЯВКИ #{request_id}:")
-        columns = [
-            "r.id", "r.user_id", "r.type", "r.room", "r.description", 
-            "r.photo_id", "r.status", "r.created_at", "r.assigned_to", "r.completed_at",
-            "u.telegram_id", "u.full_name"  # ТЕПЕРЬ telegram_id на [10], full_name на [11]
-        ]
-        for i, (col, value) in enumerate(zip(columns, request)):
-            print(f"  [{i}] {col}: {value}")
-    
+    if notify_as is not None:
+        payload = json.dumps({'status': status, 'admin_name': notify_as}, ensure_ascii=False)
+        conn.execute('''
+            INSERT INTO outbox (kind, request_id, chat_id, payload)
+            SELECT 'status_change', r.id, u.telegram_id, ?
+            FROM requests r JOIN users u ON r.user_id = u.id
+            WHERE r.id = ? OR r.parent_id = ?
+        ''', (payload, request_id, request_id))
+
+@_coalesced
+def transition_request_status(conn, request_id, status, notify_as=None):
+    """Переводит заявку и ее дубли в status, если это разрешено STATUS_TRANSITIONS.
+
+    Проверка текущего статуса и изменение — один UPDATE ... WHERE status IN (...) RETURNING,
+    поэтому из двух админов, нажавших кнопку одновременно, статус сменит только первый, и
+    автор получит одно уведомление. Возвращает строку заявки (колонки requests до
+    completed_at, затем telegram_id и full_name автора) или None, если переход не состоялся"""
+    allowed = STATUS_TRANSITIONS.get(status)
+    if allowed is None:
+        raise ValueError(f"неизвестный статус: {status}")
+    completed_at = 'CURRENT_TIMESTAMP' if status == 'completed' else 'completed_at'
+    placeholders = ', '.join('?' * len(allowed))
+    with conn:
+        before = {row[0]: row for row in conn.execute(_STATUS_SNAPSHOT_SQL, (request_id, request_id))}
+        # Срок отсчитывается заново: новый статус — новое SLA, напоминания тоже с начала
+        due = sla.modifier(sla.deadline_seconds(before[request_id][1], status)) if request_id in before else None
+        request = conn.execute(f'''
+            UPDATE requests SET status = ?, completed_at = {completed_at}, due_at = datetime('now', ?), escalation = 0
+            WHERE id = ? AND status IN ({placeholders})
+            RETURNING
+                id, user_id, type, room, description,
+                photo_id, status, created_at, assigned_to, completed_at,
+                (SELECT telegram_id FROM users WHERE users.id = requests.user_id) AS telegram_id,
+                (SELECT full_name FROM users WHERE users.id = requests.user_id) AS full_name
+        ''', (status, due, request_id, *allowed)).fetchone()
+        if request is None:
+            logger.debug("переход статуса отклонен", request_id=request_id, status=status,
+                         current=before[request_id][2] if request_id in before else None)
+            return None
+        # Дубли идут за основной заявкой; их статус не мог уйти вперед нее
+        conn.execute(f'''
+            UPDATE requests SET status = ?, completed_at = {completed_at}
+            WHERE parent_id = ? AND status IN ({placeholders})
+        ''', (status, request_id, *allowed))
+        _after_status_change(conn, request_id, status, before, notify_as)
+
+    logger.debug("статус заявки изменен", request_id=request_id, status=status, followers=max(len(before) - 1, 0))
     return request
-# === ДОБАВЛЕННЫЕ ФУНКЦИИ ДЛЯ РАБОТЫ СО СТАТУСАМИ ===
 
-def update_request_status(request_id, status):
-    """Обновляет статус заявки"""
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    
-    if status == 'completed':
-        cursor.execute('UPDATE requests SET status = ?, completed_at = CURRENT_TIMESTAMP WHERE id = ?', (status, request_id))
-    else:
-        cursor.execute('UPDATE requests SET status = ? WHERE id = ?', (status, request_id))
-    
-    conn.commit()
-    conn.close()
-    print(f"✅ Статус заявки #{request_id} изменен на: {status}")
-
-def get_all_requests(limit=50):
-    """Получает все заявки"""
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT 
-            r.id, r.user_id, r.type, r.room, r.description, 
-            r.photo_id, r.status, r.created_at, r.assigned_to, r.completed_at,
-            u.telegram_id, u.full_name  -- ТАКОЙ ЖЕ ПОРЯДОК КАК В get_request_by_id
-        FROM requests r 
-        JOIN users u ON r.user_id = u.id 
-        ORDER BY r.created_at DESC 
+@_threaded
+def get_requests_page(conn, status=None, cursor_id=None, direction='older', limit=10):
+    """Одна страница списка заявок, новые сверху, с ключом (created_at, id).
+
+    cursor_id — крайняя заявка уже показанной страницы: последняя при direction='older'
+    и первая при direction='newer'. Читается только страница (limit + 1 строка, чтобы
+    узнать, есть ли продолжение) и только нужные для списка колонки.
+    Возвращает (rows, has_newer, has_older)"""
+    # Дубли показываются счетчиком у основной заявки, а не отдельными строками
+    conditions = ['r.parent_id IS NULL']
+    params = []
+    if status is not None:
+        conditions.append('r.status = ?')
+        params.append(status)
+    if cursor_id is not None:
+        sign = '<' if direction == 'older' else '>'
+        conditions.append(f'(r.created_at, r.id) {sign} (SELECT created_at, id FROM requests WHERE id = ?)')
+        params.append(cursor_id)
+    where = f"WHERE {' AND '.join(conditions)}"
+    order = 'DESC' if direction == 'older' else 'ASC'
+
+    rows = conn.execute(f'''
+        SELECT r.id, r.type, r.room, substr(r.description, 1, 50) AS description,
+               r.status, r.created_at, u.full_name,
+               (SELECT COUNT(*) FROM requests f WHERE f.parent_id = r.id) AS followers
+        FROM requests r
+        JOIN users u ON r.user_id = u.id
+        {where}
+        ORDER BY r.created_at {order}, r.id {order}
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'older':
+        return rows, cursor_id is not None, has_more
+    rows.reverse()
+    return rows, has_more, True
+
+# === ПОИСК ===
+
+# Слова ищутся по началу из 6 или 4 символов: под эти длины у requests_fts есть префиксные
+# индексы, так что запрос читает один список вместо слияния всех слов с этим началом.
+# От слова отрезается хотя бы один символ, чтобы окончания не мешали — "проектора" найдет
+# "проектор", "бумага" — "бумагу"
+SEARCH_PREFIX_LENGTHS = (6, 4)
+
+def fts_query(text):
+    """Строка поиска -> запрос FTS5, в котором обязательны все слова.
+    Слово с цифрами ищется точно как написано или как номер аудитории (room_key) в колонке
+    room_key: "HP1020" находит модель в описании, "ауд.3-05" — аудиторию 305. Слова вроде
+    "ауд." и знаки без букв и цифр ("+", "—") отбрасываются: такая фраза ничего не находит,
+    а все слова обязательны. None, если искать нечего"""
+    terms = []
+    for word in text.split():
+        word = word.strip('.,;:!?()«»"\'')
+        key = room_key(word)
+        if key is None or not any(ch.isalnum() for ch in word):
+            continue
+        if any(ch.isdigit() for ch in word):
+            raw, key = word.replace('"', '""'), key.replace('"', '""')
+            terms.append(f'("{raw}" OR room_key : "{key}")')
+            continue
+        length = next((n for n in SEARCH_PREFIX_LENGTHS if len(word) > n), None)
+        term = word[:length].replace('"', '""')
+        terms.append(f'"{term}"*' if length else f'"{term}"')
+    return ' AND '.join(terms) or None
+
+@_threaded
+def search_requests(conn, text, offset=0, limit=10, candidates=SEARCH_CANDIDATES):
+    """Заявки по словам из описания, аудитории и типа. Возвращает (rows, has_more).
+
+    По bm25 ранжируются только candidates самых новых совпадений: bm25 считается для
+    каждой ранжируемой строки, и по частому слову ("проектор") полный рейтинг на миллионе
+    заявок стоил бы сотни миллисекунд. Остальные совпадения идут следом, от новых к
+    старым, так что листанием достижимо любое"""
+    match = fts_query(text)
+    if match is None:
+        return [], False
+    ranked = conn.execute('''
+        SELECT rowid, rank FROM requests_fts WHERE requests_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+    ''', (match, candidates)).fetchall()
+    ids = [row[0] for row in sorted(ranked, key=lambda row: (row[1], -row[0]))][offset:offset + limit + 1]
+    if len(ids) <= limit and len(ranked) == candidates:
+        ids += [row[0] for row in conn.execute('''
+            SELECT rowid FROM requests_fts WHERE requests_fts MATCH ? AND rowid < ?
+            ORDER BY rowid DESC LIMIT ? OFFSET ?
+        ''', (match, ranked[-1][0], limit + 1 - len(ids), max(0, offset - candidates)))]
+    if not ids:
+        return [], False
+    found = {row['id']: row for row in conn.execute(f'''
+        SELECT r.id, r.type, r.room, substr(r.description, 1, 50) AS description,
+               r.status, r.created_at, u.full_name
+        FROM requests r JOIN users u ON r.user_id = u.id
+        WHERE r.id IN ({', '.join('?' * len(ids))})
+    ''', ids)}
+    rows = [found[request_id] for request_id in ids if request_id in found]
+    return rows[:limit], len(ids) > limit
+
+# === АУДИТОРИИ ===
+
+@_threaded
+def find_room(conn, text):
+    """Аудитория из реестра по любому ее написанию: (id, name) или None"""
+    key = room_key(text)
+    if key is None:
+        return None
+    return conn.execute('''
+        SELECT r.id, r.name FROM room_aliases a JOIN rooms r ON r.id = a.room_id WHERE a.alias = ?
+    ''', (key,)).fetchone()
+
+@_threaded
+def add_room_alias(conn, room, alias):
+    """Добавляет аудитории room написание alias. Если alias уже означает другую аудиторию,
+    та сливается с room вместе со всеми написаниями и заявками; заявки, поданные под alias
+    свободным текстом, привязываются к room. У перенесенных заявок room_key меняется на ключ
+    названия room — в той же транзакции, так что поиск и объединение дублей сразу видят их
+    в новой аудитории. Возвращает имя аудитории или None, если room нет в реестре"""
+    key, alias_key = room_key(room), room_key(alias)
+    if key is None or alias_key is None:
+        return None
+    with conn:
+        target = conn.execute('SELECT room_id FROM room_aliases WHERE alias = ?', (key,)).fetchone()
+        if target is None:
+            return None
+        room_id = target[0]
+        name = conn.execute('SELECT name FROM rooms WHERE id = ?', (room_id,)).fetchone()[0]
+        other = conn.execute('SELECT room_id FROM room_aliases WHERE alias = ?', (alias_key,)).fetchone()
+        if other is None:
+            conn.execute('INSERT INTO room_aliases (alias, room_id) VALUES (?, ?)', (alias_key, room_id))
+            moved = ('room_id IS NULL AND room_key = ?', alias_key)
+        elif other[0] != room_id:
+            conn.execute('UPDATE room_aliases SET room_id = ? WHERE room_id = ?', (room_id, other[0]))
+            conn.execute('DELETE FROM rooms WHERE id = ?', (other[0],))
+            moved = ('room_id = ?', other[0])
+        else:
+            return name
+        # Обновление room_key переиндексирует строки в requests_fts (триггер requests_fts_update)
+        condition, value = moved
+        for table in ('requests', 'requests_archive'):
+            conn.execute(f'UPDATE {table} SET room_id = ?, room_key = ? WHERE {condition}',
+                         (room_id, room_key(name) or key, value))
+        return name
+
+@_threaded
+def get_room_history(conn, room_id, limit=10):
+    """Последние заявки аудитории, включая архив, новые сверху"""
+    return conn.execute(f'''
+        SELECT * FROM (
+            SELECT {REQUEST_COLUMNS} FROM requests WHERE room_id = ?
+            UNION ALL
+            SELECT {REQUEST_COLUMNS} FROM requests_archive WHERE room_id = ?
+        )
+        ORDER BY created_at DESC LIMIT ?
+    ''', (room_id, room_id, limit)).fetchall()
+
+@_threaded
+def get_hotspots(conn, days=30, limit=10):
+    """Проблемные аудитории. 'open' — [(name, открытых заявок)] по частичному индексу открытых
+    заявок; 'repeats' — [(name, type, случаев)]: одна и та же поломка, заново возникавшая
+    за days дней (считаются основные заявки, без присоединенных дублей)"""
+    open_rooms = conn.execute('''
+        SELECT r.name, o.count FROM (
+            SELECT room_id, COUNT(*) AS count FROM requests
+            WHERE status IN ('new', 'in_progress') AND room_id IS NOT NULL
+            GROUP BY room_id
+        ) o JOIN rooms r ON r.id = o.room_id
+        ORDER BY o.count DESC, r.name LIMIT ?
+    ''', (limit,)).fetchall()
+    repeats = conn.execute('''
+        SELECT r.name, i.type, i.count FROM (
+            SELECT room_id, type, COUNT(*) AS count FROM requests
+            WHERE created_at >= datetime('now', ?) AND parent_id IS NULL AND room_id IS NOT NULL
+            GROUP BY room_id, type HAVING COUNT(*) > 1
+        ) i JOIN rooms r ON r.id = i.room_id
+        ORDER BY i.count DESC, r.name LIMIT ?
+    ''', (f'-{int(days)} days', limit)).fetchall()
+    return {'open': [tuple(row) for row in open_rooms], 'repeats': [tuple(row) for row in repeats]}
+
+# === СТАТИСТИКА ===
+
+@_threaded
+def get_stats(conn, days=7):
+    """Готовые агрегаты для кнопки статистики: читает несколько десятков строк при любом объеме заявок"""
+    counts = conn.execute('SELECT type, status, count FROM stats_counts WHERE count != 0').fetchall()
+    daily = conn.execute("SELECT day, count FROM stats_daily WHERE day > date('now', 'localtime', ?) ORDER BY day",
+                         (f'-{days} days',)).fetchall()
+    histogram = conn.execute('SELECT bucket, count FROM stats_completion WHERE count > 0 ORDER BY bucket').fetchall()
+    return {'counts': counts, 'daily': daily, 'histogram': [tuple(row) for row in histogram]}
+
+@_threaded
+def rebuild_stats(conn):
+    """Пересчитывает статистику с нуля полным проходом по заявкам"""
+    with conn:
+        stats.rebuild(conn)
+
+# === OUTBOX УВЕДОМЛЕНИЙ ===
+
+@_threaded
+def get_due_outbox(conn, limit=50, busy_chats=()):
+    """Неотправленные уведомления, срок попытки которых наступил, вместе с данными заявки.
+    busy_chats — получатели, отправка которым еще идет: их записи ждут следующего прохода"""
+    busy = f"AND o.chat_id NOT IN ({', '.join('?' * len(busy_chats))})" if busy_chats else ''
+    rows = conn.execute(f'''
+        SELECT
+            o.id, o.kind, o.request_id, o.chat_id, o.payload, o.attempts,
+            r.type, r.room, r.description, r.photo_id, r.status, u.full_name, u.telegram_id
+        FROM outbox o
+        JOIN requests r ON o.request_id = r.id
+        JOIN users u ON r.user_id = u.id
+        WHERE o.status = 'pending' AND o.next_attempt_at <= CURRENT_TIMESTAMP {busy}
+        ORDER BY o.next_attempt_at, o.id
         LIMIT ?
-    ''', (limit,))
-    requests = cursor.fetchall()
-    conn.close()
-    return requests
-
-def get_requests_by_status(status):
-    """Получает заявки по статусу"""
-    conn = sqlite3.connect("data/database.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT r.*, u.full_name, u.telegram_id 
-        FROM requests r 
-        JOIN users u ON r.user_id = u.id 
-        WHERE r.status = ?
-        ORDER BY r.created_at DESC
-    ''', (status,))
-    requests = cursor.fetchall()
-    conn.close()
-    return requests
+    ''', (*busy_chats, limit)).fetchall()
+    rows = [dict(row, payload=json.loads(row['payload']) if row['payload'] else {}) for row in rows]
+    photos = _photos_by_request(conn, {row['request_id'] for row in rows if row['photo_id']})
+    for row in rows:
+        row['photos'] = photos.get(row['request_id'], [])
+    return rows
+
+def _photos_by_request(conn, request_ids):
+    """{id заявки: [file_id по порядку]} одним запросом"""
+    if not request_ids:
+        return {}
+    photos = {}
+    for row in conn.execute(f'''
+        SELECT request_id, file_id FROM request_photos
+        WHERE request_id IN ({', '.join('?' * len(request_ids))})
+        ORDER BY request_id, position
+    ''', tuple(request_ids)):
+        photos.setdefault(row['request_id'], []).append(row['file_id'])
+    return photos
+
+@_coalesced
+def finish_outbox(conn, results, messages=()):
+    """Записывает итоги попыток одной транзакцией (итоги отдельных отправок — групповым commit).
+    results — список (outbox_id, ok, error, retry_in): retry_in=None означает, что повторять не нужно;
+    messages — (request_id, chat_id, message_id, kind) доставленных админам уведомлений о заявке"""
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO notification_messages (request_id, chat_id, message_id, kind) VALUES (?, ?, ?, ?)
+        ''', messages)
+        for outbox_id, ok, error, retry_in in results:
+            if ok:
+                conn.execute("UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP, "
+                             "last_error = NULL WHERE id = ?", (outbox_id,))
+            elif retry_in is None:
+                conn.execute("UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                             (error, outbox_id))
+            else:
+                conn.execute("UPDATE outbox SET attempts = attempts + 1, last_error = ?, "
+                             "next_attempt_at = datetime('now', ?) WHERE id = ?",
+                             (error, f'+{int(retry_in)} seconds', outbox_id))
+
+@_threaded
+def get_notification_messages(conn, request_id, forget=False):
+    """Копии уведомления о заявке у админов: [(chat_id, message_id, kind)], kind — 'text' или 'photo'.
+    forget=True удаляет записи: после финального статуса копии больше не меняются"""
+    with conn:
+        rows = conn.execute('SELECT chat_id, message_id, kind FROM notification_messages WHERE request_id = ?',
+                            (request_id,)).fetchall()
+        if forget:
+            conn.execute('DELETE FROM notification_messages WHERE request_id = ?', (request_id,))
+    return [tuple(row) for row in rows]
+
+# === СРОКИ ЗАЯВОК (SLA) ===
+
+@_threaded
+def escalate_overdue_requests(conn, limit=100):
+    """Ставит в outbox напоминания о заявках, срок которых прошел, не больше limit за раз.
+
+    Первое напоминание (escalation 0 -> 1) получают получатели уведомлений о типе из
+    type_routes, и срок сдвигается на SLA_ESCALATION_HOURS; следующее (-> 2) — все админы,
+    после чего срока больше нет до смены статуса. Если у типа нет своих получателей,
+    сразу напоминают всем админам. Читает только просроченные строки по idx_requests_due.
+    Возвращает (сколько заявок обработано, ближайший оставшийся срок или None)"""
+    with conn:
+        rows = conn.execute('''
+            SELECT r.id, r.type, r.status, r.escalation,
+                   EXISTS (SELECT 1 FROM type_routes t WHERE t.type = r.type) AS routed
+            FROM requests r
+            WHERE r.due_at <= datetime('now')
+            ORDER BY r.due_at
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        for row in rows:
+            if row['escalation'] == 0 and row['routed']:
+                level, due = 1, sla.modifier(sla.escalation_seconds())
+                payload = json.dumps({'status': row['status'], 'level': level})
+                conn.execute('''
+                    INSERT INTO outbox (kind, request_id, chat_id, payload)
+                    SELECT 'sla_reminder', ?, chat_id, ? FROM type_routes WHERE type = ?
+                ''', (row['id'], payload, row['type']))
+            else:
+                level, due = 2, None
+                payload = json.dumps({'status': row['status'], 'level': level})
+                conn.execute('''
+                    INSERT INTO outbox (kind, request_id, chat_id, payload)
+                    SELECT 'sla_reminder', ?, telegram_id, ? FROM admins
+                ''', (row['id'], payload))
+            conn.execute("UPDATE requests SET escalation = ?, due_at = datetime('now', ?) WHERE id = ?",
+                         (level, due, row['id']))
+        next_due = conn.execute('SELECT MIN(due_at) FROM requests WHERE due_at IS NOT NULL').fetchone()[0]
+    if rows:
+        logger.debug("напоминания о просроченных заявках", count=len(rows))
+    return len(rows), next_due
+
+# === АРХИВ И ОБСЛУЖИВАНИЕ ===
+
+@_threaded
+def archive_completed_requests(conn, older_than_days, limit=500):
+    """Переносит до limit заявок, выполненных больше older_than_days дней назад, в requests_archive
+    одной транзакцией. Заявки с неотправленными уведомлениями ждут, пока outbox их не доставит.
+    Фото остаются в request_photos — они адресуются по id заявки. Возвращает число перенесенных"""
+    with conn:
+        ids = [row[0] for row in conn.execute('''
+            SELECT r.id FROM requests r
+            WHERE r.status = 'completed' AND r.completed_at < datetime('now', ?)
+              AND NOT EXISTS (SELECT 1 FROM outbox o WHERE o.request_id = r.id AND o.status = 'pending')
+            ORDER BY r.completed_at
+            LIMIT ?
+        ''', (f'-{int(older_than_days)} days', limit))]
+        if not ids:
+            return 0
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)')
+        conn.execute('DELETE FROM archive_batch')
+        conn.executemany('INSERT INTO archive_batch (id) VALUES (?)', ((id,) for id in ids))
+        conn.execute(f'''
+            INSERT OR REPLACE INTO requests_archive ({REQUEST_COLUMNS})
+            SELECT {REQUEST_COLUMNS} FROM requests WHERE id IN (SELECT id FROM archive_batch)
+        ''')
+        conn.execute('DELETE FROM outbox WHERE request_id IN (SELECT id FROM archive_batch)')
+        conn.execute('DELETE FROM notification_messages WHERE request_id IN (SELECT id FROM archive_batch)')
+        conn.execute('DELETE FROM requests WHERE id IN (SELECT id FROM archive_batch)')
+    logger.debug("заявки перенесены в архив", count=len(ids))
+    return len(ids)
+
+@_threaded
+def prune_outbox(conn, older_than_days, limit=1000):
+    """Удаляет до limit отправленных и окончательно не доставленных записей outbox старше
+    older_than_days дней. Возвращает число удаленных"""
+    with conn:
+        return conn.execute('''
+            DELETE FROM outbox WHERE id IN (
+                SELECT id FROM outbox WHERE status != 'pending' AND created_at < datetime('now', ?)
+                ORDER BY id LIMIT ?
+            )
+        ''', (f'-{int(older_than_days)} days', limit)).rowcount
+
+@_threaded
+def run_maintenance(conn):
+    """Возвращает свободные страницы файлу, обновляет статистику планировщика и
+    усекает WAL. Возвращает число освобожденных страниц"""
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # База создана до включения auto_vacuum: режим меняется только полным VACUUM, один раз
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+    # Выборочный ANALYZE: на больших таблицах читает не все строки
+    conn.execute('PRAGMA analysis_limit = 1000')
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return free_pages
+
+# === РОЛИ И МАРШРУТЫ ===
+
+@_threaded
+def load_access(conn, bootstrap_admins=()):
+    """Роли и маршруты целиком: ([telegram_id админов], [(type, chat_id)], [(type, contact)]).
+    Пока в базе нет ни одного админа, в нее записываются bootstrap_admins"""
+    if bootstrap_admins and conn.execute('SELECT 1 FROM admins LIMIT 1').fetchone() is None:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)',
+                             ((telegram_id,) for telegram_id in bootstrap_admins))
+    admins = [row[0] for row in conn.execute('SELECT telegram_id FROM admins')]
+    routes = [tuple(row) for row in conn.execute('SELECT type, chat_id FROM type_routes ORDER BY type, chat_id')]
+    responsible = [tuple(row) for row in conn.execute('SELECT type, contact FROM responsible_persons ORDER BY rowid')]
+    return admins, routes, responsible
+
+@_threaded
+def set_admin(conn, telegram_id, admin=True):
+    """Выдает (admin=True) или снимает права админа. Возвращает True, если что-то изменилось"""
+    with conn:
+        if admin:
+            return conn.execute('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)', (telegram_id,)).rowcount > 0
+        return conn.execute('DELETE FROM admins WHERE telegram_id = ?', (telegram_id,)).rowcount > 0
+
+@_threaded
+def set_route(conn, request_type, chat_ids):
+    """Заменяет получателей уведомлений о заявках типа; пустой chat_ids — снова всем админам"""
+    with conn:
+        conn.execute('DELETE FROM type_routes WHERE type = ?', (request_type,))
+        conn.executemany('INSERT OR IGNORE INTO type_routes (type, chat_id) VALUES (?, ?)',
+                         ((request_type, chat_id) for chat_id in chat_ids))
+
+@_threaded
+def set_responsible(conn, request_type, contact):
+    with conn:
+        conn.execute('''
+            INSERT INTO responsible_persons (type, contact) VALUES (?, ?)
+            ON CONFLICT (type) DO UPDATE SET contact = excluded.contact
+        ''', (request_type, contact))
 
+# === СОСТОЯНИЯ ДИАЛОГОВ ===
 
+@_threaded
+def load_chat_state(conn, chat_id):
+    return conn.execute('SELECT * FROM chat_states WHERE chat_id = ?', (chat_id,)).fetchone()
 
+@_threaded
+def save_chat_states(conn, rows, stale_before):
+    """Сохраняет состояния (chat_id, mode, creating_request, stage, type, room, description, photo_id, updated_at)
+    и удаляет те, что не обновлялись с момента stale_before"""
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO chat_states
+                (chat_id, mode, creating_request, stage, type, room, description, photo_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute('DELETE FROM chat_states WHERE updated_at < ?', (stale_before,))
@@ -0,0 +1,69 @@
+"""Кэш соответствия Telegram id -> users.id.
+
+Соответствие не меняется, пока пользователь существует, а в час пик заявки
+подают в основном уже знакомые пользователи. Поэтому /start для известного
+пользователя не ходит в базу вовсе, а создание заявки не делает отдельный
+SELECT ради users.id. Кэш — ограниченный LRU; запись сквозная: add_user сразу
+возвращает id, и он попадает в кэш.
+"""
+from collections import OrderedDict
+
+import database as db
+
+
+class IdentityCache:
+    def __init__(self, max_users=10000):
+        self.max_users = max_users
+        self._ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _remember(self, telegram_id, user_id):
+        self._ids[telegram_id] = user_id
+        self._ids.move_to_end(telegram_id)
+        while len(self._ids) > self.max_users:
+            self._ids.popitem(last=False)
+
+    def _cached(self, telegram_id):
+        user_id = self._ids.get(telegram_id)
+        if user_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._ids.move_to_end(telegram_id)
+        return user_id
+
+    async def ensure_user(self, telegram_id, full_name, username=None):
+        """users.id пользователя; при первой встрече регистрирует его в базе"""
+        user_id = self._cached(telegram_id)
+        if user_id is None:
+            user_id = await db.add_user(telegram_id=telegram_id, full_name=full_name, username=username)
+            self._remember(telegram_id, user_id)
+        return user_id
+
+    async def user_id(self, telegram_id):
+        """users.id или None, если пользователь не зарегистрирован"""
+        user_id = self._cached(telegram_id)
+        if user_id is None:
+            row = await db.get_user_by_telegram_id(telegram_id)
+            if row is None:
+                return None
+            user_id = row['id']
+            self._remember(telegram_id, user_id)
+        return user_id
+
+    def forget(self, telegram_id):
+        """Сброс записи, если пользователя удалили из базы"""
+        self._ids.pop(telegram_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._ids),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -32,10 +32,33 @@ PHOTO_CHOICE_KEYBOARD = ReplyKeyboardMarkup([
 ], resize_keyboard=True)
 
 # Inline клавиатуры для быстрого изменения статуса
-def get_status_keyboard(request_id):
+def get_status_keyboard(request_id, status='new'):
+    # Заявке в работе остается только "Выполнено"
+    if status == 'in_progress':
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Выполнено", callback_data=f"status_completed_{request_id}")]
+        ])
     return InlineKeyboardMarkup([
         [
             InlineKeyboardButton("🛠️ В работу", callback_data=f"status_in_progress_{request_id}"),
             InlineKeyboardButton("✅ Выполнено", callback_data=f"status_completed_{request_id}")
         ]
     ])
+
+# Кнопки листания списков заявок: ◀️ к более новым, ▶️ к более старым
+def get_page_keyboard(list_key, first_id, last_id, has_newer, has_older):
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"page:{list_key}:newer:{first_id}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"page:{list_key}:older:{last_id}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+# Кнопки листания результатов /find: offset — сколько результатов уже пропущено
+def get_search_keyboard(offset, page_size, has_more):
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"find:{max(0, offset - page_size)}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"find:{offset + page_size}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
@@ -0,0 +1,123 @@
+"""Структурированное логирование бота.
+
+Запись — короткое событие и поля ключ=значение:
+
+    2026-10-18 12:00:00,123 INFO bot: заявка создана request_id=42 type="💡 Электрика"
+
+Обработчики бота только кладут запись в очередь (QueueHandler), а форматирует
+и пишет в stdout отдельный поток (QueueListener), поэтому вывод не блокирует
+цикл событий. Отладочные события самые частые, поэтому из них в лог попадает
+лишь доля debug_sample_rate; события уровня INFO и выше не отбрасываются.
+
+В поля не кладем тексты пользователей (описания заявок, сообщения, имена) —
+только идентификаторы, длины и статусы.
+"""
+import atexit
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+_listener = None
+_debug_sample_rate = 1.0
+
+
+def _quote(value):
+    text = str(value)
+    if not text or any(ch in text for ch in ' ="'):
+        return '"' + text.replace('"', '\\"') + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        record.message = record.getMessage()
+        record.asctime = self.formatTime(record, self.datefmt)
+        line = self.formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={_quote(value)}' for key, value in fields.items())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в очередь почти как есть: строку собирает поток записи.
+    Трассировку исключения отрисовываем сразу, чтобы не держать в очереди стек с кадрами"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class StructLogger:
+    """Тонкая обертка над logging.Logger: logger.info("событие", request_id=1, status="new")"""
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, event, **fields):
+        if _debug_sample_rate < 1.0 and random.random() >= _debug_sample_rate:
+            return
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name):
+    return StructLogger(name)
+
+
+def setup(level='INFO', debug_sample_rate=1.0, stream=None):
+    """Переключает корневой логгер на очередь с фоновым потоком записи"""
+    global _listener, _debug_sample_rate
+    _debug_sample_rate = debug_sample_rate
+    shutdown()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(KeyValueFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(level)
+    # httpx пишет INFO на каждый запрос к Bot API — это поток шума, а не событий
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def shutdown():
+    """Дописывает остаток очереди и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,199 @@
+"""Встроенные метрики: гистограммы задержек и счетчики.
+
+Замеряются обработчики бота, функции database.py и запросы к Bot API; счетчики
+считают ошибки и итоги рассылок. Данные отдаются в текстовом формате Prometheus
+(/metrics на сервере webhook или на отдельном порту в режиме polling) и кратко —
+админской командой /metrics.
+
+При METRICS_ENABLED = False декораторы возвращают исходную функцию без обертки,
+а observe/inc сразу выходят, так что выключенные метрики ничего не стоят.
+"""
+import bisect
+import functools
+import time
+
+from config import METRICS_ENABLED
+
+ENABLED = METRICS_ENABLED
+
+# Границы корзин в секундах: от миллисекунды (SQLite) до десятков секунд (flood wait)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'handler_seconds': 'Время обработчика обновления',
+    'handler_errors_total': 'Исключения в обработчиках',
+    'db_seconds': 'Время вызова функции database.py, включая ожидание потока базы',
+    'db_errors_total': 'Исключения в функциях database.py',
+    'job_seconds': 'Время фоновой задачи',
+    'bot_api_seconds': 'Время запроса к Bot API',
+    'bot_api_responses_total': 'Ответы Bot API по HTTP-коду',
+    'notifications_total': 'Итоги отправки уведомлений',
+}
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKETS[index - 1] if index else 0.0
+                high = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+# (имя, метки) -> Histogram / число
+_histograms = {}
+_counters = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+    histogram.observe(seconds)
+
+
+def inc(name, amount=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + amount
+
+
+def timed(name, label, errors=None):
+    """Декоратор корутины: время выполнения в гистограмму name с меткой label=<имя функции>,
+    исключения — в счетчик errors"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        series = {label: func.__name__}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors:
+                    inc(errors, **series)
+                raise
+            finally:
+                observe(name, time.perf_counter() - started, **series)
+        return wrapper
+    return decorator
+
+
+def _labels_text(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in pairs) + '}'
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus 0.0.4"""
+    lines = []
+    described = set()
+
+    def describe(name, kind):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), histogram in sorted(_histograms.items()):
+        describe(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, '+Inf'), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels_text(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels_text(labels)} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{_labels_text(labels)} {histogram.count}')
+    for (name, labels), value in sorted(_counters.items()):
+        describe(name, 'counter')
+        lines.append(f'{name}{_labels_text(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary(limit=40):
+    """Короткая сводка для админа: самые загруженные серии с p50/p99 и счетчики"""
+    if not ENABLED:
+        return "📈 Метрики выключены (METRICS_ENABLED = False)"
+    rows = sorted(_histograms.items(), key=lambda item: -item[1].count)[:limit]
+    lines = ["📈 Метрики (вызовов · p50 · p99, мс)", ""]
+    for (name, labels), histogram in rows:
+        label = ','.join(str(value) for _, value in labels)
+        lines.append(f"{name}[{label}]: {histogram.count} · "
+                     f"{histogram.quantile(0.5) * 1000:.1f} · {histogram.quantile(0.99) * 1000:.1f}")
+    if _counters:
+        lines.append("")
+        for (name, labels), value in sorted(_counters.items()):
+            label = ','.join(str(value) for _, value in labels)
+            lines.append(f"{name}[{label}]: {value}")
+    return '\n'.join(lines)
+
+
+def prometheus_handler():
+    """Обработчик tornado для /metrics (tornado импортируется только при включенных метриках)"""
+    import tornado.web
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.finish(render_prometheus())
+
+    return MetricsHandler
+
+
+def start_server(listen, port):
+    """Отдельный HTTP-сервер с /metrics для режима polling (в текущем цикле событий)"""
+    import tornado.web
+    from tornado.httpserver import HTTPServer
+
+    server = HTTPServer(tornado.web.Application([('/metrics', prometheus_handler())]))
+    server.listen(port, address=listen)
+    return server
+
+
+def instrumented_request(**kwargs):
+    """HTTPXRequest, который замеряет каждый вызов метода Bot API"""
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedRequest(HTTPXRequest):
+        async def do_request(self, url, method, *args, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                status, payload = await super().do_request(url, method, *args, **kwargs)
+                return status, payload
+            finally:
+                observe('bot_api_seconds', time.perf_counter() - started, method=api_method)
+                inc('bot_api_responses_total', method=api_method, status=status)
+
+    return InstrumentedRequest(**kwargs)
@@ -0,0 +1,362 @@
+"""Версионированные миграции схемы базы данных.
+
+Каждая миграция — номер, описание и список шагов. Шаг — SQL-строка или функция,
+принимающая соединение. Применённые номера хранятся в таблице schema_version,
+поэтому при запуске выполняются только новые миграции, каждая в своей транзакции.
+Шаги пишутся идемпотентно (IF NOT EXISTS, проверка колонок), чтобы повторный прогон
+на уже изменённой вручную базе не падал.
+"""
+import sla
+import stats
+from config import ADMIN_IDS, SPECIAL_NOTIFICATIONS, RESPONSIBLE_PERSONS
+from rooms import display_name, is_room, room_key
+
+
+def add_column(table, column, declaration):
+    """Шаг миграции: ALTER TABLE ... ADD COLUMN, если такой колонки ещё нет"""
+    def step(conn):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    return step
+
+
+def backfill_room_keys(conn):
+    """Шаг миграции 7: ключ аудитории для уже существующих заявок"""
+    rows = conn.execute('SELECT id, room FROM requests WHERE room_key IS NULL').fetchall()
+    conn.executemany('UPDATE requests SET room_key = ? WHERE id = ?', [(room_key(room), id) for id, room in rows])
+
+
+def backfill_rooms(conn):
+    """Шаг миграции 12: реестр аудиторий из уже поданных заявок. Название аудитории
+    строится из ключа (rooms.display_name), как у заведенных ботом. Записи, не похожие
+    на номер, в реестр не попадают и остаются без room_id"""
+    keys = conn.execute('''
+        SELECT room_key FROM requests WHERE room_key IS NOT NULL
+        UNION SELECT room_key FROM requests_archive WHERE room_key IS NOT NULL
+    ''').fetchall()
+    for (key,) in keys:
+        if not is_room(key):
+            continue
+        room_id = conn.execute('INSERT INTO rooms (name) VALUES (?)', (display_name(key),)).lastrowid
+        conn.execute('INSERT INTO room_aliases (alias, room_id) VALUES (?, ?)', (key, room_id))
+    for table in ('requests', 'requests_archive'):
+        conn.execute(f'''
+            UPDATE {table} SET room_id = (SELECT room_id FROM room_aliases WHERE alias = {table}.room_key)
+            WHERE room_key IS NOT NULL
+        ''')
+
+
+def seed_access(conn):
+    """Шаг миграции 13: роли и маршруты, до сих пор заданные в config.py"""
+    conn.executemany('INSERT OR IGNORE INTO admins (telegram_id) VALUES (?)',
+                     ((telegram_id,) for telegram_id in ADMIN_IDS))
+    conn.executemany('INSERT OR IGNORE INTO type_routes (type, chat_id) VALUES (?, ?)',
+                     ((request_type, chat_id) for request_type, chat_ids in SPECIAL_NOTIFICATIONS.items()
+                      for chat_id in chat_ids))
+    conn.executemany('INSERT OR IGNORE INTO responsible_persons (type, contact) VALUES (?, ?)',
+                     RESPONSIBLE_PERSONS.items())
+
+
+def backfill_deadlines(conn):
+    """Шаг миграции 14: сроки уже открытых заявок. Отсчитываются от обновления, а не от
+    создания заявки — иначе давно открытые заявки разом засыпали бы админов напоминаниями"""
+    rows = conn.execute('''
+        SELECT DISTINCT type, status FROM requests WHERE status IN ('new', 'in_progress') AND parent_id IS NULL
+    ''').fetchall()
+    for request_type, status in rows:
+        conn.execute('''
+            UPDATE requests SET due_at = datetime('now', ?)
+            WHERE type = ? AND status = ? AND parent_id IS NULL
+        ''', (sla.modifier(sla.deadline_seconds(request_type, status)), request_type, status))
+
+
+MIGRATIONS = [
+    (1, 'Таблицы пользователей и заявок', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            username TEXT,
+            role TEXT DEFAULT 'user',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            room TEXT NOT NULL,
+            description TEXT NOT NULL,
+            photo_id TEXT,
+            status TEXT DEFAULT 'new',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            assigned_to INTEGER,
+            completed_at DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, 'Индексы для списков заявок по статусу и по пользователю', [
+        'CREATE INDEX IF NOT EXISTS idx_requests_status_created ON requests (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_requests_user_created ON requests (user_id, created_at)',
+        'ANALYZE',
+    ]),
+    (3, 'Outbox исходящих уведомлений', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            request_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME,
+            FOREIGN KEY (request_id) REFERENCES requests (id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (next_attempt_at) WHERE status = 'pending'",
+    ]),
+    (4, 'Сохраненные состояния диалогов', [
+        '''
+        CREATE TABLE IF NOT EXISTS chat_states (
+            chat_id INTEGER PRIMARY KEY,
+            mode TEXT NOT NULL DEFAULT 'user',
+            creating_request INTEGER NOT NULL DEFAULT 0,
+            stage TEXT,
+            type TEXT,
+            room TEXT,
+            description TEXT,
+            photo_id TEXT,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_chat_states_updated ON chat_states (updated_at)',
+    ]),
+    (5, 'Индекс для постраничного списка всех заявок', [
+        'CREATE INDEX IF NOT EXISTS idx_requests_created ON requests (created_at)',
+    ]),
+    (6, 'Инкрементальная статистика заявок', [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counts (
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (type, status)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stats_completion (
+            bucket INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        stats.rebuild,
+    ]),
+    (7, 'Объединение дублей: ключ аудитории и ссылка на основную заявку', [
+        add_column('requests', 'room_key', 'TEXT'),
+        add_column('requests', 'parent_id', 'INTEGER REFERENCES requests (id)'),
+        backfill_room_keys,
+        # Открытые основные заявки по аудитории и типу: здесь новая заявка ищет, к чему присоединиться
+        '''
+        CREATE INDEX IF NOT EXISTS idx_requests_open_incident ON requests (room_key, type)
+        WHERE status IN ('new', 'in_progress') AND parent_id IS NULL
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_requests_parent ON requests (parent_id) WHERE parent_id IS NOT NULL',
+    ]),
+    (8, 'Несколько фото у заявки', [
+        '''
+        CREATE TABLE IF NOT EXISTS request_photos (
+            request_id INTEGER NOT NULL REFERENCES requests (id),
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (request_id, position)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR IGNORE INTO request_photos (request_id, position, file_id)
+        SELECT id, 0, photo_id FROM requests WHERE photo_id IS NOT NULL
+        ''',
+    ]),
+    (9, 'Отправленные админам уведомления о заявках', [
+        '''
+        CREATE TABLE IF NOT EXISTS notification_messages (
+            request_id INTEGER NOT NULL REFERENCES requests (id),
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'text',
+            PRIMARY KEY (request_id, chat_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (10, 'Архив выполненных заявок', [
+        '''
+        CREATE TABLE IF NOT EXISTS requests_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            room TEXT NOT NULL,
+            description TEXT NOT NULL,
+            photo_id TEXT,
+            status TEXT,
+            created_at DATETIME,
+            assigned_to INTEGER,
+            completed_at DATETIME,
+            room_key TEXT,
+            parent_id INTEGER,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_requests_archive_user_created ON requests_archive (user_id, created_at)',
+        # Кандидаты в архив: выполненные, по дате выполнения
+        "CREATE INDEX IF NOT EXISTS idx_requests_completed_at ON requests (completed_at) WHERE status = 'completed'",
+    ]),
+    (11, 'Полнотекстовый поиск по заявкам', [
+        # Внешнее содержимое: индекс хранит только токены, текст читается из requests.
+        # Аудитория индексируется ключом room_key, чтобы "3-05" и "305" совпадали.
+        # Префиксные индексы на 4 и 6 символов — под них database.fts_query обрезает слова
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5 (
+            description, room_key, type,
+            content = 'requests', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '4 6'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS requests_fts_insert AFTER INSERT ON requests BEGIN
+            INSERT INTO requests_fts (rowid, description, room_key, type)
+            VALUES (new.id, new.description, new.room_key, new.type);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS requests_fts_delete AFTER DELETE ON requests BEGIN
+            INSERT INTO requests_fts (requests_fts, rowid, description, room_key, type)
+            VALUES ('delete', old.id, old.description, old.room_key, old.type);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS requests_fts_update AFTER UPDATE OF description, room_key, type ON requests BEGIN
+            INSERT INTO requests_fts (requests_fts, rowid, description, room_key, type)
+            VALUES ('delete', old.id, old.description, old.room_key, old.type);
+            INSERT INTO requests_fts (rowid, description, room_key, type)
+            VALUES (new.id, new.description, new.room_key, new.type);
+        END
+        ''',
+        "INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')",
+        # Вес колонок для ORDER BY rank: аудитория важнее описания, тип — меньше всего
+        "INSERT INTO requests_fts (requests_fts, rank) VALUES ('rank', 'bm25(1.0, 3.0, 0.5)')",
+    ]),
+    (12, 'Реестр аудиторий', [
+        '''
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Все написания аудитории, приведенные rooms.room_key, -> аудитория
+        '''
+        CREATE TABLE IF NOT EXISTS room_aliases (
+            alias TEXT PRIMARY KEY,
+            room_id INTEGER NOT NULL REFERENCES rooms (id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_room_aliases_room ON room_aliases (room_id)',
+        add_column('requests', 'room_id', 'INTEGER REFERENCES rooms (id)'),
+        add_column('requests_archive', 'room_id', 'INTEGER'),
+        backfill_rooms,
+        # История аудитории и открытые заявки по аудиториям читаются по индексам
+        'CREATE INDEX IF NOT EXISTS idx_requests_room_created ON requests (room_id, created_at)',
+        "CREATE INDEX IF NOT EXISTS idx_requests_room_open ON requests (room_id) WHERE status IN ('new', 'in_progress')",
+        'CREATE INDEX IF NOT EXISTS idx_requests_archive_room_created ON requests_archive (room_id, created_at)',
+        # Повторные поломки: основные заявки по аудитории и типу, отчет читает только индекс
+        '''
+        CREATE INDEX IF NOT EXISTS idx_requests_room_incidents ON requests (room_id, type, created_at)
+        WHERE parent_id IS NULL
+        ''',
+        # Дубли теперь ищутся по аудитории из реестра, а не по ключу
+        '''
+        CREATE INDEX IF NOT EXISTS idx_requests_open_incident_room ON requests (room_id, type)
+        WHERE status IN ('new', 'in_progress') AND parent_id IS NULL
+        ''',
+        'DROP INDEX IF EXISTS idx_requests_open_incident',
+    ]),
+    (13, 'Роли и маршрутизация заявок в базе', [
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            telegram_id INTEGER PRIMARY KEY,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Кому уведомлять о новых заявках типа (вместо всех админов)
+        '''
+        CREATE TABLE IF NOT EXISTS type_routes (
+            type TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            PRIMARY KEY (type, chat_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS responsible_persons (
+            type TEXT PRIMARY KEY,
+            contact TEXT NOT NULL
+        )
+        ''',
+        seed_access,
+    ]),
+    (14, 'Сроки заявок (SLA) и эскалация', [
+        add_column('requests', 'due_at', 'DATETIME'),
+        # 0 — напоминаний не было, 1 — напомнили получателям по типу, 2 — всем админам
+        add_column('requests', 'escalation', 'INTEGER NOT NULL DEFAULT 0'),
+        backfill_deadlines,
+        # Только заявки со сроком: ближайший срок — первая запись индекса
+        'CREATE INDEX IF NOT EXISTS idx_requests_due ON requests (due_at) WHERE due_at IS NOT NULL',
+    ]),
+]
+
+
+def current_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def apply_migrations(conn):
+    """Применяет по порядку все миграции новее текущей версии схемы.
+    Возвращает список применённых номеров"""
+    version = current_version(conn)
+    applied = []
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        conn.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (number, description))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(number)
+    return applied
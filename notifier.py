@@ -0,0 +1,116 @@
+"""Рассылка уведомлений с ограничением параллельности и скорости.
+
+Telegram допускает около 30 сообщений в секунду на бота и около одного сообщения
+в секунду в один чат; при превышении он отвечает RetryAfter (flood wait),
+а при повторных нарушениях блокирует бота надолго. Dispatcher отправляет
+сообщения всем получателям одновременно, но не больше max_concurrency запросов
+разом, проходя через общий и поканальный token bucket, и повторяет отправку
+после RetryAfter и сетевых ошибок.
+"""
+import asyncio
+import random
+import time
+from collections import namedtuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+
+# Итог отправки одному получателю: result — то, что вернул метод Bot API (Message и т.п.)
+Outcome = namedtuple('Outcome', ['chat_id', 'ok', 'result', 'error', 'attempts'])
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (после RetryAfter от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Dispatcher:
+    def __init__(self, max_concurrency=8, global_rate=25, per_chat_rate=1, max_attempts=4,
+                 backoff_base=0.5, max_chat_buckets=10000):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.max_chat_buckets = max_chat_buckets
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._chat_buckets = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                # Полные корзины ничем не отличаются от новых — их можно выбросить
+                for idle_id in [cid for cid, b in self._chat_buckets.items() if b.is_idle()]:
+                    del self._chat_buckets[idle_id]
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    async def send(self, chat_id, method, **kwargs):
+        """Вызывает method(chat_id=chat_id, **kwargs) с учетом лимитов и повторов"""
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                async with self._semaphore:
+                    result = await method(chat_id=chat_id, **kwargs)
+                metrics.inc('notifications_total', result='sent')
+                return Outcome(chat_id, True, result, None, attempt)
+            except RetryAfter as e:
+                error = e
+                metrics.inc('notifications_total', result='retry_after')
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+                # Flood wait действует на весь бот, поэтому притормаживаем всех
+                self.global_bucket.pause(delay)
+                await asyncio.sleep(delay)
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или запрос некорректен — повтор не поможет
+                metrics.inc('notifications_total', result='rejected')
+                return Outcome(chat_id, False, None, e, attempt)
+            except NetworkError as e:
+                error = e
+                metrics.inc('notifications_total', result='network_retry')
+                await asyncio.sleep(self.backoff_base * 2 ** (attempt - 1) * (1 + random.random()))
+            except Exception as e:
+                metrics.inc('notifications_total', result='failed')
+                return Outcome(chat_id, False, None, e, attempt)
+        metrics.inc('notifications_total', result='gave_up')
+        return Outcome(chat_id, False, None, error, self.max_attempts)
+
+    async def fan_out(self, chat_ids, method, **kwargs):
+        """Отправляет одно и то же всем chat_ids одновременно. Возвращает Outcome на каждого"""
+        return await asyncio.gather(*(self.send(chat_id, method, **kwargs) for chat_id in chat_ids))
@@ -0,0 +1,59 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+По умолчанию Application обрабатывает обновления строго по одному, и медленный
+обработчик (рассылка, запись в базу) задерживает всех пользователей. С
+ChatOrderedProcessor обновления разных чатов обрабатываются одновременно (не больше
+max_concurrent_updates), а обновления одного чата — по очереди и в порядке прихода,
+поэтому шаги создания заявки в USER_STATES не гоняются друг с другом.
+"""
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update):
+    """Ключ очереди: чат, а без чата — пользователь. None — порядок не важен"""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+    return None
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> [замок, сколько обновлений его держат или ждут]
+        self._chats = {}
+
+    async def do_process_update(self, update, coroutine):
+        # Вызывается из process_update базового класса уже под его семафором. Обновление,
+        # ждущее свой чат, занимает одно из max_concurrent_updates мест — зато лимит
+        # считает только BaseUpdateProcessor, а @final метод не переопределяется
+        key = chat_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock отдается ожидающим по очереди, а задачи на обновления Application
+            # создает в порядке прихода (семафор их порядок тоже сохраняет) — так сохраняется
+            # порядок в чате
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,37 @@
+"""Нормализация номера аудитории.
+
+Студенты пишут одну и ту же аудиторию по-разному: "Ауд. 3-01", "301", "каб 301".
+room_key сводит такие записи к одному ключу; по ключам (room_aliases) запись
+находится в реестре аудиторий. Сам заводится в реестре только ключ, похожий на номер
+(is_room): "у окна" или "не знаю" остаются свободным текстом.
+"""
+import re
+
+_PREFIX = re.compile(r'^(аудитория|ауд|кабинет|каб|комната|комн|room|aud)\b\.?\s*')
+_SEPARATORS = re.compile(r'[\s\-–—_.,/№#"\']+')
+# Латинские буквы, которые на телефоне легко набрать вместо кириллических: 301a -> 301а
+_LOOKALIKES = str.maketrans('aeopcxkmtb', 'аеорсхкмтв')
+# Номер с корпусом или крылом: "301", "301а", "б12", "2к301", "корпус2ауд301"
+_ROOM_NUMBER = re.compile(r'[а-я]{0,6}\d{1,5}(?:[а-я]{0,6}\d{1,5})?[а-я]{0,2}')
+# Граница между словом и номером, по которой ключ снова разбивается пробелами: буква
+# корпуса после номера ("301а") остается слитной
+_WORD_BOUNDARY = re.compile(r'(?<=[а-я])(?=\d)|(?<=\d)(?=[а-я]{2})')
+
+
+def room_key(room):
+    """Ключ аудитории или None, если из записи ничего не осталось"""
+    key = (room or '').strip().lower().replace('ё', 'е')
+    key = _PREFIX.sub('', key)
+    key = _SEPARATORS.sub('', key).translate(_LOOKALIKES)
+    return key or None
+
+
+def display_name(key):
+    """Название аудитории для реестра из ключа: корпус2ауд301 -> Корпус 2 ауд 301"""
+    name = _WORD_BOUNDARY.sub(' ', key)
+    return name[:1].upper() + name[1:]
+
+
+def is_room(key):
+    """Похож ли ключ room_key на номер аудитории"""
+    return key is not None and _ROOM_NUMBER.fullmatch(key) is not None
@@ -0,0 +1,44 @@
+"""Табличная маршрутизация текстовых сообщений.
+
+Маршрут — ключ (роль, этап, текст кнопки) в словаре; любая из частей может быть
+ANY. Раньше handle_message сравнивал текст с длинной цепочкой if/elif, и
+каждая новая кнопка удлиняла путь для всех сообщений. Здесь resolve делает не
+больше шести обращений к словарю при любом числе кнопок и этапов.
+
+Порядок поиска повторяет прежнюю цепочку: сначала кнопки роли, потом общие
+кнопки (они работают на любом этапе, например "🔙 Назад" посреди заявки),
+потом кнопки текущего этапа и, наконец, произвольный текст на этапе
+(аудитория, описание).
+"""
+ANY = None
+
+
+class Router:
+    def __init__(self, fallback=None):
+        self._routes = {}
+        self.fallback = fallback
+
+    def add(self, handler, text=ANY, stage=ANY, role=ANY):
+        key = (role, stage, text)
+        if key in self._routes:
+            raise ValueError(f"маршрут {key} уже занят обработчиком {self._routes[key].__name__}")
+        self._routes[key] = handler
+        return handler
+
+    def route(self, text=ANY, stage=ANY, role=ANY):
+        """Декоратор: @router.route("📝 Подать заявку")"""
+        def decorator(handler):
+            return self.add(handler, text, stage, role)
+        return decorator
+
+    def resolve(self, role, stage, text):
+        """Обработчик для сообщения text от роли role на этапе stage (None — вне диалога)"""
+        routes = self._routes
+        handler = routes.get((role, ANY, text)) or routes.get((ANY, ANY, text))
+        if handler is None and stage is not None:
+            handler = (routes.get((role, stage, text)) or routes.get((ANY, stage, text))
+                       or routes.get((role, stage, ANY)) or routes.get((ANY, stage, ANY)))
+        return handler or self.fallback
+
+    def __len__(self):
+        return len(self._routes)
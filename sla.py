@@ -0,0 +1,24 @@
+"""Сроки реакции на заявки (SLA).
+
+Открытую заявку должны взять в работу и выполнить за время, зависящее от типа
+(config.SLA_HOURS). Срок хранится в requests.due_at и пересчитывается при создании
+и каждой смене статуса; у выполненных заявок и присоединенных дублей срока нет.
+Просроченная заявка — напоминание получателям уведомлений о ее типе (/route), а если
+и через SLA_ESCALATION_HOURS она не сдвинулась — всем админам.
+"""
+from config import SLA_HOURS, SLA_DEFAULT_HOURS, SLA_ESCALATION_HOURS
+
+
+def deadline_seconds(request_type, status):
+    """Сколько секунд дается заявке типа request_type в статусе status; None — срока нет"""
+    hours = SLA_HOURS.get(request_type, SLA_DEFAULT_HOURS).get(status)
+    return hours * 3600 if hours else None
+
+
+def escalation_seconds():
+    return SLA_ESCALATION_HOURS * 3600
+
+
+def modifier(seconds):
+    """Модификатор для datetime('now', ?): срок через seconds секунд. None дает NULL — срока нет"""
+    return None if seconds is None else f'+{int(seconds)} seconds'
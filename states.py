@@ -0,0 +1,127 @@
+"""Состояния диалогов с пользователями.
+
+Раньше состояние чата было словарем строк в глобальном dict, который рос без
+ограничений и терялся при перезапуске. Здесь состояние — компактный объект
+со __slots__, хранилище держит в памяти не больше max_chats последних чатов
+(LRU), выбрасывает простаивающие дольше ttl секунд и периодически сбрасывает
+измененные состояния в SQLite (write-behind), откуда они поднимаются после
+перезапуска.
+"""
+import sys
+import time
+from collections import OrderedDict
+
+import database as db
+
+
+class ChatState:
+    __slots__ = ('chat_id', 'mode', 'creating_request', 'stage', 'type', 'room',
+                 'description', 'photo_id', 'touched')
+
+    def __init__(self, chat_id, mode='user'):
+        self.chat_id = chat_id
+        self.mode = mode
+        self.touched = time.time()
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает черновик заявки, сохраняя режим (user/admin)"""
+        self.creating_request = False
+        self.stage = None
+        self.type = None
+        self.room = None
+        self.description = None
+        self.photo_id = None
+
+    def to_row(self):
+        return (self.chat_id, self.mode, int(self.creating_request), self.stage, self.type,
+                self.room, self.description, self.photo_id, self.touched)
+
+    @classmethod
+    def from_row(cls, row):
+        state = cls(row['chat_id'], row['mode'])
+        state.creating_request = bool(row['creating_request'])
+        state.stage = row['stage']
+        state.type = row['type']
+        state.room = row['room']
+        state.description = row['description']
+        state.photo_id = row['photo_id']
+        state.touched = row['updated_at']
+        return state
+
+
+class StateStore:
+    def __init__(self, max_chats=5000, ttl=7 * 24 * 3600):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._states = OrderedDict()
+        # Измененные с последнего сброса; держим ссылки, даже если чат уже вытеснен из LRU
+        self._dirty = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def _remember(self, state):
+        self._states[state.chat_id] = state
+        self._states.move_to_end(state.chat_id)
+        while len(self._states) > self.max_chats:
+            self._states.popitem(last=False)
+
+    async def get(self, chat_id):
+        """Состояние чата для обработчика. Считается измененным и попадет в ближайший сброс"""
+        state = self._states.get(chat_id) or self._dirty.get(chat_id)
+        if state is None:
+            row = await db.load_chat_state(chat_id)
+            if row is not None and row['updated_at'] >= time.time() - self.ttl:
+                state = ChatState.from_row(row)
+            else:
+                state = ChatState(chat_id)
+        state.touched = time.time()
+        self._remember(state)
+        self._dirty[chat_id] = state
+        return state
+
+    async def reset(self, chat_id, mode=None):
+        """Начинает диалог заново: пустой черновик и, если задан, новый режим"""
+        state = await self.get(chat_id)
+        state.reset()
+        if mode is not None:
+            state.mode = mode
+        return state
+
+    def expire(self):
+        """Выбрасывает из памяти чаты, которые не писали дольше ttl"""
+        deadline = time.time() - self.ttl
+        while self._states:
+            state = next(iter(self._states.values()))
+            if state.touched >= deadline:
+                break
+            self._states.popitem(last=False)
+
+    async def flush(self):
+        """Сбрасывает измененные состояния в базу одной транзакцией"""
+        self.expire()
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await db.save_chat_states([state.to_row() for state in dirty.values()],
+                                      stale_before=time.time() - self.ttl)
+        except Exception:
+            # Не потеряем изменения: вернем их в очередь к следующему сбросу
+            dirty.update(self._dirty)
+            self._dirty = dirty
+            raise
+        return len(dirty)
+
+    def memory_usage(self):
+        """Приблизительный объем памяти состояний: всего и в пересчете на 1000 чатов"""
+        total = sys.getsizeof(self._states)
+        for state in self._states.values():
+            total += sys.getsizeof(state)
+            for name in ChatState.__slots__:
+                value = getattr(state, name)
+                if isinstance(value, str):
+                    total += sys.getsizeof(value)
+        per_thousand = total * 1000 // len(self._states) if self._states else 0
+        return {'chats': len(self._states), 'bytes': total, 'bytes_per_1000_chats': per_thousand}
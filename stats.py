@@ -0,0 +1,113 @@
+"""Статистика заявок, которая поддерживается инкрементально.
+
+Счетчики по (тип, статус), поступления по дням и гистограмма времени выполнения
+обновляются в той же транзакции, что и сама заявка, поэтому кнопка
+"📊 Статистика" читает несколько десятков строк, а не сканирует requests.
+
+Время выполнения хранится в логарифмических корзинах (как в DDSketch): корзина k
+покрывает интервал (GAMMA^(k-1), GAMMA^k] секунд, так что любой перцентиль
+оценивается с относительной ошибкой не больше (GAMMA - 1) / (GAMMA + 1) — около 2.5%,
+а размер гистограммы не зависит от числа заявок.
+"""
+import math
+
+GAMMA = 1.05
+_LOG_GAMMA = math.log(GAMMA)
+
+
+def bucket_for(seconds):
+    return max(0, math.ceil(math.log(max(seconds, 1.0)) / _LOG_GAMMA))
+
+
+def bucket_value(bucket):
+    """Представитель корзины с минимальной относительной ошибкой"""
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def percentile(histogram, q):
+    """Оценка q-перцентиля (0..1) по списку (корзина, количество), отсортированному по корзине"""
+    total = sum(count for _, count in histogram)
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for bucket, count in histogram:
+        seen += count
+        if seen > rank:
+            return bucket_value(bucket)
+    return bucket_value(histogram[-1][0])
+
+
+def format_duration(seconds):
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    return f"{max(minutes, 1)} мин"
+
+
+def _add_count(conn, request_type, status, delta):
+    conn.execute('''
+        INSERT INTO stats_counts (type, status, count) VALUES (?, ?, ?)
+        ON CONFLICT (type, status) DO UPDATE SET count = count + excluded.count
+    ''', (request_type, status, delta))
+
+
+def _add_completion(conn, seconds, delta):
+    conn.execute('''
+        INSERT INTO stats_completion (bucket, count) VALUES (?, ?)
+        ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count
+    ''', (bucket_for(seconds), delta))
+
+
+def record_created(conn, request_type):
+    """Вызывается в транзакции create_request"""
+    _add_count(conn, request_type, 'new', 1)
+    conn.execute('''
+        INSERT INTO stats_daily (day, count) VALUES (date('now', 'localtime'), 1)
+        ON CONFLICT (day) DO UPDATE SET count = count + 1
+    ''')
+
+
+def record_status_change(conn, request_type, old_status, new_status, old_completion_seconds=None,
+                         new_completion_seconds=None):
+    """Вызывается в транзакции смены статуса. Время выполнения передается,
+    если заявка была или стала выполненной"""
+    if old_status != new_status:
+        _add_count(conn, request_type, old_status, -1)
+        _add_count(conn, request_type, new_status, 1)
+    if old_completion_seconds is not None:
+        _add_completion(conn, old_completion_seconds, -1)
+    if new_completion_seconds is not None:
+        _add_completion(conn, new_completion_seconds, 1)
+
+
+def rebuild(conn):
+    """Пересчитывает все агрегаты по таблице requests (и архиву, если он уже есть) с нуля
+    внутри транзакции вызывающего"""
+    source = 'requests'
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'requests_archive'").fetchone():
+        columns = 'type, status, created_at, completed_at'
+        source = f'(SELECT {columns} FROM requests UNION ALL SELECT {columns} FROM requests_archive)'
+    conn.execute('DELETE FROM stats_counts')
+    conn.execute('DELETE FROM stats_daily')
+    conn.execute('DELETE FROM stats_completion')
+    conn.execute(f'''
+        INSERT INTO stats_counts (type, status, count)
+        SELECT type, COALESCE(status, 'new'), COUNT(*) FROM {source} GROUP BY type, COALESCE(status, 'new')
+    ''')
+    conn.execute(f'''
+        INSERT INTO stats_daily (day, count)
+        SELECT date(created_at, 'localtime'), COUNT(*) FROM {source} GROUP BY 1
+    ''')
+    histogram = {}
+    for (seconds,) in conn.execute(f'''
+        SELECT (julianday(completed_at) - julianday(created_at)) * 86400
+        FROM {source} WHERE status = 'completed' AND completed_at IS NOT NULL
+    '''):
+        bucket = bucket_for(seconds)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+    conn.executemany('INSERT INTO stats_completion (bucket, count) VALUES (?, ?)', histogram.items())
@@ -0,0 +1,119 @@
+"""Режим webhook: Telegram сам присылает обновления на встроенный HTTP-сервер.
+
+В отличие от run_polling здесь нет задержки на цикл long-poll: обновление попадает
+в очередь Application сразу после POST от Telegram. Сервер проверяет заголовок
+X-Telegram-Bot-Api-Secret-Token (если секрет не задан в конфиге, он генерируется
+при каждом запуске и передается Telegram в setWebhook) и отдает /healthz для
+балансировщика или мониторинга.
+
+Используется tornado — тот же сервер, что ставит python-telegram-bot[webhooks].
+"""
+import asyncio
+import hmac
+import json
+import secrets
+import signal
+import time
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+
+import log
+import metrics
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+logger = log.get_logger('webhook')
+
+
+class UpdateHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app, secret_token):
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+
+    async def post(self):
+        token = self.request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.set_status(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_app.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("некорректное обновление в webhook", error=e)
+            self.set_status(400)
+            return
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app, started):
+        self.bot_app = bot_app
+        self.started = started
+
+    def get(self):
+        running = self.bot_app.running
+        self.set_status(200 if running else 503)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({
+            'status': 'ok' if running else 'stopped',
+            'update_queue': self.bot_app.update_queue.qsize(),
+            'uptime_seconds': round(time.monotonic() - self.started),
+        }))
+
+
+def make_app(application, path, secret_token):
+    routes = [
+        (f'/{path.strip("/")}', UpdateHandler, {'bot_app': application, 'secret_token': secret_token}),
+        ('/healthz', HealthHandler, {'bot_app': application, 'started': time.monotonic()}),
+    ]
+    if metrics.ENABLED:
+        routes.append(('/metrics', metrics.prometheus_handler()))
+    return tornado.web.Application(routes)
+
+
+async def serve(application, listen, port, path, public_url=None, secret_token=None, stop_event=None):
+    """Полный жизненный цикл Application в режиме webhook (аналог run_polling).
+
+    Если задан public_url, регистрирует webhook в Telegram. stop_event позволяет
+    остановить сервер извне (в замерах); иначе сервер работает до SIGINT/SIGTERM"""
+    secret_token = secret_token or secrets.token_urlsafe(32)
+    stop_event = stop_event or asyncio.Event()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    if public_url:
+        await application.bot.set_webhook(
+            url=f"{public_url.rstrip('/')}/{path.strip('/')}",
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    await application.start()
+
+    server = HTTPServer(make_app(application, path, secret_token))
+    server.listen(port, address=listen)
+    logger.info("webhook слушает", listen=listen, port=port, path=path.strip('/'))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Не главный поток или платформа без сигналов в цикле событий
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run(application, listen, port, path, public_url, secret_token=None):
+    asyncio.run(serve(application, listen, port, path, public_url, secret_token))